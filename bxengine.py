@@ -32,6 +32,7 @@ Started from example code written by Sean J. McKiernan 'Mekire'
 * https://github.com/Mekire/pygame-samples/blob/master/drag_text.py
 """
 
+import asyncio
 import os
 import sys
 
@@ -79,6 +80,7 @@ except ImportError:
 
 from lib.app import App
 from lib.databasemanager import DatabaseManager
+from lib.eventmanager import EventManager
 from lib.logger import Logger
 from lib.resourcemanager import ResourceManager
 from lib.tickmanager import TickManager
@@ -113,15 +115,15 @@ def load_images(config: dict, resource: ResourceManager, log: Logger) -> dict:
         "lookgo"
     ]
 
-    # Load all images in the common/ folder into the loaded_images dict.
+    # Load all images in the common/ folder into the loaded_images dict. They are decoded in parallel.
     loaded_images = {}  # Dict mapping image names to PyGame Surfaces for loaded images.
     common_directory_contents = os.listdir("common/")
-    for common_file in common_directory_contents:
-        split_ext = os.path.splitext(common_file)
-        if split_ext[1] == ".png":
-            loaded_images[split_ext[0]] = resource.load_image("common/{0}".format(common_file),
-                                                              config["navigation"]["indicator_size"], rootdir=True,
-                                                              noexpire=True)
+    common_images = [common_file for common_file in common_directory_contents
+                     if os.path.splitext(common_file)[1] == ".png"]
+    decoded_images = resource.load_images(["common/{0}".format(common_file) for common_file in common_images],
+                                          config["navigation"]["indicator_size"], rootdir=True, noexpire=True)
+    for common_file in common_images:
+        loaded_images[os.path.splitext(common_file)[0]] = decoded_images["common/{0}".format(common_file)]
 
     # Make sure all of the required common images are present and loaded.
     # If not, give a warning and put a None in the loaded_images dict so we exit afterwards.
@@ -138,10 +140,6 @@ def load_images(config: dict, resource: ResourceManager, log: Logger) -> dict:
 def main() -> None:
     """Prepare our environment, create a display, and start the program.
     """
-    # Set the window to be centered and initialize PyGame.
-    os.environ['SDL_VIDEO_CENTERED'] = '1'
-    pygame.init()
-
     # Welcome message.
     print("Welcome to {0}.".format(VERSION))
 
@@ -159,9 +157,24 @@ def main() -> None:
     config = resource._load_initial_config("config.json")
     log = Logger("BXEngine")
 
+    # In headless mode, there is no window or sound, so use SDL's dummy drivers. Image decoding may also be skipped.
+    # Otherwise, set the window to be centered. Then initialize PyGame.
+    headless = config.get("headless", {}).get("enabled", False)
+    if headless:
+        log.info("Running headless.")
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+        resource.decode = config["headless"].get("decode_images", True)
+    else:
+        os.environ['SDL_VIDEO_CENTERED'] = '1'
+    pygame.init()
+
+    # Initialize the EventManager, which the other managers publish engine events through.
+    event = EventManager()
+
     # Open the primary database.
     log.info("Opening primary database...")
-    database = DatabaseManager(config)
+    database = DatabaseManager(config, event)
 
     # Load all images from the common folder.
     log.info("Loading common images...")
@@ -176,14 +189,21 @@ def main() -> None:
 
     # Set the default window caption, set window size, whether fullscreen, and get the window surface.
     pygame.display.set_caption(VERSION)
-    if config["window"]["fullscreen"]:
+    if config["window"]["fullscreen"] and not headless:
         pygame.display.set_mode(config["window"]["size"], pygame.FULLSCREEN)
     else:
         pygame.display.set_mode(config["window"]["size"])
     screen = pygame.display.get_surface()
 
     # Entry point to the main program.
-    App(screen, config, images, tick, resource, database)._main_loop()
+    # The asyncio and headless main loops are optional, and the regular main loop is the default.
+    app = App(screen, config, images, tick, resource, database, event)
+    if headless:
+        app._main_loop_headless()
+    elif config.get("asyncio"):
+        asyncio.run(app._main_loop_async())
+    else:
+        app._main_loop()
 
     # Shut down.
     log.info("Shutting down...")
@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+
+#######################
+# BXEngine            #
+# bxregistry.py       #
+# Copyright 2021-2023 #
+# Sei Satzparad       #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+"""
+Builds the packed room registry of a game world, or adds rooms to it.
+
+The engine uses the registry instead of the room descriptor files whenever it is present, so it should be built again,
+or the changed rooms added again, after editing room descriptors. Every room is checked against the room schema
+before it is packed, and rooms which fail are left out.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import jsonschema
+
+from lib import logger
+from lib.roomregistry import RoomRegistry, SHARD_COUNT
+from lib.util import normalize_path
+
+VERSION = "BXEngine Room Registry Builder"
+COPYRIGHT = "Copyright 2021-2023 Sei Satzparad"
+
+
+# Running as a standalone program.
+if __name__ == "__main__":
+    # Initialize the command line parser.
+    parser = argparse.ArgumentParser(description=VERSION,
+                                     formatter_class=lambda prog: argparse.HelpFormatter(prog,
+                                                                                         max_help_position=40))
+
+    # Setup command line options.
+    parser.add_argument("world", nargs='?', type=str, help="world directory to build for, default from config.json")
+    parser.add_argument("--shards", nargs=1, dest="shards", type=int, metavar="<n>",
+                        help="number of shard files to build, default {0}".format(SHARD_COUNT))
+    parser.add_argument("--add", nargs='+', dest="add", type=str, metavar="<room>",
+                        help="only add or replace these room files in the existing registry")
+    parser.add_argument("--verbose", action="store_true", dest="verbose", help="print every log message")
+    parser.add_argument("--version", action="store_true", dest="version", help="print the version string")
+
+    # Retrieve arguments.
+    args = parser.parse_args()
+
+    # --version
+    if args.version:
+        print(VERSION)
+        print(COPYRIGHT)
+        sys.exit(0)  # Exit here, this is all we're doing today.
+
+    # Default to the world named in the engine config.
+    world = args.world
+    if not world:
+        try:
+            with open("config.json") as f:
+                world = json.load(f)["world"]
+        except (OSError, ValueError, KeyError):
+            print("{0}: error: world directory required".format(os.path.basename(__file__)))
+            sys.exit(2)
+    if not os.path.isdir(world):
+        print("FAILURE :: OPEN :: {0}".format(world))
+        sys.exit(2)
+
+    logger.init("info" if args.verbose else "warn", suppressions=[])
+
+    # The world may replace the room schema with its own, just like in the engine.
+    schema_path = os.path.join(world, "schema", "room.json")
+    if not os.path.exists(schema_path):
+        schema_path = os.path.join("common", "schema", "room.json")
+    with open(schema_path) as f:
+        validator = jsonschema.Draft202012Validator(json.load(f))
+    failed = []
+
+    def check(filename: str, room: dict) -> bool:
+        """Check a room descriptor against the room schema before it is packed.
+
+        :param filename: The filename of the room descriptor.
+        :param room: The room descriptor.
+
+        :return: True if valid, False if not.
+        """
+        error = jsonschema.exceptions.best_match(validator.iter_errors(room))
+        if error:
+            print("FAILURE :: VALIDATE :: {0} :: {1}".format(filename, error.message))
+            failed.append(filename)
+            return False
+        return True
+
+    registry = RoomRegistry(world)
+
+    # --add: Append the given rooms to the existing registry.
+    if args.add:
+        if not registry.load():
+            print("FAILURE :: OPEN :: {0}".format(os.path.join(world, "rooms.ubj")))
+            sys.exit(3)
+        added = 0
+        for filename in args.add:
+            filename = normalize_path(os.path.relpath(filename, world) if os.path.isabs(filename) else filename)
+            try:
+                with open(os.path.join(world, filename)) as f:
+                    room = json.load(f)
+            except (OSError, ValueError):
+                print("FAILURE :: OPEN :: {0}".format(filename))
+                failed.append(filename)
+                continue
+            if check(filename, room):
+                registry.add(filename, room, save=False)
+                added += 1
+        if not registry.save():
+            sys.exit(4)
+        print("SUCCESS :: ADD :: {0} rooms".format(added))
+
+    # Build the whole registry from scratch.
+    else:
+        count = registry.build(args.shards[0] if args.shards else SHARD_COUNT, check)
+        print("SUCCESS :: BUILD :: {0} rooms in {1} shards".format(count, registry.shards))
+
+    # Finished.
+    registry.close()
+    sys.exit(1 if failed else 0)
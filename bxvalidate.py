@@ -0,0 +1,351 @@
+#! /usr/bin/env python
+
+#######################
+# BXEngine            #
+# bxvalidate.py       #
+# Copyright 2021-2023 #
+# Sei Satzparad       #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+"""
+Checks every room descriptor in a game world without starting the engine.
+
+Each room descriptor is checked against the room schema, every exit and action destination is resolved, and every
+image, music file and event script the rooms refer to is checked to exist and to load. The work is spread across a
+process pool, in two passes: first the room descriptors, then each distinct file they refer to, once. If the world
+has a packed room registry, room descriptors are read from it when they are in it, just like in the engine.
+"""
+
+import argparse
+import ast
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import jsonschema
+
+from lib import logger
+from lib.roomregistry import RoomRegistry
+from lib.util import normalize_path, room_files
+from lib.worldgraph import node_name, view_exits
+
+VERSION = "BXEngine World Validator"
+COPYRIGHT = "Copyright 2021-2023 Sei Satzparad"
+
+# How many files each worker process is handed at a time.
+CHUNK_SIZE = 64
+
+# Set up in each worker process by init_worker().
+_world_dir = None
+_registry = None
+_validator = None
+_decode = True
+
+
+def init_worker(world_dir: str, schema: dict, decode: bool) -> None:
+    """Prepare a worker process.
+
+    :param world_dir: The directory of the game world.
+    :param schema: The room descriptor JSON schema.
+    :param decode: Whether to load images and music, or only check that they exist.
+    """
+    global _world_dir, _registry, _validator, _decode
+    _world_dir = world_dir
+    _registry = RoomRegistry(world_dir)
+    _registry.load()
+    _validator = jsonschema.Draft202012Validator(schema)
+    _decode = decode
+
+    # Loading music needs the mixer, which must not try to open a real audio device.
+    if decode:
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+        import pygame
+        pygame.mixer.init()
+
+
+def check_room(filename: str) -> dict:
+    """Check one room descriptor, and collect everything it refers to.
+
+    :param filename: The filename of the room descriptor, relative to the world directory.
+
+    :return: A dict of the errors found, the names of the views, the exit destinations by where they are used, and
+             the images, music and scripts by where they are used.
+    """
+    result = {"file": filename, "errors": [], "views": [], "destinations": [], "images": [], "music": [],
+              "scripts": []}
+    if filename in _registry:
+        room = _registry.get(filename)
+        if room is None:
+            result["errors"].append((filename, "Unreadable room in registry."))
+            return result
+    else:
+        try:
+            with open(os.path.join(_world_dir, filename)) as f:
+                room = json.load(f)
+        except (OSError, ValueError) as e:
+            result["errors"].append((filename, "Invalid JSON: {0}".format(e)))
+            return result
+
+    # A file that isn't shaped like a room at all is some other kind of JSON file, and not our business.
+    if type(room) is not dict or not any(type(view) is dict and "image" in view for view in room.values()):
+        result["skipped"] = True
+        return result
+
+    for error in _validator.iter_errors(room):
+        result["errors"].append((filename, "Schema: {0}: {1}".format(
+            "/".join(str(part) for part in error.absolute_path), error.message)))
+
+    for view_name, view in room.items():
+        if type(view) is not dict:
+            continue
+        where = "{0}:{1}".format(filename, view_name)
+        result["views"].append(view_name)
+        if type(view.get("image")) is str:
+            result["images"].append((where, view["image"]))
+        if type(view.get("music")) is str:
+            result["music"].append((where, view["music"]))
+        for label, destinations, dynamic in view_exits(view):
+            for destination in destinations:
+                result["destinations"].append(("{0}: {1}".format(where, label), destination))
+        for index, action in enumerate(view.get("actions", [])):
+            for act_type in ["go", "look", "use"]:
+                if act_type in action and action[act_type].get("result") == "script":
+                    result["scripts"].append(("{0}: {1}#{2}".format(where, act_type, index),
+                                              action[act_type]["contents"]))
+    return result
+
+
+def resolve(filename: str) -> str:
+    """Work out the full path of a file referred to by a room, the same way the engine does.
+
+    :param filename: The filename, relative to the world directory, or to the common directory if it starts with
+                     "$COMMON$/".
+
+    :return: The full path.
+    """
+    filename = normalize_path(filename)
+    if filename.startswith("$COMMON$/"):
+        return "{0}/{1}".format("common", filename.split('/', 1)[1])
+    return "{0}/{1}".format(_world_dir, filename)
+
+
+def check_image(filename: str) -> str:
+    """Check that an image exists and decodes.
+
+    :param filename: The filename of the image.
+
+    :return: An error message, or an empty string if the image is fine.
+    """
+    path = resolve(filename)
+    if not os.path.isfile(path):
+        return "Missing image: {0}".format(filename)
+    if _decode:
+        import pygame
+        try:
+            pygame.image.load(path)
+        except pygame.error as e:
+            return "Image does not decode: {0}: {1}".format(filename, e)
+    return ""
+
+
+def check_music(filename: str) -> str:
+    """Check that a music file exists and can be opened for playing.
+
+    :param filename: The filename of the music.
+
+    :return: An error message, or an empty string if the music is fine.
+    """
+    path = resolve(filename)
+    if not os.path.isfile(path):
+        return "Missing music: {0}".format(filename)
+    if _decode:
+        import pygame
+        try:
+            pygame.mixer.music.load(path)
+            pygame.mixer.music.unload()
+        except pygame.error as e:
+            return "Music does not decode: {0}: {1}".format(filename, e)
+    return ""
+
+
+def check_script(filename: str, functions: list) -> str:
+    """Check that an event script exists, compiles, and defines the functions called from rooms.
+
+    :param filename: The filename of the script.
+    :param functions: The names of the functions called from rooms.
+
+    :return: An error message, or an empty string if the script is fine.
+    """
+    path = resolve(filename)
+    try:
+        with open(path) as f:
+            tree = ast.parse(f.read(), path)
+    except OSError:
+        return "Missing script: {0}".format(filename)
+    except SyntaxError as e:
+        return "Script does not compile: {0}: line {1}: {2}".format(filename, e.lineno, e.msg)
+    defined = {node.name for node in tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    missing = sorted(set(functions) - defined)
+    if missing:
+        return "Script does not define: {0}: {1}".format(filename, ", ".join(missing))
+    return ""
+
+
+def check_file(kind: str, filename: str, functions: list = None) -> str:
+    """Check one file referred to by the rooms.
+
+    :param kind: One of "image", "music" or "script".
+    :param filename: The filename.
+    :param functions: For scripts, the names of the functions called from rooms.
+
+    :return: An error message, or an empty string if the file is fine.
+    """
+    if kind == "image":
+        return check_image(filename)
+    elif kind == "music":
+        return check_music(filename)
+    return check_script(filename, functions)
+
+
+def validate(world_dir: str, jobs: int = None, decode: bool = True) -> list:
+    """Validate every room descriptor in a game world.
+
+    :param world_dir: The directory of the game world.
+    :param jobs: The number of worker processes, or None for one per CPU.
+    :param decode: Whether to load images and music, or only check that they exist.
+
+    :return: A list of (where, message) errors, sorted by where they were found.
+    """
+    # The world may replace the room schema with its own, just like in the engine.
+    schema_path = os.path.join(world_dir, "schema", "room.json")
+    if not os.path.exists(schema_path):
+        schema_path = os.path.join("common", "schema", "room.json")
+    with open(schema_path) as f:
+        schema = json.load(f)
+
+    # The room descriptors are the loose files and the rooms in the registry, if there is one.
+    registry = RoomRegistry(world_dir)
+    registry.load()
+    rooms = sorted(set(room_files(world_dir)) | set(registry))
+
+    errors = []
+    views = {}  # {room_file: [view_name, ...]}
+    destinations, references, scripts = [], {}, {}  # references = {(kind, filename): [where, ...]}
+    with ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(world_dir, schema, decode)) as pool:
+        # First pass: check each room descriptor, and find out what it refers to.
+        for result in pool.map(check_room, rooms, chunksize=CHUNK_SIZE):
+            if result.get("skipped"):
+                continue
+            errors += result["errors"]
+            views[result["file"]] = result["views"]
+            destinations += result["destinations"]
+            for kind in ["images", "music"]:
+                for where, filename in result[kind]:
+                    references.setdefault((kind.rstrip("s"), filename), []).append(where)
+            for where, contents in result["scripts"]:
+                if ":" not in contents:
+                    errors.append((where, "Malformed script result contents: {0}".format(contents)))
+                    continue
+                filename, function = contents.split(":", 1)
+                references.setdefault(("script", filename), []).append(where)
+                scripts.setdefault(filename, set()).add(function.split(",")[0])
+
+        # Second pass: check each file that was referred to, just once.
+        files = list(references)
+        for (kind, filename), message in zip(files, pool.map(
+                check_file, [kind for kind, filename in files], [filename for kind, filename in files],
+                [sorted(scripts.get(filename, [])) for kind, filename in files], chunksize=CHUNK_SIZE)):
+            if message:
+                errors += [(where, message) for where in references[(kind, filename)]]
+
+    # Resolve every exit destination against the rooms and views we found, including the first roomview.
+    # Rooms built by roomview generators only exist while the game is running, so they are left alone.
+    generators = []
+    try:
+        with open(os.path.join(world_dir, "world.json")) as f:
+            world = json.load(f)
+        destinations.append(("world.json: first_roomview", world["first_roomview"]))
+        generators = list(world.get("generators", {}))
+    except (OSError, ValueError, KeyError):
+        errors.append(("world.json", "Missing or invalid world descriptor."))
+    for where, destination in destinations:
+        if any(destination.startswith(prefix) for prefix in generators):
+            continue
+        room_file, view_name = node_name(destination).split(":", 1)
+        if room_file not in views:
+            errors.append((where, "Exit to nonexistent room: {0}".format(destination)))
+        elif view_name not in views[room_file]:
+            errors.append((where, "Exit to nonexistent view: {0}".format(destination)))
+    return sorted(errors)
+
+
+# Running as a standalone program.
+if __name__ == "__main__":
+    # Initialize the command line parser.
+    parser = argparse.ArgumentParser(description=VERSION,
+                                     formatter_class=lambda prog: argparse.HelpFormatter(prog,
+                                                                                         max_help_position=40))
+
+    # Setup command line options.
+    parser.add_argument("world", nargs='?', type=str, help="world directory to validate, default from config.json")
+    parser.add_argument("--jobs", nargs=1, dest="jobs", type=int, metavar="<n>",
+                        help="number of worker processes, default one per cpu")
+    parser.add_argument("--no-decode", action="store_true", dest="no_decode",
+                        help="only check that images and music exist, without loading them")
+    parser.add_argument("--quiet", action="store_true", dest="quiet", help="do not print failure messages")
+    parser.add_argument("--version", action="store_true", dest="version", help="print the version string")
+
+    # Retrieve arguments.
+    args = parser.parse_args()
+
+    # --version
+    if args.version:
+        print(VERSION)
+        print(COPYRIGHT)
+        sys.exit(0)  # Exit here, this is all we're doing today.
+
+    # Default to the world named in the engine config.
+    world = args.world
+    if not world:
+        try:
+            with open("config.json") as f:
+                world = json.load(f)["world"]
+        except (OSError, ValueError, KeyError):
+            print("{0}: error: world directory required".format(os.path.basename(__file__)))
+            sys.exit(2)
+    if not os.path.isdir(world):
+        print("FAILURE :: OPEN :: {0}".format(world))
+        sys.exit(2)
+
+    # The room registry logs through the engine's logger, which worker processes inherit.
+    logger.init("critical" if args.quiet else "error", suppressions=[])
+
+    # Validate, and report each problem on its own line.
+    found = validate(world, args.jobs[0] if args.jobs else None, not args.no_decode)
+    if not args.quiet:
+        for where, message in found:
+            print("FAILURE :: {0} :: {1}".format(where, message))
+
+    # Finished.
+    sys.exit(1 if found else 0)
@@ -46,13 +46,14 @@ class APIContext(object):
     :ivar audio: The AudioManager instance.
     :ivar cursor: The Cursor instance.
     :ivar database: The DatabaseManager instance.
+    :ivar event: The EventManager instance.
+    :ivar input: The InputManager instance.
     :ivar log: The Logger instance for this script.
     :ivar overlay: The OverlayManager instance.
     :ivar resource: The ResourceManager instance.
     :ivar script: The ScriptManager instance.
     :ivar tick: The TickManager instance.
     :ivar ui: The UI instance.
-    :ivar world: The World instance.
     :ivar vars: The vars variable from the main App, used to share variables between event scripts.
     :ivar path: The relative path to this script, from the engine's base directory.
     :ivar dir: The directory this script is in.
@@ -69,17 +70,24 @@ class APIContext(object):
         self.audio = self.app.audio
         self.cursor = self.app.cursor
         self.database = self.app.database
+        self.event = self.app.event
+        self.input = self.app.input
         self.log = Logger(filename)
         self.overlay = self.app.overlay
         self.resource = self.app.resource
         self.script = self.app.script
         self.tick = self.app.tick
         self.ui = self.app.ui
-        self.world = self.app.world
         self.vars = self.app.vars
-        self.path = os.path.join(self.world.dir, self.filename)
+        self.path = os.path.join(self.script.world.dir, self.filename)
         self.dir = os.path.dirname(self.path)
 
+    @property
+    def world(self):
+        """The current World instance, which changes when the App switches worlds.
+        """
+        return self.app.world
+
     def __contains__(self, item: str) -> bool:
         return item in self.vars
 
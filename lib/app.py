@@ -25,18 +25,25 @@
 # IN THE SOFTWARE.
 # **********
 
+import asyncio
+import inspect
+import os
 import pdb
 import sys
+import time
+from typing import Optional
 
 import pygame
 
 from lib.audiomanager import AudioManager
 from lib.cursor import Cursor
-from lib.logger import Logger
+from lib.inputmanager import InputManager
+from lib.logger import flush, Logger
 from lib.overlaymanager import OverlayManager
 from lib.scriptmanager import ScriptManager
 from lib.tickmanager import TickManager
 from lib.uimanager import UIManager
+from lib.util import normalize_path
 from lib.world import World
 
 
@@ -44,29 +51,34 @@ class App(object):
     """This class manages our event processing, game loop, and overall program flow.
 
     It is, for all intents and purposes, the base class. It contains a path to all other class instances.
-    This class has no methods that are useful or available to event scripts.
+    The only methods useful to event scripts are load_world() and switch_world(), for games made of several worlds,
+    and act(), for driving the game from a script in headless mode.
 
     :ivar screen: The PyGame screen surface.
     :ivar clock: The PyGame Clock instance used for timing.
     :ivar fps: The base FPS of the engine. Currently hardcoded.
     :ivar done: If this becomes True, the engine will exit.
+    :ivar headless: Whether the engine is running without a display or sound, for testing and simulation.
     :ivar keys: This always contains whichever keys are being pressed at the moment.
     :ivar cursor: The Cursor instance.
     :ivar config: This contains the engine's configuration variables.
     :ivar images: This is a dict containing all of the common required images.
     :ivar audio: The AudioManager instance.
     :ivar ui: The UIManager instance.
+    :ivar input: The InputManager instance.
     :ivar tick: The TickManager instance.
     :ivar resource: The ResourceManager instance.
     :ivar database: The DatabaseManager instance.
+    :ivar event: The EventManager instance.
     :ivar vars: A storage space for variables to be shared between event scripts.
     :ivar log: The Logger instance for this class.
     :ivar world: The World instance for the currently loaded world.
+    :ivar worlds: A dict of every loaded World instance, by world directory.
     :ivar overlay: The OverlayManager instance.
     :ivar script: The ScriptManager instance.
     """
 
-    def __init__(self, screen, config, images, tick, resource, database):
+    def __init__(self, screen, config, images, tick, resource, database, event):
         """App Class Initializer
 
         :param screen: The PyGame screen surface.
@@ -75,142 +87,271 @@ class App(object):
         :param tick: The TickManager instance.
         :param resource: The ResourceManager instance.
         :param database: The DatabaseManager instance.
+        :param event: The EventManager instance.
         """
         self.screen = screen
         self.clock = pygame.time.Clock()
         self.fps = config["window"]["fps"]
         self.done = False
+        self.headless = config.get("headless", {}).get("enabled", False)
         self.keys = pygame.key.get_pressed()
         self.cursor = Cursor()
         self.config = config
         self.images = images
-        self.audio = AudioManager(self.config)
+        self.audio = AudioManager(self.config, event)
         self.ui = UIManager(config, self.clock, self.fps, self.screen)
+        self.input = InputManager(self.ui)
         self.tick = tick
+        self.tick.step = 1000 / config["window"].get("tick_rate", self.fps)
         self.resource = resource
         self.database = database
+        self.event = event
         self.vars = {}
         self.log = Logger("App")
 
         # The game World must be initialized here, since it requires a reference to the App.
+        # It is loaded once scripts can be called, since roomview generators may be event scripts.
         self.log.info("Initializing game world...")
         self.world = World(config, self, resource)
+        self.overlay = OverlayManager(self.config, self, self.resource, self.world)
+        self.script = ScriptManager(self, self.audio, self.cursor, self.resource, self.ui, self.world)
         if not self.world.load():
             sys.exit(8)
+        self.worlds = {self.world.dir: self.world}
 
-        self.overlay = OverlayManager(self.config, self, self.resource, self.world)
-        self.script = ScriptManager(self, self.audio, self.cursor, self.resource, self.ui, self.world)
+        # Bind the engine's own input handlers. Clicks only count for the left and right mouse buttons.
+        self.input.bind(pygame.QUIT, self.__quit)
+        self.input.bind(pygame.KEYDOWN, self.__quit, pygame.K_ESCAPE)
+        self.input.bind(pygame.MOUSEBUTTONDOWN, self.__mouse_down, 1)
+        self.input.bind(pygame.MOUSEBUTTONDOWN, self.__mouse_down, 3)
+        self.input.bind(pygame.MOUSEBUTTONUP, self.__left_click, 1)
+        self.input.bind(pygame.MOUSEBUTTONUP, self.__right_click, 3)
+        self.input.bind(pygame.KEYDOWN, self.__key)
+        self.input.bind(pygame.KEYUP, self.__key)
+
+        # Writing the database and the log file to disk can wait until a frame has time to spare.
+        self.tick.add_idle_task(self.database._update, 10, continuous=True)
+        self.tick.add_idle_task(flush, -10, continuous=True)
+
+    def load_world(self, world_dir: str) -> Optional[World]:
+        """Load another game world without switching to it, so that it can be switched to instantly later.
+
+        Loaded worlds share the engine's caches. Files from the common directory and schemas are shared outright, and
+        images with identical content and scale in different worlds are only loaded once.
+
+        :param world_dir: The directory of the game world, from the engine's base directory.
+
+        :return: The World instance if succeeded, None if failed.
+        """
+        world_dir = normalize_path(world_dir).rstrip('/')
+        if world_dir in self.worlds:
+            return self.worlds[world_dir]
+        if not os.path.isdir(world_dir):
+            self.log.error("load_world(): No such world directory: {0}".format(world_dir))
+            return None
+
+        # The world's files are found relative to the current world in the config, so point it there while loading.
+        self.log.info("load_world(): Loading game world: {0}".format(world_dir))
+        current_dir, self.config["world"] = self.config["world"], world_dir
+        world = World(self.config, self, self.resource, world_dir, primary=False)
+        loaded = world.load(enter=False)
+        self.config["world"] = current_dir
+        if not loaded:
+            self.log.error("load_world(): Unable to load game world: {0}".format(world_dir))
+            return None
+
+        # Now that there is more than one world, look for identical images between them.
+        self.worlds[world_dir] = world
+        self.resource.dedupe = True
+        return world
+
+    def switch_world(self, world_dir: str) -> bool:
+        """Switch to another game world, loading it first if needed.
+
+        The world we leave is kept as it is, and switching back to it later returns to the roomview we left it in.
+        Overlays belong to the world they were inserted in, so they are all removed.
+
+        :param world_dir: The directory of the game world, from the engine's base directory.
+
+        :return: True if succeeded, False if failed.
+        """
+        world = self.load_world(world_dir)
+        if not world:
+            return False
+        if world is self.world:
+            return True
+
+        # Make sure the roomview we are going to enter loads before leaving the current world, so that a broken world
+        # can't leave us stranded between the two. The world's files are found relative to it in the config, and its
+        # scripts, such as roomview generators, relative to it in the ScriptManager.
+        previous = self.world
+        self.config["world"] = world.dir
+        self.script.world = world
+        if not world.roomview and not world._load_roomview(world.vars["first_roomview"]):
+            self.config["world"] = previous.dir
+            self.script.world = previous
+            self.log.error("switch_world(): Unable to enter game world: {0}".format(world.dir))
+            return False
+
+        # Leave the current world.
+        self.event.publish("world_leave", previous.dir, previous)
+        for overlay_id in list(self.overlay.overlays):
+            self.overlay.remove_overlay(overlay_id)
+
+        # Point everything else at the new world.
+        self.world = self.overlay.world = world
+        world.set_caption()
+
+        # Enter the roomview we left the world in, just as it was, or the first roomview if it is new to us.
+        # That was loaded above, so this only fails if it has dropped out of the cache since and no longer loads. In
+        # that case, go back to where we were in the previous world.
+        if world.roomview:
+            world.roomview._enter(recalculate=False)
+        elif not world.change_roomview(world.vars["first_roomview"]):
+            self.log.error("switch_world(): Unable to enter game world: {0}".format(world.dir))
+            self.config["world"] = previous.dir
+            self.world = self.overlay.world = self.script.world = previous
+            previous.set_caption()
+            previous.roomview._enter(recalculate=False)
+            self.event.publish("world_enter", previous.dir, previous)
+            return False
+        self.event.publish("world_enter", world.dir, world)
+        self.log.info("switch_world(): Switched to game world: {0}".format(world.dir))
+        return True
+
+    def act(self, index: int, act_type: str) -> bool:
+        """Perform an action of the current roomview, just as if it had been clicked.
+
+        :param index: The index of the action in the roomview's list of actions.
+        :param act_type: The type of action to perform, "look", "use" or "go".
+
+        :return: True if succeeded, False if failed.
+        """
+        actions = self.world.roomview.vars.get("actions", [])
+        if not 0 <= index < len(actions) or act_type not in actions[index]:
+            self.log.warn("act(): Attempt to perform nonexistent action: {0}: {1}: {2}".format(
+                self.world.roomview.file, index, act_type))
+            return False
+        self.cursor.action = actions[index]
+        self.__do_action(act_type)
+        return True
+
+    def __quit(self, event: pygame.event.Event) -> None:
+        """Input handler for when we have been asked to quit.
+
+        :param event: The PyGame event.
+        """
+        self.done = True
+
+    def __mouse_down(self, event: pygame.event.Event) -> None:
+        """Input handler for when a left or right mouse button down event has been recorded.
 
-    def __event_loop(self) -> None:
-        """This is the input event loop for the whole program.
+        :param event: The PyGame event.
+        """
+        # Record that a click is in progress.
+        self.cursor.click = True
+
+        # If the cursor is in an action zone, make note of that zone.
+        # This is necessary to check whether the cursor is in the same zone when click concludes.
+        if self.cursor.action:
+            self.cursor.last_click = id(self.cursor.action)
+
+        # If the cursor is in a navigation zone, make note of that zone.
+        # This is necessary to check whether the cursor is in the same zone when click concludes.
+        elif self.cursor.nav:
+            self.cursor.last_click = self.cursor.nav
+
+        # For debugging purposes, log whether this is a left or a right click.
+        if event.button == 1:
+            self.log.debug("__mouse_down(): LEFT MOUSE BUTTON DOWN")
+        elif event.button == 3:
+            self.log.debug("__mouse_down(): RIGHT MOUSE BUTTON DOWN")
+
+    def __left_click(self, event: pygame.event.Event) -> None:
+        """Input handler for when a left click has concluded.
+
+        :param event: The PyGame event.
+        """
+        # Record that no click is in progress anymore.
+        self.cursor.click = False
+
+        # The click was a complete click -- it started and ended within the same zone.
+        # The zone was an action zone.
+        if self.cursor.action and id(self.cursor.action) == self.cursor.last_click:
+            self.log.debug("__left_click(): FULL LEFT CLICK IN ACTION ZONE")
+
+            # Perform the action associated with this zone.
+            if "look" in self.cursor.action:
+                self.__do_action("look")
+            elif "use" in self.cursor.action:
+                self.__do_action("use")
+            elif "go" in self.cursor.action:
+                self.__do_action("go")
+
+        # The click was a complete click -- it started and ended within the same zone.
+        # The zone was a navigation zone.
+        elif self.cursor.nav and self.cursor.nav == self.cursor.last_click:
+            self.log.debug("__left_click(): FULL LEFT CLICK IN NAV REGION: {0}".format(self.cursor.nav))
+
+            # Perform the navigation associated with the zone.
+            if self.cursor.nav == "double":
+                self.world.navigate("forward")
+            else:
+                self.world.navigate(self.cursor.nav)
+
+            # At the conclusion of changing roomviews, the UI must be reset.
+            self.ui.reset()
 
-        We handle clicks and navigation and cleaning up UI elements here.
+        # We clicked somewhere other than a zone. Just reset the UI.
+        elif self.cursor.pos:
+            self.ui.reset()
+
+    def __right_click(self, event: pygame.event.Event) -> None:
+        """Input handler for when a right click has concluded.
+
+        :param event: The PyGame event.
         """
-        # Iterate through current events, and process them.
-        for event in pygame.event.get():
-            # We have been asked to quit.
-            if event.type == pygame.QUIT or self.keys[pygame.K_ESCAPE]:
-                self.done = True
-
-            # A left or right mouse button down event has been recorded.
-            elif event.type == pygame.MOUSEBUTTONDOWN and event.button in [1, 3]:
-                # Record that a click is in progress.
-                self.cursor.click = True
-
-                # If the cursor is in an action zone, make note of that zone.
-                # This is necessary to check whether the cursor is in the same zone when click concludes.
-                if self.cursor.action:
-                    self.cursor.last_click = id(self.cursor.action)
-
-                # If the cursor is in a navigation zone, make note of that zone.
-                # This is necessary to check whether the cursor is in the same zone when click concludes.
-                elif self.cursor.nav:
-                    self.cursor.last_click = self.cursor.nav
-
-                # For debugging purposes, log whether this is a left or a right click.
-                if event.button == 1:
-                    self.log.debug("__event_loop(): LEFT MOUSE BUTTON DOWN")
-                elif event.button == 3:
-                    self.log.debug("__event_loop(): RIGHT MOUSE BUTTON DOWN")
-
-            # A left click has concluded.
-            elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
-                # Record that no click is in progress anymore.
-                self.cursor.click = False
-
-                # The click was a complete click -- it started and ended within the same zone.
-                # The zone was an action zone.
-                if self.cursor.action and id(self.cursor.action) == self.cursor.last_click:
-                    self.log.debug("__event_loop(): FULL LEFT CLICK IN ACTION ZONE")
-
-                    # Perform the action associated with this zone.
-                    if "look" in self.cursor.action:
-                        self.__do_action("look")
-                    elif "use" in self.cursor.action:
-                        self.__do_action("use")
-                    elif "go" in self.cursor.action:
-                        self.__do_action("go")
-
-                # The click was a complete click -- it started and ended within the same zone.
-                # The zone was a navigation zone.
-                elif self.cursor.nav and self.cursor.nav == self.cursor.last_click:
-                    self.log.debug("__event_loop(): FULL LEFT CLICK IN NAV REGION: {0}".format(self.cursor.nav))
-
-                    # Perform the navigation associated with the zone.
-                    if self.cursor.nav == "double":
-                        self.world.navigate("forward")
-                    else:
-                        self.world.navigate(self.cursor.nav)
-
-                    # At the conclusion of changing roomviews, the UI must be reset.
-                    self.ui.reset()
-
-                # We clicked somewhere other than a zone. Just reset the UI.
-                elif self.cursor.pos:
-                    self.ui.reset()
-
-            # A right click has concluded.
-            elif event.type == pygame.MOUSEBUTTONUP and event.button == 3:
-                # Record that no click is in progress anymore.
-                self.cursor.click = False
-
-                # The click was a complete click -- it started and ended within the same zone.
-                # The zone was an action zone.
-                if self.cursor.action and id(self.cursor.action) == self.cursor.last_click:
-                    self.log.debug("__event_loop(): FULL RIGHT CLICK IN ACTION ZONE")
-
-                    # Perform the action associated with this zone.
-                    if "use" in self.cursor.action:
-                        self.__do_action("use")
-                    elif "go" in self.cursor.action:
-                        self.__do_action("go")
-
-                # The click was a complete click -- it started and ended within the same zone.
-                # The zone was a navigation zone.
-                elif self.cursor.nav in ["backward", "double"] and self.cursor.nav == self.cursor.last_click:
-                    # We have right clicked on a backward or double arrow; attempt to go backward.
-                    self.log.debug("__event_loop(): FULL RIGHT CLICK IN NAV REGION: {0}".format(self.cursor.nav))
-                    self.world.navigate("backward")
-
-                    # At the conclusion of changing roomviewss, the UI must be reset.
-                    self.ui.reset()
-
-                # We clicked somewhere other than a zone. Just reset the UI.
-                elif self.cursor.pos:
-                    self.ui.reset()
-
-            # Record keypresses. We don't do anything with them yet.
-            elif event.type in (pygame.KEYUP, pygame.KEYDOWN):
-                self.keys = pygame.key.get_pressed()
-
-                # Trigger debug mode if the debug key is pressed.
-                if event.type == pygame.KEYDOWN:
-                    if self.config["debug"]["enabled"] and event.key == getattr(pygame, self.config["debug"]["key"]):
-                        self.log.debug("__event_loop(): ENTERING DEBUG MODE FROM KEYPRESS")
-                        pdb.set_trace()
-
-            # Process any UI events that have been queued.
-            self.ui._process_events(event)
+        # Record that no click is in progress anymore.
+        self.cursor.click = False
+
+        # The click was a complete click -- it started and ended within the same zone.
+        # The zone was an action zone.
+        if self.cursor.action and id(self.cursor.action) == self.cursor.last_click:
+            self.log.debug("__right_click(): FULL RIGHT CLICK IN ACTION ZONE")
+
+            # Perform the action associated with this zone.
+            if "use" in self.cursor.action:
+                self.__do_action("use")
+            elif "go" in self.cursor.action:
+                self.__do_action("go")
+
+        # The click was a complete click -- it started and ended within the same zone.
+        # The zone was a navigation zone.
+        elif self.cursor.nav in ["backward", "double"] and self.cursor.nav == self.cursor.last_click:
+            # We have right clicked on a backward or double arrow; attempt to go backward.
+            self.log.debug("__right_click(): FULL RIGHT CLICK IN NAV REGION: {0}".format(self.cursor.nav))
+            self.world.navigate("backward")
+
+            # At the conclusion of changing roomviewss, the UI must be reset.
+            self.ui.reset()
+
+        # We clicked somewhere other than a zone. Just reset the UI.
+        elif self.cursor.pos:
+            self.ui.reset()
+
+    def __key(self, event: pygame.event.Event) -> None:
+        """Input handler for keypresses.
+
+        :param event: The PyGame event.
+        """
+        # Record keypresses. We don't do anything with them yet.
+        self.keys = pygame.key.get_pressed()
+
+        # Trigger debug mode if the debug key is pressed.
+        if event.type == pygame.KEYDOWN:
+            if self.config["debug"]["enabled"] and event.key == getattr(pygame, self.config["debug"]["key"]):
+                self.log.debug("__key(): ENTERING DEBUG MODE FROM KEYPRESS")
+                pdb.set_trace()
 
     def __demarc_action_indicator(self) -> bool:
         """This is a method to demarcate an appropriate action indicator.
@@ -352,7 +493,7 @@ class App(object):
                 self.log.error("__do_action(): Missing exit which should exist: {0}: {1}: {2}".format(
                     self.world.roomview.file, self.cursor.action["rect"], act_type))
 
-        # A script action was invoked. Execute an event script.
+        # A script action was invoked. Execute an event script, starting it as a coroutine if it is one.
         elif self.cursor.action[act_type]["result"] == "script":
             self.log.debug("__do_action(): ACTION SCRIPT RESULT CONTENTS: {0}".format(
                 self.cursor.action[act_type]["contents"]))
@@ -363,11 +504,15 @@ class App(object):
                 self.log.error("__do_action(): Malformed script result contents: {0}".format(
                     self.cursor.action[act_type]["contents"]))
             else:
-                self.script.call(script_result_split[0], *script_result_args)
+                self.script.call(script_result_split[0], *script_result_args, start=True)
 
     def _render(self) -> None:
         """Render a frame.
         """
+        # There is nothing to see in headless mode.
+        if self.headless:
+            return
+
         # Fill the screen with black, and then draw our roomview image.
         self.screen.fill(pygame.Color("black"))
         self.screen.blit(self.world.roomview.image, (0, 0))
@@ -391,17 +536,108 @@ class App(object):
         self.log.info("Entering main loop.")
 
         # Until we are told to stop:
-        # * Check for and process delayed events.
+        # * Advance the simulation clock, and process delayed events.
         # * Check for and process input events.
         # * Render a frame.
         # * Update the Cursor.
-        # * Update the UI.
+        # * Run idle tasks in whatever time is left in the frame.
+        # * Update the UI, which waits out the rest of the frame.
         # * Run the AudioManager cleanup callback.
+        # * Pick up background work that has finished.
+        frame_time = 1000 / self.fps
         while not self.done:
+            frame_start = time.perf_counter()
             self.tick._tick()
-            self.__event_loop()
+            self.input._update()
             self._render()
             self.cursor._update()
+            self.tick._idle(frame_time - (time.perf_counter() - frame_start) * 1000)
             self.ui._update()
             self.audio._update()
-            self.database._update()
+            self.tick._update()
+
+    def _main_loop_headless(self) -> None:
+        """This is the main loop for the entire program, when running headless.
+
+        Nothing is rendered, the UI and the Cursor are left alone, and frames run as fast as they can, with the
+        simulation clock taking one step each frame. The game is driven by the event script named in the config, which
+        may be a coroutine that navigates and performs actions over time. The loop ends when the script sets
+        BXE.app.done, when a coroutine script returns, or after the configured number of frames, if any.
+        """
+        self.log.info("Entering headless main loop.")
+        self.tick.virtual = True
+
+        # Start the script which drives the game, if there is one.
+        driver = None
+        script = self.config["headless"].get("script")
+        if script and ":" not in script:
+            self.log.error("_main_loop_headless(): Malformed headless script, expected file.py:function: {0}".format(
+                script))
+        elif script:
+            script_file, func = script.split(':', 1)
+            module = self.script[script_file]
+            if module and (inspect.isgeneratorfunction(getattr(module, func, None)) or
+                           inspect.iscoroutinefunction(getattr(module, func, None))):
+                driver = self.script.call(script_file, func, start=True)
+            else:
+                self.script.call(script_file, func)
+
+        # Until we are told to stop, or the driving coroutine finishes, or we run out of frames:
+        # * Advance the simulation clock by one step, and process delayed events.
+        # * Process input events, which only come from scripts.
+        # * Run any idle tasks that have waited too long, since there is never time left over.
+        # * Run the AudioManager cleanup callback.
+        # * Pick up background work that has finished.
+        frames = self.config["headless"].get("frames", 0)
+        frame = 0
+        while not self.done and (driver is None or self.tick.running(driver)) and (not frames or frame < frames):
+            self.tick._tick()
+            self.input._update()
+            self.tick._idle(0)
+            self.audio._update()
+            self.tick._update()
+            frame += 1
+
+        # Write out anything the run left in the database, since idle tasks only got to run now and then.
+        self.database._update()
+        self.log.info("Leaving headless main loop after {0} frames, at {1} ms simulated.".format(
+            frame, int(self.tick.now)))
+
+    async def _main_loop_async(self) -> None:
+        """This is the main loop for the entire program, when running on asyncio.
+
+        It does the same work each frame as _main_loop(), but instead of blocking until the next frame, it awaits a
+        sleep, so that other asyncio tasks get to run in between frames. If a delayed event comes due before the next
+        frame, it wakes up early to run it on time.
+        """
+        self.log.info("Entering main loop on asyncio.")
+
+        # Let event scripts run coroutines on this loop. The loop keeps its own default executor, since asyncio shuts
+        # that down on exit, and the TickManager's background thread pool must outlive the loop.
+        self.tick.loop = asyncio.get_running_loop()
+
+        frame_time = 1000 / self.fps
+        next_frame = time.perf_counter() * 1000
+        while not self.done:
+            frame_start = time.perf_counter()
+            self.tick._tick()
+            self.input._update()
+            self._render()
+            self.cursor._update()
+            self.tick._idle(frame_time - (time.perf_counter() - frame_start) * 1000)
+            self.ui._update(wait=False)
+            self.audio._update()
+            self.tick._update()
+
+            # Sleep until the next frame, waking up early for any delayed events that come due before it.
+            # If we are running behind, start the next frame right away instead of trying to catch up.
+            next_frame = max(next_frame + frame_time, time.perf_counter() * 1000)
+            while True:
+                until_frame = next_frame - time.perf_counter() * 1000
+                until_due = self.tick._next_due()
+                if until_due is None or until_due >= until_frame:
+                    await asyncio.sleep(max(until_frame, 0) / 1000)
+                    break
+                await asyncio.sleep(until_due / 1000)
+                self.tick._advance()
+        self.tick.loop = None
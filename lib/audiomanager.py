@@ -41,6 +41,7 @@ class AudioManager:
     This class manages the audio subsystem and allows playing sound effects and music.
 
     :ivar config: This contains the engine's configuration variables.
+    :ivar event: The EventManager instance.
     :ivar log: The Logger instance for this class.
     :ivar playing_music: If music is currently playing, this contains the filename; otherwise it is None.
     :ivar playing_sfx: True if any sound effects are currently playing, otherwise False.
@@ -49,12 +50,14 @@ class AudioManager:
                        to prevent the _cleanup method from deleting __sfx members during iteration.
     """
 
-    def __init__(self, config):
+    def __init__(self, config, event):
         """AudioManager Class Initializer
 
         :param config: The engine's configuration variables.
+        :param event: The EventManager instance.
         """
         self.config = config
+        self.event = event
         self.log = Logger("Audio")
 
         self.playing_music = None
@@ -190,7 +193,7 @@ class AudioManager:
             if self.__sfx[channel_id]["channel"].get_busy():
                 if not fade:  # Stop channel.
                     self.__sfx[channel_id]["channel"].stop()
-                    del self.__sfx[channel_id]
+                    self.__end_sfx(channel_id)
                 else:  # Fade out channel.
                     self.__sfx[channel_id]["channel"].fadeout(int(fade*1000))
                     # Cleanup callback will handle deletion.
@@ -216,7 +219,7 @@ class AudioManager:
                     self.__sfx[channel_id]["channel"].fadeout(int(fade*1000))
                 else:
                     self.__sfx[channel_id]["channel"].stop()
-                    del self.__sfx[channel_id]
+                    self.__end_sfx(channel_id)
                 result += 1
         self.__iter_lock = False
 
@@ -330,6 +333,7 @@ class AudioManager:
                 pygame.mixer.music.stop()
                 pygame.mixer.music.unload()
                 self.playing_music = None
+                self.event.publish("music_end", temp_music)
             else:  # Fade out the music.
                 pygame.mixer.music.fadeout(int(fade*1000))
                 # Cleanup callback will handle deletion.
@@ -344,6 +348,7 @@ class AudioManager:
         """
         if self.playing_music and not pygame.mixer.music.get_busy():
             pygame.mixer.music.unload()
+            self.event.publish("music_end", self.playing_music)
             self.playing_music = None
         try:
             if not len(self.__sfx):
@@ -352,10 +357,18 @@ class AudioManager:
                 for sfx in self.__sfx:
                     if not self.__sfx[sfx]["channel"].get_busy():
                         if not self.__iter_lock:
-                            del self.__sfx[sfx]
+                            self.__end_sfx(sfx)
         except RuntimeError:
             # The size of the self.__sfx dictionary changed while iterating. This is not actually a problem.
             pass
 
         return True
 
+    def __end_sfx(self, channel_id: AudioChannelID) -> None:
+        """Forget a sound effect that has stopped playing, and let event subscribers know.
+
+        :param channel_id: The abstracted channel ID of the sound effect.
+        """
+        filename = self.__sfx.pop(channel_id)["filename"]
+        self.event.publish("sfx_end", filename, channel_id)
+
@@ -41,18 +41,21 @@ class DatabaseManager:
     Any object type supported by JSON may be stored.
 
     :ivar config: This contains the engine's configuration variables.
+    :ivar event: The EventManager instance.
     :ivar log: The Logger instance for this class.
     :ivar filename: The filename of the initial database to open.
     :ivar __change: Whether there are changes to the database that haven't been written to disk yet.
     :ivar __database: The JSON contents of the currently open database.
     """
 
-    def __init__(self, config):
+    def __init__(self, config, event):
         """DatabaseManager Class Initializer
 
         :param config: This contains the engine's configuration variables.
+        :param event: The EventManager instance.
         """
         self.config = config
+        self.event = event
         self.log = Logger("DatabaseManager")
 
         self.filename = os.path.join(self.config["database"])
@@ -152,6 +155,7 @@ class DatabaseManager:
         self.__database[key] = obj
         self.__changed = True
         self.log.debug("put(): Put object: \"{0}\"".format(key))
+        self.event.publish("database_put", key, obj)
         return True
 
     def remove(self, key: str) -> bool:
@@ -166,6 +170,7 @@ class DatabaseManager:
             del self.__database[key]
             self.log.debug("remove(): Remove object: \"{0}\"".format(key))
             self.__changed = True
+            self.event.publish("database_remove", key)
             return True
         else:
             self.log.error("remove(): No such key: \"{0}\"".format(key))
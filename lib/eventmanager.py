@@ -0,0 +1,164 @@
+#######################
+# BXEngine            #
+# eventmanager.py     #
+# Copyright 2021-2023 #
+# Sei Satzparad       #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+import itertools
+import traceback
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, NewType
+
+from lib.logger import Logger
+
+SubscriptionID = NewType("SubscriptionID", int)
+
+
+class EventManager:
+    """The Event Manager
+
+    This class is a publish/subscribe event bus, which lets event scripts react to things happening in the engine
+    without having to check for them every frame.
+
+    Each event has a type, like "roomview_enter", and a key, which says what the event is about, like the filename of
+    the room. A subscription can be for every event of a type, or only for those with a particular key. Subscriptions
+    are indexed by type and key, so publishing an event only looks at the subscriptions that actually match it.
+
+    Callbacks are called with the key and the data of the event. The engine publishes these events:
+
+    * "roomview_leave": Leaving a roomview. The key is the room filename, and the data is the Roomview instance.
+    * "roomview_enter": Entering a roomview. The key is the room filename, and the data is the Roomview instance.
+    * "overlay_insert", "overlay_change", "overlay_remove": An overlay was inserted, repositioned or rescaled, or
+      removed. The key is the overlay ID, and the data is the overlay, as stored in OverlayManager.overlays.
+    * "music_end": Music finished playing or was stopped. The key is the music filename, and the data is None.
+    * "sfx_end": A sound effect finished playing or was stopped. The key is the sound filename, and the data is its
+      channel ID.
+    * "database_put", "database_remove": A database key was created or updated, or removed. The key is the database
+      key, and the data is the new object, or None if removed.
+    * "world_leave", "world_enter": Switching from one game world to another. The key is the world directory, and the
+      data is the World instance.
+
+    Event scripts may also publish and subscribe to events of their own.
+
+    :ivar log: The Logger instance for this class.
+    :ivar subscriptions: A dict of subscription IDs mapped to their event type, key and callback.
+    :ivar __index: A dict of (event type, key) pairs mapped to dicts of subscription IDs and callbacks.
+    :ivar __subscription_ids: A counter used to hand out subscription IDs.
+    """
+    def __init__(self):
+        """
+        EventManager class initializer.
+        """
+        self.log = Logger("Event")
+
+        # {subscription_id: {event: str, key: Hashable, callback: Callable}}
+        self.subscriptions = {}
+        self.__index = {}  # {(event, key): {subscription_id: callback}}
+        self.__subscription_ids = itertools.count(1)
+
+    def __contains__(self, item: SubscriptionID) -> bool:
+        return item in self.subscriptions
+
+    def subscribe(self, event: str, callback: Callable, key: Hashable = None) -> SubscriptionID:
+        """Subscribe to an event.
+
+        :param event: The type of event to subscribe to.
+        :param callback: A function to be called with the key and data of each matching event.
+        :param key: If given, only subscribe to events of this type with this key, otherwise to all of them.
+
+        :return: A unique subscription ID, which can be given to unsubscribe().
+        """
+        subscription_id = SubscriptionID(next(self.__subscription_ids))
+        self.subscriptions[subscription_id] = {"event": event, "key": key, "callback": callback}
+        self.__index.setdefault((event, key), {})[subscription_id] = callback
+        self.log.debug("subscribe(): Subscribed to event: {0}: {1} ({2})".format(event, key, subscription_id))
+        return subscription_id
+
+    def unsubscribe(self, subscription_id: SubscriptionID) -> bool:
+        """Cancel a subscription.
+
+        :param subscription_id: The subscription ID given by subscribe().
+
+        :return: True if succeeded, False if failed.
+        """
+        if subscription_id not in self.subscriptions:
+            self.log.warn("unsubscribe(): Attempt to cancel nonexistent subscription: {0}".format(subscription_id))
+            return False
+
+        subscription = self.subscriptions.pop(subscription_id)
+        index_key = (subscription["event"], subscription["key"])
+        del self.__index[index_key][subscription_id]
+        if not self.__index[index_key]:
+            del self.__index[index_key]
+        self.log.debug("unsubscribe(): Cancelled subscription: {0}".format(subscription_id))
+        return True
+
+    def publish(self, event: str, key: Hashable = None, data: Any = None) -> int:
+        """Publish an event to its subscribers.
+
+        Subscribers are called right away, first those subscribed to this key, then those subscribed to every key.
+        A subscriber which fails is logged and skipped. Subscribers may freely subscribe and unsubscribe, including
+        themselves, while this happens.
+
+        :param event: The type of event.
+        :param key: What the event is about.
+        :param data: Any extra information to pass to the subscribers.
+
+        :return: The number of subscribers called.
+        """
+        called = 0
+        for index_key in [(event, key), (event, None)] if key is not None else [(event, None)]:
+            if index_key not in self.__index:
+                continue
+            for subscription_id, callback in list(self.__index[index_key].items()):
+                # Skip subscriptions that were cancelled by an earlier subscriber.
+                if subscription_id not in self.subscriptions:
+                    continue
+                try:
+                    callback(key, data)
+                except:
+                    self.log.error("publish(): Error from event subscriber: {0}: {1}: {2}\n{3}".format(
+                        event, key, getattr(callback, "__name__", callback), traceback.format_exc().rstrip()))
+                called += 1
+        return called
+
+    def next_event(self, event: str, key: Hashable = None) -> Future:
+        """Get a Future for the next matching event, which an event script coroutine can wait for.
+
+        For example, "room, roomview = yield BXE.tick.wait_for(BXE.event.next_event("roomview_enter"))" in a generator
+        function pauses that function until the next roomview is entered.
+
+        :param event: The type of event to wait for.
+        :param key: If given, only wait for an event of this type with this key.
+
+        :return: A Future whose result will be the key and data of the event, as a tuple.
+        """
+        future = Future()
+
+        def deliver(event_key: Hashable, data: Any) -> None:
+            self.unsubscribe(subscription_id)
+            future.set_result((event_key, data))
+
+        subscription_id = self.subscribe(event, deliver, key)
+        return future
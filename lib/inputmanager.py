@@ -0,0 +1,169 @@
+#######################
+# BXEngine            #
+# inputmanager.py     #
+# Copyright 2021-2023 #
+# Sei Satzparad       #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+import itertools
+import traceback
+from typing import Callable, NewType
+
+import pygame
+
+from lib.logger import Logger
+
+BindingID = NewType("BindingID", int)
+
+# The high rate input event types that nothing in the engine or PyGame GUI makes use of, which can flood the event queue
+# with hundreds of events per second. They are kept out of the event queue unless a handler is bound to them.
+BLOCKED_EVENTS = [pygame.JOYAXISMOTION, pygame.JOYBALLMOTION, pygame.JOYHATMOTION, pygame.CONTROLLERAXISMOTION]
+
+# The attribute which tells apart events of the same type in the handler table, for each type that has one.
+DETAIL_ATTRIBUTES = {pygame.MOUSEBUTTONDOWN: "button", pygame.MOUSEBUTTONUP: "button",
+                     pygame.KEYDOWN: "key", pygame.KEYUP: "key"}
+
+
+class InputManager:
+    """The Input Manager
+
+    This class runs the input pipeline. Once per frame, it takes the waiting input events from PyGame, collapses each
+    run of consecutive mouse motion events into one, and hands each event to its handlers and then to the UI.
+
+    Handlers are looked up from a table keyed by event type and detail, where the detail is the mouse button for mouse
+    button events, the key for keyboard events, or None. A handler bound with a detail of None gets every event of its
+    type. The engine's own click and keyboard handling is bound here by the App, and event scripts may bind handlers
+    of their own through bind(), for example "BXE.input.bind(pygame.KEYDOWN, on_space, pygame.K_SPACE)".
+
+    :ivar log: The Logger instance for this class.
+    :ivar ui: The UIManager instance.
+    :ivar bindings: A dict of binding IDs mapped to their event type, detail and handler.
+    :ivar __handlers: A dict of (event type, detail) pairs mapped to dicts of binding IDs and handlers.
+    :ivar __binding_ids: A counter used to hand out binding IDs.
+    """
+    def __init__(self, ui):
+        """InputManager Class Initializer
+
+        :param ui: The UIManager instance.
+        """
+        self.log = Logger("Input")
+        self.ui = ui
+
+        # {binding_id: {type: int, detail: int, handler: Callable}}
+        self.bindings = {}
+        self.__handlers = {}  # {(type, detail): {binding_id: handler}}
+        self.__binding_ids = itertools.count(1)
+
+        # Keep high rate event types nobody handles out of the queue to begin with.
+        pygame.event.set_blocked(BLOCKED_EVENTS)
+
+    def bind(self, event_type: int, handler: Callable, detail: int = None) -> BindingID:
+        """Bind a handler to an input event.
+
+        :param event_type: The PyGame event type, like pygame.KEYDOWN.
+        :param handler: A function to be called with the PyGame event.
+        :param detail: If given, only handle events with this mouse button or key, otherwise handle all of them.
+
+        :return: A unique binding ID, which can be given to unbind().
+        """
+        binding_id = BindingID(next(self.__binding_ids))
+        self.bindings[binding_id] = {"type": event_type, "detail": detail, "handler": handler}
+        self.__handlers.setdefault((event_type, detail), {})[binding_id] = handler
+
+        # Make sure events of this type are let into the queue.
+        if pygame.event.get_blocked(event_type):
+            pygame.event.set_allowed(event_type)
+        self.log.debug("bind(): Bound input handler: {0}: {1}: {2} ({3})".format(
+            pygame.event.event_name(event_type), detail, getattr(handler, "__name__", handler), binding_id))
+        return binding_id
+
+    def unbind(self, binding_id: BindingID) -> bool:
+        """Unbind an input handler.
+
+        :param binding_id: The binding ID given by bind().
+
+        :return: True if succeeded, False if failed.
+        """
+        if binding_id not in self.bindings:
+            self.log.warn("unbind(): Attempt to unbind nonexistent input handler: {0}".format(binding_id))
+            return False
+
+        binding = self.bindings.pop(binding_id)
+        table_key = (binding["type"], binding["detail"])
+        del self.__handlers[table_key][binding_id]
+        if not self.__handlers[table_key]:
+            del self.__handlers[table_key]
+        self.log.debug("unbind(): Unbound input handler: {0}".format(binding_id))
+        return True
+
+    def _update(self) -> None:
+        """This is called by the mainloop once per frame.
+
+        It processes every input event that has arrived since the last frame.
+        """
+        for event in self.__coalesce(pygame.event.get()):
+            # Call the handlers for this particular button or key first, then the ones for the whole event type.
+            detail = getattr(event, DETAIL_ATTRIBUTES[event.type]) if event.type in DETAIL_ATTRIBUTES else None
+            for table_key in [(event.type, detail), (event.type, None)] if detail is not None else [(event.type, None)]:
+                if table_key in self.__handlers:
+                    for binding_id, handler in list(self.__handlers[table_key].items()):
+                        if binding_id in self.bindings:
+                            self.__call(handler, event)
+
+            # Process any UI events that have been queued.
+            self.ui._process_events(event)
+
+    def __call(self, handler: Callable, event: pygame.event.Event) -> None:
+        """Call an input handler, and log any error it gives instead of crashing.
+
+        :param handler: The handler to call.
+        :param event: The PyGame event to pass to the handler.
+        """
+        try:
+            handler(event)
+        except Exception:
+            self.log.error("_update(): Error from input handler: {0}: {1}\n{2}".format(
+                pygame.event.event_name(event.type), getattr(handler, "__name__", handler),
+                traceback.format_exc().rstrip()))
+
+    @staticmethod
+    def __coalesce(events: list) -> list:
+        """Collapse each run of consecutive mouse motion events into a single one.
+
+        The collapsed event has the position and buttons of the last motion event in the run, and the sum of their
+        relative motions, so nothing is lost by handling it instead of the whole run.
+
+        :param events: A list of PyGame events.
+
+        :return: The list of events with mouse motion collapsed.
+        """
+        coalesced = []
+        for event in events:
+            if event.type == pygame.MOUSEMOTION and coalesced and coalesced[-1].type == pygame.MOUSEMOTION:
+                previous = coalesced[-1]
+                attributes = event.dict.copy()
+                attributes["rel"] = (previous.rel[0] + event.rel[0], previous.rel[1] + event.rel[1])
+                coalesced[-1] = pygame.event.Event(pygame.MOUSEMOTION, attributes)
+            else:
+                coalesced.append(event)
+        return coalesced
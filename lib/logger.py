@@ -103,6 +103,15 @@ def init(level: str, logfile: str = None, use_stdout: bool = True, suppressions:
             _LOGFILE.write(timestamp() + " [Logger#info] init(): Finished initializing logger.\n")
 
 
+def flush() -> None:
+    """Flush buffered log messages to the log file, if there is one.
+
+    The engine runs this as an idle task, so that writing the log file to disk doesn't land in a busy frame.
+    """
+    if _LOGFILE:
+        _LOGFILE.flush()
+
+
 def timestamp() -> str:
     """Return a Log timestamp.
 
@@ -105,6 +105,7 @@ class OverlayManager(object):
         self.overlays[id(overlay_image)] = {"filename": filename, "image": overlay_image, "position": position,
                                             "persistent": persistent}
         self.app._render()
+        self.app.event.publish("overlay_insert", id(overlay_image), self.overlays[id(overlay_image)])
         self.log.info("insert_overlay(): Added overlay image: {0} at position: {1}".format(overlay_image, position))
         return id(overlay_image)
 
@@ -121,8 +122,9 @@ class OverlayManager(object):
             return False
 
         # Success.
-        del self.overlays[overlay_id]
+        overlay = self.overlays.pop(overlay_id)
         self.app._render()
+        self.app.event.publish("overlay_remove", overlay_id, overlay)
         self.log.info("remove_overlay(): Removed overlay image with ID: {0}".format(overlay_id))
         return True
 
@@ -142,6 +144,7 @@ class OverlayManager(object):
         # Success.
         self.overlays[overlay_id]["position"] = position
         self.app._render()
+        self.app.event.publish("overlay_change", overlay_id, self.overlays[overlay_id])
         self.log.info("reposition_overlay(): Repositioned overlay image with ID: {0} to position: {1}".format(
             overlay_id, position))
         return True
@@ -162,16 +165,31 @@ class OverlayManager(object):
         # Success.
         self.overlays[overlay_id]["image"] = pygame.transform.scale(self.overlays[overlay_id]["image"], scale)
         self.app._render()
+        self.app.event.publish("overlay_change", overlay_id, self.overlays[overlay_id])
         self.log.info("rescale_overlay(): Rescaled overlay image with ID: {0} to size: {1}".format(
             overlay_id, scale))
         return True
 
-    def _cleanup(self):
+    def _cleanup(self) -> dict:
         """Delete non-persistent overlay images.
+
+        :return: A dict of the removed overlays, by overlay ID, which can be given back to _restore().
         """
         to_remove = []
         for overlay in self.overlays:
             if not self.overlays[overlay]["persistent"]:
                 to_remove.append(overlay)
+        removed = {}
         for overlay in to_remove:
-            del self.overlays[overlay]
+            removed[overlay] = self.overlays.pop(overlay)
+            self.app.event.publish("overlay_remove", overlay, removed[overlay])
+        return removed
+
+    def _restore(self, overlays: dict) -> None:
+        """Put back overlay images that were removed by _cleanup(), when going back to the roomview they were in.
+
+        :param overlays: A dict of overlays by overlay ID, as returned from _cleanup().
+        """
+        for overlay in overlays:
+            self.overlays[overlay] = overlays[overlay]
+            self.app.event.publish("overlay_insert", overlay, overlays[overlay])
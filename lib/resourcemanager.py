@@ -25,18 +25,33 @@
 # IN THE SOFTWARE.
 # **********
 
+import hashlib
+import io
 import json
 import jsonschema
+import mmap
 import os
+import re
+import time
 import traceback
 import sys
-
-from typing import Optional
+from collections import OrderedDict
+from typing import Any, Callable, Iterator, IO, Optional, Union
 
 import pygame
 
 from lib.logger import init, timestamp, Logger
-from lib.util import normalize_path, copy_function
+from lib.resourcestats import ResourceStats
+from lib.util import LRUCache, normalize_path
+
+# Matches the filenames of pre-generated image variants, like "room01@400x300.jpg".
+VARIANT_PATTERN = re.compile(r"^(.*)@(\d+)x(\d+)(\.[^.]*)$")
+
+# How many expired resources to unload in each step of the eviction idle task.
+EVICTIONS_PER_STEP = 8
+
+# The most parsed JSON files from load_json_view() which are kept at once, for loading their other keys.
+JSON_FILE_CACHE_SIZE = 32
 
 
 class ResourceManager(object):
@@ -48,8 +63,23 @@ class ResourceManager(object):
     :ivar log: The Logger instance for this class.
     :ivar tick: The TickManager instance.
     :ivar resources: A dict of all currently loaded resources.
-    :ivar unload_callbacks: A dict of unload() tick callbacks associated with cached resources.
-    :ivar _loaded_schemas: A dict of all currently loaded JSON schemas.
+    :ivar access_times: An ordered dict of expiring resource filenames mapped to when they were last used, on the
+                       simulation clock, oldest first.
+    :ivar _loaded_schemas: A dict of all currently loaded JSON schemas, by world directory and schema name.
+    :ivar _schema_files: A dict of schema file paths mapped to the loaded schemas, so that worlds share common schemas.
+    :ivar _mappings: A dict of open mmap objects backing cached memoryviews from load_mmap().
+    :ivar _stats: The ResourceStats instance which tracks cache behavior.
+    :ivar _pending: A dict of filenames being decoded in the background mapped to their completion callbacks, scale,
+                   and expiry and timing details.
+    :ivar _variants: A dict of image filenames mapped to lists of known resolution variants, as [width, height, path].
+    :ivar _variant_listings: A dict of directories mapped to the pre-generated variants found in them.
+    :ivar _identical: A dict of image file digests and scales mapped to the filename of a loaded image with that
+                      content, so that identical images in different worlds are only loaded once.
+    :ivar _digests: A dict of loaded image filenames mapped to their keys in _identical.
+    :ivar decode: Whether to decode images. If not, as in headless mode, blank surfaces of the right size stand in.
+    :ivar dedupe: Whether to look for identical images. The App turns this on once more than one world is loaded.
+    :ivar _json_files: The recently parsed JSON files from load_json_view(), by filename, as (contents, size in
+                       bytes).
     """
 
     def __init__(self, tick):
@@ -62,8 +92,19 @@ class ResourceManager(object):
         self.tick = tick
 
         self.resources = {}
-        self.unload_callbacks = {}
+        self.access_times = OrderedDict()
         self._loaded_schemas = {}
+        self._schema_files = {}
+        self._mappings = {}
+        self._stats = ResourceStats()
+        self._pending = {}
+        self._variants = {}
+        self._variant_listings = {}
+        self._json_files = LRUCache(JSON_FILE_CACHE_SIZE)
+        self._identical = {}
+        self._digests = {}
+        self.decode = True
+        self.dedupe = False
 
     def __contains__(self, item: str) -> bool:
         if item in self.resources:
@@ -72,8 +113,10 @@ class ResourceManager(object):
 
     def __getitem__(self, item: str) -> Optional[dict]:
         if self.__contains__(item):
-            if item in self.tick:
-                self.tick.renew(item)
+            if item in self.access_times:
+                self.__touch(item)
+            if item in self._stats.resident:
+                self._stats._hit(self._stats.resident[item][0])
             return self.resources[item]
         else:
             return None
@@ -86,9 +129,10 @@ class ResourceManager(object):
         :param schema: The name of the schema type whose file to load. The filename will be "<schema>.json".
         :return: JSON object of the schema file if succeeded, otherwise the engine will exit.
         """
-        # Return the schema if it is already loaded.
-        if schema in self._loaded_schemas:
-            return self._loaded_schemas[schema]
+        # Return the schema if it is already loaded. Each world may have its own version of a schema.
+        world = self.config["world"] if self.config else None
+        if (world, schema) in self._loaded_schemas:
+            return self._loaded_schemas[(world, schema)]
 
         # Begin loading a schema file.
         if self.log:
@@ -104,10 +148,15 @@ class ResourceManager(object):
                 self.log.error("load_schema(): Could not locate schema file: {1}".format(timestamp(), schema + ".json"))
             return None
 
+        # If another world already loaded the same schema file, share it.
+        if schema_fullpath in self._schema_files:
+            self._loaded_schemas[(world, schema)] = self._schema_files[schema_fullpath]
+            return self._loaded_schemas[(world, schema)]
+
         # Attempt to load the schema.
         try:
             with open(schema_fullpath) as f:
-                self._loaded_schemas[schema] = json.load(f)
+                self._loaded_schemas[(world, schema)] = self._schema_files[schema_fullpath] = json.load(f)
 
         # Failed to load the schema.
         except (OSError, IOError):
@@ -130,7 +179,7 @@ class ResourceManager(object):
             return None
 
         # Return the loaded schema.
-        return self._loaded_schemas[schema]
+        return self._loaded_schemas[(world, schema)]
 
     def load_json(self, filename: str, validate: str = None, rootdir: bool = False,
                   noexpire: bool = False) -> Optional[dict]:
@@ -150,13 +199,14 @@ class ResourceManager(object):
         if not rootdir:
             filename = os.path.join(self.config["world"], filename)
 
-        # If the file is already loaded, just return it. Renew the timer if cached.
-        if filename in self.unload_callbacks:
-            if self.unload_callbacks[filename] in self.tick:
-                self.tick.renew(self.unload_callbacks[filename])
+        # If the file is already loaded, just return it. Mark it as used if cached.
+        if filename in self.access_times:
+            self.__touch(filename)
+            self._stats._hit("json")
             return self.resources[filename]
 
         # Attempt to load and optionally validate the JSON file.
+        start_time = time.perf_counter()
         try:
             self.log.info("load_json(): Loading JSON file: {0}".format(filename))
             with open(filename) as f:
@@ -170,11 +220,12 @@ class ResourceManager(object):
                     jsonschema.validate(rsrc, schema)
 
                 # Success.
-                # Register a tick callback to delete this resource later if caching is enabled.
+                # Start tracking this resource for expiry if caching is enabled.
                 self.resources[filename] = rsrc
                 if self.config["cache"]["enabled"] and not noexpire:
-                    self.unload_callbacks[filename] = copy_function(self.unload)
-                    self.tick.register(self.unload_callbacks[filename], self.config["cache"]["ttl"], [self, filename])
+                    self.__touch(filename)
+                self._stats._loaded("json", filename, os.fstat(f.fileno()).st_size,
+                                    (time.perf_counter() - start_time) * 1000)
                 self.log.info("load_json(): Finished loading JSON file: {0}".format(filename))
                 return self.resources[filename]
 
@@ -196,6 +247,90 @@ class ResourceManager(object):
             print(traceback.format_exc(1))
             return None
 
+    def load_json_view(self, filename: str, view: str, validate: str = None, rootdir: bool = False,
+                       noexpire: bool = False) -> Optional[Any]:
+        """Load the value of one top level key from a JSON file, such as one view from a room descriptor.
+
+        The whole file is parsed once and kept for a while, but only the requested value is validated. The others are
+        left alone until they are requested too. Each validated value is cached separately, as "<filename>:<key>".
+
+        :param filename: The filename of the JSON file to load from.
+        :param view: The top level key whose value to load.
+        :param validate: If set, the schema type to validate with. (Filename minus the ".json".) The value is validated
+                         as if it were the only key in the file.
+        :param rootdir: Whether to search from the engine root directory instead of the world directory.
+        :param noexpire: If true, the value never expires from the cache.
+
+        :return: The value if succeeded, None if failed.
+        """
+        # Normalize the path to a Unix-style path for internal consistency.
+        filename = normalize_path(filename)
+
+        # If we're not searching from the root directory, prepend the world directory.
+        if not rootdir:
+            filename = os.path.join(self.config["world"], filename)
+        resource_name = "{0}:{1}".format(filename, view)
+
+        # If the value is already loaded, just return it. Mark it as used if cached.
+        if resource_name in self.resources:
+            if resource_name in self.access_times:
+                self.__touch(resource_name)
+            self._stats._hit("json")
+            return self.resources[resource_name]
+
+        # Attempt to get the value, parsing the file if we haven't recently.
+        start_time = time.perf_counter()
+        try:
+            self.log.info("load_json_view(): Loading JSON file: {0}, key: {1}".format(filename, view))
+            if filename not in self._json_files:
+                with open(filename, "rb") as f:
+                    data = f.read()
+                contents = json.loads(data)
+                if type(contents) is not dict:
+                    raise json.JSONDecodeError("Expecting an object", filename, 0)
+                self._json_files[filename] = (contents, len(data))
+            contents, size = self._json_files[filename]
+            if view not in contents:
+                self.log.error("load_json_view(): No such key in JSON file: {0}: {1}".format(filename, view))
+                return None
+            rsrc = contents[view]
+
+            # Load the appropriate schema and attempt validation.
+            if validate:
+                schema = self.load_schema(validate)
+                if not schema:
+                    return None
+                jsonschema.validate({view: rsrc}, schema)
+
+            # Success.
+            # Start tracking this resource for expiry if caching is enabled.
+            self.resources[resource_name] = rsrc
+            if self.config["cache"]["enabled"] and not noexpire:
+                self.__touch(resource_name)
+            # Count each value as an equal share of the size of the file.
+            self._stats._loaded("json", resource_name, size // len(contents),
+                                (time.perf_counter() - start_time) * 1000)
+            self.log.info("load_json_view(): Finished loading JSON file: {0}, key: {1}".format(filename, view))
+            return rsrc
+
+        # Failed to open the JSON file.
+        except (OSError, IOError):
+            self.log.error("load_json_view(): Could not open JSON file: {0}".format(filename))
+            print(traceback.format_exc(1))
+            return None
+
+        # Failed to decode the JSON file due to JSON error.
+        except json.JSONDecodeError:
+            self.log.error("load_json_view(): JSON error from file: {0}: {1}".format(filename, view))
+            print(traceback.format_exc(1))
+            return None
+
+        # The JSON file failed validation.
+        except jsonschema.ValidationError:
+            self.log.error("load_json_view(): JSON schema validation error from file: {0}: {1}".format(filename, view))
+            print(traceback.format_exc(1))
+            return None
+
     def load_image(self, filename: str, scale: tuple = None, rootdir: bool = False,
                    noexpire: bool = False) -> Optional[pygame.Surface]:
         """Load an image file.
@@ -214,18 +349,33 @@ class ResourceManager(object):
         if not rootdir:
             filename = os.path.join(self.config["world"], filename)
 
-        # If the file is already loaded, just return it. Renew the timer if cached.
-        if filename in self.unload_callbacks:
-            if self.unload_callbacks[filename] in self.tick:
-                self.tick.renew(self.unload_callbacks[filename])
+        # If the file is already loaded, just return it. Mark it as used if cached.
+        if filename in self.access_times:
+            self.__touch(filename)
+            self._stats._hit("image")
             return self.resources[filename]
 
+        # We are not decoding images.
+        if not self.decode:
+            return self.__blank(filename, scale, noexpire)
+
+        # Another world may have the same image loaded already.
+        rsrc = self.__find_identical(filename, scale, noexpire)
+        if rsrc:
+            return rsrc
+
         # Attempt to load and optionally scale the image.
+        start_time = time.perf_counter()
         try:
-            # We are going to scale the image.
+            # We are going to scale the image. Start from the smallest resolution variant that is big enough.
+            # If we had to decode the full image, and it is much bigger than we need, make a variant for next time.
             if scale:
-                rsrc = pygame.transform.scale(pygame.image.load(filename), scale)
-                self.log.info("load_image(): Loading image file: {0}, at scale: {1}".format(filename, scale))
+                variant = self.__find_variant(filename, scale)
+                self.log.info("load_image(): Loading image file: {0}, at scale: {1}".format(variant, scale))
+                image = pygame.image.load(variant)
+                if variant == filename and self.config["cache"].get("variants"):
+                    self.__submit_variant(filename, image, scale)
+                rsrc = pygame.transform.scale(image, scale)
 
             # We are not going to scale the image.
             else:
@@ -233,11 +383,13 @@ class ResourceManager(object):
                 rsrc = pygame.image.load(filename)
 
             # Success.
-            # Register a tick callback to delete this resource later if caching is enabled.
+            # Start tracking this resource for expiry if caching is enabled.
             self.resources[filename] = rsrc
             if self.config["cache"]["enabled"] and not noexpire:
-                self.unload_callbacks[filename] = copy_function(self.unload)
-                self.tick.register(self.unload_callbacks[filename], self.config["cache"]["ttl"], [self, filename])
+                self.__touch(filename)
+            self.__remember_identical(filename)
+            self._stats._loaded("image", filename, rsrc.get_pitch() * rsrc.get_height(),
+                                (time.perf_counter() - start_time) * 1000)
             self.log.info("load_image(): Finished loading image file: {0}".format(filename))
             return self.resources[filename]
 
@@ -246,6 +398,155 @@ class ResourceManager(object):
             self.log.error("load_image(): Could not load image file: {0}".format(filename))
             return None
 
+    def load_image_progressive(self, filename: str, scale: tuple, callback: Callable, rootdir: bool = False,
+                               noexpire: bool = False) -> Optional[pygame.Surface]:
+        """Load an image file in the background, returning a low resolution placeholder immediately.
+
+        If the image is already cached, it is returned directly and the callback is never called. Otherwise, the image
+        is decoded and scaled on a worker thread, and the callback is called from the main loop with the finished
+        surface, or None if loading failed. In the meantime, a tiny thumbnail from the sidecar cache is returned,
+        scaled up to the requested size. If there is no thumbnail yet, a black surface is returned instead, and the
+        thumbnail is generated during the background decode for next time.
+
+        :param filename: The filename of the image to load.
+        :param scale: A two-member tuple of the width and height to scale the image to.
+        :param callback: A function taking one argument, to be called with the full resolution surface.
+        :param rootdir: Whether to search from the engine root directory instead of the world directory.
+        :param noexpire: If true, this file never expires from the cache.
+
+        :return: PyGame surface, which may be a placeholder, if succeeded, None if failed.
+        """
+        # Normalize the path to a Unix-style path for internal consistency.
+        filename = normalize_path(filename)
+
+        # If we're not searching from the root directory, prepend the world directory.
+        if not rootdir:
+            filename = os.path.join(self.config["world"], filename)
+
+        # If the file is already loaded, just return it. Mark it as used if cached.
+        if filename in self.access_times:
+            self.__touch(filename)
+            self._stats._hit("image")
+            return self.resources[filename]
+
+        # We can tell right away if the file is missing.
+        if not os.path.exists(filename):
+            self.log.error("load_image_progressive(): Could not load image file: {0}".format(filename))
+            return None
+
+        # We are not decoding images.
+        if not self.decode:
+            return self.__blank(filename, scale, noexpire)
+
+        # Load the thumbnail to use as a placeholder, if there is an up to date one.
+        thumbnail_path = os.path.join(self.__sidecar_dir("thumbnails", filename), os.path.basename(filename) + ".png")
+        placeholder = None
+        if os.path.exists(thumbnail_path) and os.path.getmtime(thumbnail_path) >= os.path.getmtime(filename):
+            try:
+                placeholder = pygame.transform.scale(pygame.image.load(thumbnail_path), scale)
+            except:
+                self.log.warn("load_image_progressive(): Could not load thumbnail file: {0}".format(thumbnail_path))
+
+        # If there is no usable thumbnail, fall back to a black placeholder, and have the decode make a thumbnail.
+        make_thumbnail = placeholder is None
+        if make_thumbnail:
+            placeholder = pygame.Surface(scale)
+
+        # If the image is already being decoded, just wait for that to finish.
+        if filename in self._pending:
+            self._pending[filename]["callbacks"].append(callback)
+            return placeholder
+
+        # Start decoding the image on a worker thread. Only generate a thumbnail if we don't have one.
+        # If deduplicating, the worker also takes the digest of the image, which is looked up once it is done.
+        self.log.info("load_image_progressive(): Loading image file in background: {0}, at scale: {1}".format(
+            filename, scale))
+        self._pending[filename] = {"callbacks": [callback], "scale": scale, "noexpire": noexpire,
+                                   "start_time": time.perf_counter()}
+        variant = self.__find_variant(filename, scale)
+        self.tick.run_in_background(self.__decode_image, variant, scale, thumbnail_path if make_thumbnail else None,
+                                    self.config["cache"].get("thumbnail_size", [32, 24]),
+                                    self.__variant_dir(filename) if variant == filename and
+                                    self.config["cache"].get("variants") else None,
+                                    filename if self.dedupe else None,
+                                    on_done=lambda result: self.__finish_decode(filename, *result))
+        return placeholder
+
+    def load_images(self, filenames: list, scale: tuple = None, rootdir: bool = False,
+                    noexpire: bool = False) -> dict:
+        """Load several image files at once, decoding them in parallel.
+
+        Files are read and decoded on the worker thread pool, and the finished surfaces are cached on the calling thread
+        just like with load_image(). This is mostly useful for preloading many assets at startup.
+
+        :param filenames: A list of filenames of the images to load.
+        :param scale: A two-member tuple of the width and height to scale the images to.
+        :param rootdir: Whether to search from the engine root directory instead of the world directory.
+        :param noexpire: If true, these files never expire from the cache.
+
+        :return: Dictionary of the given filenames mapped to PyGame surfaces, or None for images which failed to load.
+        """
+        loaded = {}
+        futures = {}
+        for name in filenames:
+            # Normalize the path to a Unix-style path for internal consistency.
+            filename = normalize_path(name)
+
+            # If we're not searching from the root directory, prepend the world directory.
+            if not rootdir:
+                filename = os.path.join(self.config["world"], filename)
+
+            # If the file is already loaded, just use it. Mark it as used if cached.
+            if filename in self.access_times:
+                self.__touch(filename)
+                self._stats._hit("image")
+                loaded[name] = self.resources[filename]
+
+            # We are not decoding images.
+            elif not self.decode:
+                loaded[name] = self.__blank(filename, scale, noexpire)
+
+            # Otherwise, start decoding it, from the smallest resolution variant that is big enough.
+            # If deduplicating, take the digest of the image on a worker thread as well.
+            else:
+                variant = self.__find_variant(filename, scale)
+                self.log.info("load_images(): Loading image file: {0}".format(variant))
+                futures[name] = (filename, self.tick.run_in_background(self.__read_image, variant, scale),
+                                 self.tick.run_in_background(self.__digest, filename) if self.dedupe else None,
+                                 time.perf_counter())
+
+        # Collect the decoded images in order and attach them to the cache.
+        for name in futures:
+            filename, future, digest_future, start_time = futures[name]
+
+            # Another world may have the same image loaded already.
+            if digest_future and digest_future.exception() is None and \
+                    self.__find_identical(filename, scale, noexpire, digest_future.result()):
+                loaded[name] = self.resources[filename]
+                continue
+            try:
+                rsrc = future.result()
+
+            # We were unable to load the image.
+            except:
+                self.log.error("load_images(): Could not load image file: {0}".format(filename))
+                loaded[name] = None
+                continue
+
+            # Success.
+            # Start tracking this resource for expiry if caching is enabled.
+            self.resources[filename] = rsrc
+            if self.config["cache"]["enabled"] and not noexpire:
+                self.__touch(filename)
+            self.__remember_identical(filename)
+            self._stats._loaded("image", filename, rsrc.get_pitch() * rsrc.get_height(),
+                                (time.perf_counter() - start_time) * 1000)
+            self.log.info("load_images(): Finished loading image file: {0}".format(filename))
+            loaded[name] = rsrc
+
+        # Done.
+        return loaded
+
     def load_raw(self, filename: str, binary: bool = False, rootdir: bool = False,
                  noexpire: bool = False) -> Optional[dict]:
         """Load any kind of file.
@@ -264,10 +565,10 @@ class ResourceManager(object):
         if not rootdir:
             filename = os.path.join(self.config["world"], filename)
 
-        # If the file is already loaded, just return it. Renew the timer if cached.
-        if filename in self.unload_callbacks:
-            if self.unload_callbacks[filename] in self.tick:
-                self.tick.renew(self.unload_callbacks[filename])
+        # If the file is already loaded, just return it. Mark it as used if cached.
+        if filename in self.access_times:
+            self.__touch(filename)
+            self._stats._hit("raw")
             return self.resources[filename]
 
         # Attempt to load the file in binary or text mode.
@@ -275,16 +576,17 @@ class ResourceManager(object):
             mode = 'rb'
         else:
             mode = 'rt'
+        start_time = time.perf_counter()
         try:
             with open(filename, mode) as f:
                 rsrc = f.read()
 
                 # Success.
-                # Register a tick callback to delete this resource later if caching is enabled.
+                # Start tracking this resource for expiry if caching is enabled.
                 self.resources[filename] = rsrc
                 if self.config["cache"]["enabled"] and not noexpire:
-                    self.unload_callbacks[filename] = copy_function(self.unload)
-                    self.tick.register(self.unload_callbacks[filename], self.config["cache"]["ttl"], [self, filename])
+                    self.__touch(filename)
+                self._stats._loaded("raw", filename, len(rsrc), (time.perf_counter() - start_time) * 1000)
                 self.log.info("load_raw(): Finished loading raw file: {0}".format(filename))
                 return self.resources[filename]
 
@@ -294,6 +596,109 @@ class ResourceManager(object):
             print(traceback.format_exc(1))
             return None
 
+    def load_stream(self, filename: str, binary: bool = False, chunk_size: int = None,
+                    rootdir: bool = False) -> Optional[Union[IO, Iterator]]:
+        """Open any kind of file for streaming, without reading it into memory.
+
+        Streams are never cached. If chunk_size is not given, an open file object is returned, and the caller is
+        responsible for closing it (preferably with a "with" statement). Otherwise, an iterator is returned which
+        yields chunks of at most chunk_size characters or bytes, and closes the file when exhausted.
+
+        :param filename: The filename of the file to open.
+        :param binary: Whether to open the file in binary mode.
+        :param chunk_size: If set, return an iterator over chunks of this size instead of a file object.
+        :param rootdir: Whether to search from the engine root directory instead of the world directory.
+
+        :return: File object or chunk iterator if succeeded, None if failed.
+        """
+        # Normalize the path to a Unix-style path for internal consistency.
+        filename = normalize_path(filename)
+
+        # If we're not searching from the root directory, prepend the world directory.
+        if not rootdir:
+            filename = os.path.join(self.config["world"], filename)
+
+        # Attempt to open the file in binary or text mode.
+        if binary:
+            mode = 'rb'
+        else:
+            mode = 'rt'
+        try:
+            f = open(filename, mode)
+        except (OSError, IOError):
+            self.log.error("load_stream(): Could not open file: {0}".format(filename))
+            print(traceback.format_exc(1))
+            return None
+
+        # Success.
+        self.log.info("load_stream(): Opened file for streaming: {0}".format(filename))
+        if not chunk_size:
+            return f
+        return self.__iter_chunks(f, chunk_size)
+
+    def load_mmap(self, filename: str, rootdir: bool = False, noexpire: bool = False) -> Optional[memoryview]:
+        """Map any kind of file into memory, read-only.
+
+        The file's contents are not copied onto the heap; pages are read from disk by the operating system as they are
+        accessed. A read-only memoryview of the mapping is returned, which supports slicing and the buffer protocol
+        without copying. Use bytes() on a slice to get a copy of just that part.
+
+        :param filename: The filename of the file to map.
+        :param rootdir: Whether to search from the engine root directory instead of the world directory.
+        :param noexpire: If true, this mapping never expires from the cache.
+
+        :return: Read-only memoryview if succeeded, None if failed.
+        """
+        # Normalize the path to a Unix-style path for internal consistency.
+        filename = normalize_path(filename)
+
+        # If we're not searching from the root directory, prepend the world directory.
+        if not rootdir:
+            filename = os.path.join(self.config["world"], filename)
+
+        # If the file is already mapped, just return it. Mark it as used if cached.
+        if filename in self.access_times:
+            self.__touch(filename)
+            self._stats._hit("mmap")
+            return self.resources[filename]
+
+        # Attempt to map the file. Empty files cannot be mapped, so they get an empty view instead.
+        start_time = time.perf_counter()
+        try:
+            with open(filename, 'rb') as f:
+                if os.fstat(f.fileno()).st_size:
+                    self._mappings[filename] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    rsrc = memoryview(self._mappings[filename])
+                else:
+                    rsrc = memoryview(b"")
+
+                # Success.
+                # Start tracking this resource for expiry if caching is enabled.
+                # The mapping itself costs almost nothing to keep, since the pages live in the OS page cache.
+                self.resources[filename] = rsrc
+                if self.config["cache"]["enabled"] and not noexpire:
+                    self.__touch(filename)
+                self._stats._loaded("mmap", filename, 0, (time.perf_counter() - start_time) * 1000)
+                self.log.info("load_mmap(): Finished mapping file: {0}".format(filename))
+                return self.resources[filename]
+
+        # Failed to open or map the file.
+        except (OSError, IOError, ValueError):
+            self.log.error("load_mmap(): Could not map file: {0}".format(filename))
+            print(traceback.format_exc(1))
+            return None
+
+    def stats(self) -> dict:
+        """Get a snapshot of resource cache statistics.
+
+        This includes hits, misses, evictions and reloads, the number of bytes resident in the cache, and load latency
+        histograms, each broken down by resource type ("image", "json", "raw", or "mmap"). Latency histograms are also
+        kept for each directory that resources were loaded from. Memory mappings are counted as zero bytes.
+
+        :return: Dictionary of statistics.
+        """
+        return self._stats.stats()
+
     def unload(self, filename: str) -> bool:
         """Unload a loaded resource, freeing its memory.
 
@@ -304,13 +709,23 @@ class ResourceManager(object):
         if filename in self.resources:
             # Delete the resource from the registry.
             del self.resources[filename]
+            self._stats._evicted(filename)
 
-            # If a cache timer exists in TickManager for this resource, unregister it.
-            if self.unload_callbacks[filename] in self.tick:
-                self.tick.unregister(self.unload_callbacks[filename])
-
-            # Delete the unload callback from its registry.
-            del self.unload_callbacks[filename]
+            # If the resource is a memory mapping, close it. If a script still holds a view into the mapping, closing
+            # fails and the mapping is left for the garbage collector instead.
+            if filename in self._mappings:
+                try:
+                    self._mappings[filename].close()
+                except BufferError:
+                    pass
+                del self._mappings[filename]
+
+            # Stop tracking the resource for expiry, and stop offering it as identical to other images.
+            self.access_times.pop(filename, None)
+            if filename in self._digests:
+                key = self._digests.pop(filename)
+                if self._identical.get(key) == filename:
+                    del self._identical[key]
 
             # Success.
             self.log.debug("unload(): Unloaded resource: {0}".format(filename))
@@ -321,6 +736,114 @@ class ResourceManager(object):
             self.log.error("unload(): Attempt to unload nonexistent resource: {0}".format(filename))
             return False
 
+    def __blank(self, filename: str, scale: Optional[tuple], noexpire: bool) -> Optional[pygame.Surface]:
+        """Cache a blank surface in place of an image file, without decoding it, when image decoding is turned off.
+
+        :param filename: The full filename of the image.
+        :param scale: The scale the image is wanted at, if any. Otherwise the surface is a single pixel.
+        :param noexpire: If true, the surface never expires from the cache.
+
+        :return: The blank PyGame surface if the image file exists, otherwise None.
+        """
+        if not os.path.exists(filename):
+            self.log.error("__blank(): Could not load image file: {0}".format(filename))
+            return None
+        self.resources[filename] = pygame.Surface(scale if scale else (1, 1))
+        if self.config["cache"]["enabled"] and not noexpire:
+            self.__touch(filename)
+        self._stats._loaded("image", filename, 0, 0.0)
+        return self.resources[filename]
+
+    def __find_identical(self, filename: str, scale: Optional[tuple], noexpire: bool,
+                         digest: bytes = None) -> Optional[pygame.Surface]:
+        """Look for a loaded image with the same content and scale as an image file, if deduplication is on.
+
+        If one is found, it is cached under this filename too, and returned. Otherwise the digest of the file is
+        remembered, so that __remember_identical() can offer this image to others once it has been loaded.
+
+        :param filename: The full filename of the image.
+        :param scale: The scale the image is wanted at, if any.
+        :param noexpire: If true, the image never expires from the cache under this filename.
+        :param digest: The digest of the file, if it was already taken on a worker thread. Otherwise it is taken here.
+
+        :return: The identical PyGame surface if found, otherwise None.
+        """
+        if not self.dedupe:
+            return None
+        if digest is None:
+            try:
+                digest = self.__digest(filename)
+            except OSError:
+                return None
+        key = (digest, tuple(scale) if scale else None)
+        self._digests[filename] = key
+        if key not in self._identical or self._identical[key] not in self.resources:
+            return None
+
+        # Found one. Share it.
+        self.resources[filename] = self.resources[self._identical[key]]
+        if self.config["cache"]["enabled"] and not noexpire:
+            self.__touch(filename)
+        self._stats._hit("image")
+        self.log.info("__find_identical(): Sharing identical image: {0}: {1}".format(filename, self._identical[key]))
+        return self.resources[filename]
+
+    @staticmethod
+    def __digest(filename: str) -> bytes:
+        """Take the digest of the content of a file, for finding identical images. This is safe to run on a worker.
+
+        :param filename: The full filename of the image.
+
+        :return: The digest. Raises an exception if reading failed.
+        """
+        with open(filename, "rb") as f:
+            return hashlib.blake2b(f.read(), digest_size=16).digest()
+
+    def __remember_identical(self, filename: str) -> None:
+        """Offer a newly loaded image to others with the same content and scale, if its digest was taken.
+
+        :param filename: The full filename of the image.
+        """
+        if filename in self._digests:
+            self._identical[self._digests[filename]] = filename
+
+    def __touch(self, filename: str) -> None:
+        """Mark a cached resource as just used, which moves it to the back of the expiry order.
+
+        :param filename: The filename of the resource.
+        """
+        self.access_times[filename] = self.tick.now
+        self.access_times.move_to_end(filename)
+
+    def __sweep(self) -> None:
+        """Tick callback which finds expired resources.
+
+        Since access_times is kept in order of last use, only the expired resources at the front need to be looked at.
+        They are not unloaded right away, but handed to an idle task, so that evictions don't pile up in a busy frame.
+        """
+        expiry = self.tick.now - self.config["cache"]["ttl"]
+        expired = []
+        for filename, last_used in self.access_times.items():
+            if last_used > expiry:
+                break
+            expired.append(filename)
+        if expired:
+            self.tick.add_idle_task(self.__evict(expired))
+
+    def __evict(self, expired: list) -> Iterator[None]:
+        """Idle task which unloads expired resources, a few per step.
+
+        Resources which were unloaded or used again since they were found to be expired are left alone.
+
+        :param expired: A list of filenames of expired resources.
+        """
+        for index, filename in enumerate(expired, 1):
+            if filename in self.access_times and \
+                    self.access_times[filename] <= self.tick.now - self.config["cache"]["ttl"]:
+                self.unload(filename)
+            if not index % EVICTIONS_PER_STEP:
+                yield
+
     def _load_initial_config(self, filename: str) -> dict:
         """Load the engine configuration file.
 
@@ -358,6 +881,15 @@ class ResourceManager(object):
                      self.config["log"]["wait_on_critical"])  # This is the init() from Logger.
                 self.log = Logger("Resource")
 
+                # Periodically look for expired resources if caching is enabled.
+                if self.config["cache"]["enabled"]:
+                    self.tick.register(self.__sweep, self.config["cache"].get("sweep_interval", 1000), continuous=True)
+
+                # If requested, periodically write the cache statistics to the log.
+                if self.config["cache"].get("stats_interval"):
+                    self.tick.register(self._stats._dump, self.config["cache"]["stats_interval"], [self.log],
+                                       continuous=True)
+
                 # Success.
                 return self.config
 
@@ -390,19 +922,271 @@ class ResourceManager(object):
         :return: The updated dict of images.
         """
         # Iterate through the common images and check if replacements are present.
+        # If a replacement exists, start decoding a scaled version of it on the worker thread pool.
+        futures = {}
         for image_name in images:
             image_path = os.path.join(self.config["world"], "common/"+image_name+".png")
             if os.path.exists(image_path):
-                # If a replacement exists, load a scaled version and replace our current version.
-                try:
-                    rsrc = pygame.transform.scale(pygame.image.load(image_path),
-                                                         self.config["navigation"]["indicator_size"])
-                    self.resources["common/"+image_name+".png"] = rsrc
-                    images[image_name] = rsrc
+                futures[image_name] = (image_path, self.tick.run_in_background(
+                    self.__read_image, image_path, self.config["navigation"]["indicator_size"]))
 
-                # Loading one of these failed, so give an error for that one and keep the original.
-                except:
-                    self.log.error("load_image(): Could not load image file: {0}".format(image_path))
+        # Replace our current versions with the decoded replacements.
+        for image_name in futures:
+            image_path, future = futures[image_name]
+            try:
+                rsrc = future.result()
+                self.resources["common/"+image_name+".png"] = rsrc
+                images[image_name] = rsrc
+
+            # Loading one of these failed, so give an error for that one and keep the original.
+            except:
+                self.log.error("load_image(): Could not load image file: {0}".format(image_path))
 
         # Success.
         return images
+
+    @staticmethod
+    def __iter_chunks(f: IO, chunk_size: int) -> Iterator:
+        """Yield chunks from an open file until it is exhausted, then close it.
+
+        :param f: The open file object to read from.
+        :param chunk_size: The maximum size of each chunk.
+        """
+        with f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    @staticmethod
+    def __decode_image(variant: str, scale: tuple, thumbnail_path: Optional[str], thumbnail_size: tuple,
+                       variant_dir: Optional[str], digest_file: Optional[str]) -> tuple:
+        """Decode and scale an image on a worker thread, optionally writing a thumbnail and a variant to the cache.
+
+        This never touches the rest of the ResourceManager, which is not thread safe.
+
+        :param variant: The full filename of the resolution variant of the image to decode.
+        :param scale: A two-member tuple of the width and height to scale the image to.
+        :param thumbnail_path: If set, where to write a thumbnail of the image.
+        :param thumbnail_size: A two-member tuple of the width and height of the thumbnail.
+        :param variant_dir: If set, the sidecar cache directory to write a smaller resolution variant into.
+        :param digest_file: If set, the full filename of the image to take the digest of, for deduplication.
+
+        :return: A tuple of the surface or None if decoding failed, an error traceback string or None, and the digest
+                 or None.
+        """
+        try:
+            image = ResourceManager.__read_image(variant)
+            rsrc = pygame.transform.scale(image, scale)
+            digest = ResourceManager.__digest(digest_file) if digest_file else None
+        except:
+            return None, traceback.format_exc(1).rstrip(), None
+
+        # A failure to write the thumbnail is only worth a warning.
+        error = None
+        if thumbnail_path:
+            try:
+                os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+                # Smooth scaling only works on 24 and 32 bit images, so palettized images get plain scaling.
+                if image.get_bitsize() >= 24:
+                    thumbnail = pygame.transform.smoothscale(image, thumbnail_size)
+                else:
+                    thumbnail = pygame.transform.scale(image, thumbnail_size)
+                pygame.image.save(thumbnail, thumbnail_path)
+            except:
+                error = traceback.format_exc(1).rstrip()
+        if variant_dir:
+            try:
+                ResourceManager.__write_variant(image, scale, variant_dir, os.path.splitext(variant)[1])
+            except:
+                error = traceback.format_exc(1).rstrip()
+        return rsrc, error, digest
+
+    @staticmethod
+    def __read_image(filename: str, scale: tuple = None) -> pygame.Surface:
+        """Read an image file into memory and decode it, optionally scaling it. This is safe to run on a worker thread.
+
+        The whole file is read in one go and decoded from the in-memory bytes, so that the worker spends as little
+        time as possible holding the file open, and PyGame can decode without holding the GIL.
+
+        :param filename: The full filename of the image to decode.
+        :param scale: If set, a two-member tuple of the width and height to scale the image to.
+
+        :return: PyGame surface. Raises an exception if reading or decoding failed.
+        """
+        with open(filename, 'rb') as f:
+            data = f.read()
+        image = pygame.image.load(io.BytesIO(data), filename)
+        if scale:
+            image = pygame.transform.scale(image, scale)
+        return image
+
+    def __finish_decode(self, filename: str, rsrc: Optional[pygame.Surface], error: Optional[str],
+                        digest: Optional[bytes]) -> None:
+        """Cache an image that finished decoding in the background, and call its completion callbacks.
+
+        This is called on the main thread by TickManager. If another world has an identical image loaded by now, that
+        one is shared instead, and the newly decoded surface is dropped.
+
+        :param filename: The full filename of the image.
+        :param rsrc: The decoded surface, or None if decoding failed.
+        :param error: An error traceback string, or None.
+        :param digest: The digest of the image file, if deduplicating, or None.
+        """
+        pending = self._pending.pop(filename)
+
+        # The decode may have written a new resolution variant, so search for variants again next time.
+        self._variants.pop(filename, None)
+
+        # The background decode failed.
+        if rsrc is None:
+            self.log.error("load_image_progressive(): Could not load image file: {0}\n{1}".format(filename, error))
+
+        # Another world has the same image loaded already.
+        elif digest and self.__find_identical(filename, pending["scale"], pending["noexpire"], digest):
+            rsrc = self.resources[filename]
+
+        # Success.
+        # Start tracking this resource for expiry if caching is enabled.
+        else:
+            if error:
+                self.log.warn("load_image_progressive(): Could not write to the cache for image file: {0}\n{1}".format(
+                    filename, error))
+            self.resources[filename] = rsrc
+            if self.config["cache"]["enabled"] and not pending["noexpire"]:
+                self.__touch(filename)
+            self.__remember_identical(filename)
+            self._stats._loaded("image", filename, rsrc.get_pitch() * rsrc.get_height(),
+                                (time.perf_counter() - pending["start_time"]) * 1000)
+            self.log.info("load_image_progressive(): Finished loading image file: {0}".format(filename))
+
+        # Hand the surface over to everyone who was waiting for it.
+        for callback in pending["callbacks"]:
+            callback(rsrc)
+
+    def __find_variant(self, filename: str, scale: Optional[tuple]) -> str:
+        """Find the smallest resolution variant of an image which is at least as big as the given scale.
+
+        Variants are either pre-generated next to the image, named like "room01@400x300.jpg" for "room01.jpg", or
+        generated lazily into the sidecar cache when the "variants" cache option is enabled. The list of variants is
+        remembered for each image, so the filesystem is only searched once.
+
+        :param filename: The full filename of the image.
+        :param scale: A two-member tuple of the width and height the image will be scaled to, or None.
+
+        :return: The full filename of the best variant, or the original filename if there is no suitable variant.
+        """
+        if not scale:
+            return filename
+
+        # Search the filesystem for variants if we haven't already.
+        if filename not in self._variants:
+            variants = []
+            directory, base = os.path.split(filename)
+            stem, ext = os.path.splitext(base)
+
+            # Look for pre-generated variants next to the image. Each directory is only listed once.
+            if directory not in self._variant_listings:
+                listing = {}
+                try:
+                    for entry in os.listdir(directory or "."):
+                        match = VARIANT_PATTERN.match(entry)
+                        if match:
+                            listing.setdefault(match.group(1) + match.group(4), []).append(
+                                [int(match.group(2)), int(match.group(3)), os.path.join(directory, entry)])
+                except OSError:
+                    pass
+                self._variant_listings[directory] = listing
+            variants.extend(self._variant_listings[directory].get(base, []))
+
+            # Look for lazily generated variants in the sidecar cache, ignoring any that are older than the image.
+            variant_dir = self.__variant_dir(filename)
+            if os.path.isdir(variant_dir):
+                mtime = os.path.getmtime(filename)
+                for entry in os.listdir(variant_dir):
+                    match = VARIANT_PATTERN.match("@" + entry)
+                    variant_path = os.path.join(variant_dir, entry)
+                    if match and os.path.getmtime(variant_path) >= mtime:
+                        variants.append([int(match.group(2)), int(match.group(3)), variant_path])
+            self._variants[filename] = variants
+
+        # Pick the smallest variant that is at least as big as the scale in both dimensions.
+        best = None
+        for width, height, path in self._variants[filename]:
+            if width >= scale[0] and height >= scale[1] and (best is None or width * height < best[0] * best[1]):
+                best = [width, height, path]
+        if best:
+            return best[2]
+        return filename
+
+    def __sidecar_dir(self, kind: str, filename: str) -> str:
+        """Get the directory in the sidecar cache for files derived from an image, like thumbnails.
+
+        The directory is named for a hash of the absolute path of the image, so that images from any world, wherever
+        it is, neither collide with each other nor end up outside of the cache.
+
+        :param kind: The kind of derived files, which is the name of their subdirectory in the cache.
+        :param filename: The full filename of the image.
+
+        :return: The directory path.
+        """
+        key = hashlib.blake2b(normalize_path(os.path.abspath(filename)).encode("utf-8"), digest_size=8).hexdigest()
+        return os.path.join(self.config["cache"].get("dir", "cache"), kind, key)
+
+    def __variant_dir(self, filename: str) -> str:
+        """Get the sidecar cache directory for lazily generated resolution variants of an image.
+
+        :param filename: The full filename of the image.
+
+        :return: The directory path.
+        """
+        return self.__sidecar_dir("variants", filename)
+
+    def __submit_variant(self, filename: str, image: pygame.Surface, scale: tuple) -> None:
+        """Generate a smaller resolution variant of a full size image on a worker thread.
+
+        The list of known variants for the image is forgotten once the variant is written, so it will be found on the
+        next search. If writing the variant fails, the error is logged by TickManager.
+
+        :param filename: The full filename of the image.
+        :param image: The decoded full size image. The worker is given its own copy, since the caller keeps using it.
+        :param scale: A two-member tuple of the width and height the image is being scaled to.
+        """
+        self.tick.run_in_background(self.__write_variant, image.copy(), scale, self.__variant_dir(filename),
+                                    os.path.splitext(filename)[1],
+                                    on_done=lambda path: self._variants.pop(filename, None))
+
+    @staticmethod
+    def __write_variant(image: pygame.Surface, scale: tuple, variant_dir: str, ext: str) -> Optional[str]:
+        """Write the smallest power of two reduction of an image that is still at least as big as the given scale.
+
+        This is like choosing a mip level. Nothing is written if the image is less than twice as big as the scale.
+        This is safe to run on a worker thread.
+
+        :param image: The decoded full size image.
+        :param scale: A two-member tuple of the width and height the image is being scaled to.
+        :param variant_dir: The sidecar cache directory to write the variant into.
+        :param ext: The file extension of the original image, which decides the format of the variant.
+
+        :return: The path of the written variant, or None if no variant was needed.
+        """
+        width, height = image.get_size()
+        while width // 2 >= scale[0] and height // 2 >= scale[1]:
+            width //= 2
+            height //= 2
+        if [width, height] == list(image.get_size()):
+            return None
+
+        # JPEG sources get JPEG variants, which decode faster. Everything else is kept lossless.
+        if ext.lower() not in [".jpg", ".jpeg"]:
+            ext = ".png"
+        variant_path = os.path.join(variant_dir, "{0}x{1}{2}".format(width, height, ext))
+        os.makedirs(variant_dir, exist_ok=True)
+
+        # Smooth scaling only works on 24 and 32 bit images, so palettized images get plain scaling.
+        if image.get_bitsize() >= 24:
+            pygame.image.save(pygame.transform.smoothscale(image, (width, height)), variant_path)
+        else:
+            pygame.image.save(pygame.transform.scale(image, (width, height)), variant_path)
+        return variant_path
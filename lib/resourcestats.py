@@ -0,0 +1,182 @@
+#######################
+# BXEngine            #
+# resourcestats.py    #
+# Copyright 2021-2023 #
+# Sei Satzparad       #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+import os
+
+from lib.util import LRUCache
+
+# Upper bounds of the load latency histogram buckets, in milliseconds. The last bucket catches everything slower.
+LATENCY_BUCKETS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+# How many of the most recently loaded filenames to remember, for recognizing reloads.
+SEEN_CACHE_SIZE = 4096
+
+
+class ResourceStats(object):
+    """Resource Cache Statistics
+
+    Keeps counters and load latency histograms for the ResourceManager, so that cache TTLs and budgets can be tuned.
+    Every counter is kept per resource type, which is one of "image", "json", "raw", or "mmap".
+
+    :ivar hits: A dict of resource types mapped to the number of cache hits.
+    :ivar misses: A dict of resource types mapped to the number of cache misses (loads from disk).
+    :ivar evictions: A dict of resource types mapped to the number of resources unloaded from the cache.
+    :ivar reloads: A dict of resource types mapped to the number of misses for files that had been loaded before.
+    :ivar resident: A dict of currently cached filenames mapped to their resource type and estimated size in bytes.
+    :ivar latency_by_type: A dict of resource types mapped to load latency histograms.
+    :ivar latency_by_prefix: A dict of directory prefixes mapped to load latency histograms.
+    :ivar __seen: An LRUCache of the most recently loaded filenames, used to recognize reloads. A reload of a file
+                 which has dropped out of it is counted as a first load.
+    """
+
+    def __init__(self):
+        """ResourceStats Class Initializer
+        """
+        self.hits = {}
+        self.misses = {}
+        self.evictions = {}
+        self.reloads = {}
+        self.resident = {}  # {filename: [rtype, bytes]}
+        self.latency_by_type = {}
+        self.latency_by_prefix = {}
+        self.__seen = LRUCache(SEEN_CACHE_SIZE)
+
+    def _hit(self, rtype: str) -> None:
+        """Record a cache hit.
+
+        :param rtype: The resource type.
+        """
+        self.hits[rtype] = self.hits.get(rtype, 0) + 1
+
+    def _loaded(self, rtype: str, filename: str, size: int, elapsed: float) -> None:
+        """Record a cache miss, which resulted in a resource being loaded from disk.
+
+        :param rtype: The resource type.
+        :param filename: The full filename of the loaded resource.
+        :param size: The estimated size of the resource in memory, in bytes.
+        :param elapsed: The time it took to load the resource, in milliseconds.
+        """
+        self.misses[rtype] = self.misses.get(rtype, 0) + 1
+        if filename in self.__seen:
+            self.reloads[rtype] = self.reloads.get(rtype, 0) + 1
+        self.__seen[filename] = True
+        self.resident[filename] = [rtype, size]
+
+        # Record the latency for both the type and the directory the file is in.
+        self.__record_latency(self.latency_by_type, rtype, elapsed)
+        self.__record_latency(self.latency_by_prefix, os.path.dirname(filename) or ".", elapsed)
+
+    def _evicted(self, filename: str) -> None:
+        """Record a resource being unloaded from the cache.
+
+        :param filename: The full filename of the unloaded resource.
+        """
+        if filename not in self.resident:
+            return
+        rtype = self.resident[filename][0]
+        self.evictions[rtype] = self.evictions.get(rtype, 0) + 1
+        del self.resident[filename]
+
+    def stats(self) -> dict:
+        """Get a snapshot of all resource cache statistics.
+
+        Latency histograms map the upper bound of each bucket in milliseconds (or "inf") to the number of loads that
+        fell into it, alongside the count, total, and maximum load times.
+
+        :return: Dictionary of statistics.
+        """
+        resident_bytes = {}
+        resident_count = {}
+        for rtype, size in self.resident.values():
+            resident_bytes[rtype] = resident_bytes.get(rtype, 0) + size
+            resident_count[rtype] = resident_count.get(rtype, 0) + 1
+
+        return {
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "evictions": dict(self.evictions),
+            "reloads": dict(self.reloads),
+            "resident_bytes": resident_bytes,
+            "resident_count": resident_count,
+            "latency_by_type": self.__export_latency(self.latency_by_type),
+            "latency_by_prefix": self.__export_latency(self.latency_by_prefix)
+        }
+
+    def _dump(self, log) -> None:
+        """Write a summary of the statistics to the log.
+
+        :param log: The Logger instance to write to.
+        """
+        stats = self.stats()
+        log.info("stats(): hits: {0}, misses: {1}, evictions: {2}, reloads: {3}, resident bytes: {4}".format(
+            stats["hits"], stats["misses"], stats["evictions"], stats["reloads"], stats["resident_bytes"]))
+        for category in ["latency_by_type", "latency_by_prefix"]:
+            for name, hist in sorted(stats[category].items()):
+                log.info("stats(): {0}: {1}: count: {2}, mean: {3:.2f}ms, max: {4:.2f}ms, buckets: {5}".format(
+                    category, name, hist["count"], hist["total_ms"] / hist["count"], hist["max_ms"],
+                    hist["buckets"]))
+
+    @staticmethod
+    def __record_latency(histograms: dict, name: str, elapsed: float) -> None:
+        """Add a load time to a named latency histogram, creating it if necessary.
+
+        :param histograms: The dict of histograms to update.
+        :param name: The name of the histogram within the dict.
+        :param elapsed: The load time in milliseconds.
+        """
+        if name not in histograms:
+            histograms[name] = {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "count": 0, "total_ms": 0.0,
+                                "max_ms": 0.0}
+        hist = histograms[name]
+
+        # Find the first bucket whose upper bound holds this load time, or the overflow bucket.
+        bucket = len(LATENCY_BUCKETS)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                bucket = i
+                break
+        hist["buckets"][bucket] += 1
+        hist["count"] += 1
+        hist["total_ms"] += elapsed
+        hist["max_ms"] = max(hist["max_ms"], elapsed)
+
+    @staticmethod
+    def __export_latency(histograms: dict) -> dict:
+        """Convert internal latency histograms into plain dicts keyed by bucket bound.
+
+        :param histograms: The dict of histograms to convert.
+
+        :return: The converted dict of histograms.
+        """
+        exported = {}
+        for name, hist in histograms.items():
+            buckets = {}
+            for i, count in enumerate(hist["buckets"]):
+                buckets[str(LATENCY_BUCKETS[i]) if i < len(LATENCY_BUCKETS) else "inf"] = count
+            exported[name] = {"buckets": buckets, "count": hist["count"], "total_ms": hist["total_ms"],
+                              "max_ms": hist["max_ms"]}
+        return exported
@@ -0,0 +1,230 @@
+#######################
+# BXEngine            #
+# roomregistry.py     #
+# Copyright 2021-2023 #
+# Sei Satzparad       #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+import json
+import os
+import zlib
+from typing import Callable, Iterator, Optional
+
+import ubjson
+
+from lib.logger import Logger
+from lib.util import LRUCache, normalize_path, room_files
+
+# The filename of the registry index, which is kept in the world directory.
+REGISTRY_FILENAME = "rooms.ubj"
+
+# The filename of each shard, by shard number.
+SHARD_FILENAME = "rooms.{0}.shard"
+
+# Bump this whenever the layout of the registry files changes.
+REGISTRY_VERSION = 1
+
+# The number of shards to pack the rooms into, if not told otherwise.
+SHARD_COUNT = 16
+
+# The most recently read room descriptors which are kept at once.
+ROOM_CACHE_SIZE = 256
+
+
+def shard_of(room_file: str, shards: int) -> int:
+    """Choose the shard a room descriptor is packed into. This is always the same for the same room name.
+
+    :param room_file: The room descriptor filename.
+    :param shards: The number of shards.
+
+    :return: The shard number.
+    """
+    return zlib.crc32(room_file.encode("utf-8")) % shards
+
+
+class RoomRegistry(object):
+    """A packed store of the room descriptors in a world.
+
+    In a world with a very large number of rooms, finding and opening a separate file for every room costs more than
+    reading it. The registry packs the room descriptors into a small number of shard files, and keeps an index of
+    where each one is, as [shard, offset, length] by room descriptor filename. Loading a room from the registry is then
+    a single positioned read from a shard file that is already open. Adding or replacing a room only appends to its
+    shard and updates the index.
+
+    The registry is optional. It is built with the bxregistry.py tool, and used by the World whenever its index is
+    present in the world directory, in which case the registry is trusted over the room descriptor files themselves,
+    so it should be built again after they are changed.
+
+    :ivar dir: The directory of the game world.
+    :ivar log: The Logger instance for this class.
+    :ivar shards: The number of shards.
+    :ivar rooms: A dict of room descriptor filenames mapped to their [shard, offset, length].
+    :ivar __files: A dict of the shard files which are open for reading, by shard number.
+    :ivar __rooms: A cache of the recently read room descriptors, by room descriptor filename.
+    """
+    def __init__(self, world_dir: str):
+        """RoomRegistry Class Initializer
+
+        :param world_dir: The directory of the game world.
+        """
+        self.dir = world_dir
+        self.log = Logger("RoomRegistry")
+        self.shards = SHARD_COUNT
+        self.rooms = {}
+        self.__files = {}
+        self.__rooms = LRUCache(ROOM_CACHE_SIZE)
+
+    def __contains__(self, item: str) -> bool:
+        return normalize_path(item) in self.rooms
+
+    def __len__(self) -> int:
+        return len(self.rooms)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.rooms)
+
+    def load(self) -> bool:
+        """Load the registry index from the world directory, if there is one.
+
+        :return: True if succeeded, False if there is no usable registry.
+        """
+        path = os.path.join(self.dir, REGISTRY_FILENAME)
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, "rb") as f:
+                saved = ubjson.load(f)
+            if saved["version"] != REGISTRY_VERSION:
+                self.log.warn("load(): Ignoring room registry from another engine version: {0}".format(path))
+                return False
+            self.shards, self.rooms = saved["shards"], saved["rooms"]
+            self.__rooms.clear()
+        except (OSError, ValueError, KeyError, TypeError, ubjson.DecoderException):
+            self.log.error("load(): Could not load room registry: {0}".format(path))
+            return False
+        self.log.info("load(): Loaded room registry: {0} rooms in {1} shards".format(len(self.rooms), self.shards))
+        return True
+
+    def get(self, room_file: str) -> Optional[dict]:
+        """Read a room descriptor from the registry, or get it from the cache if it was read recently.
+
+        :param room_file: The room descriptor filename.
+
+        :return: The room descriptor if succeeded, None if failed.
+        """
+        room_file = normalize_path(room_file)
+        if room_file not in self.rooms:
+            self.log.error("get(): No such room in registry: {0}".format(room_file))
+            return None
+        if room_file in self.__rooms:
+            return self.__rooms[room_file]
+
+        shard, offset, length = self.rooms[room_file]
+        try:
+            if shard not in self.__files:
+                self.__files[shard] = open(os.path.join(self.dir, SHARD_FILENAME.format(shard)), "rb")
+            self.__files[shard].seek(offset)
+            self.__rooms[room_file] = json.loads(self.__files[shard].read(length))
+            return self.__rooms[room_file]
+        except (OSError, ValueError):
+            self.log.error("get(): Could not read room from registry: {0}: shard {1}".format(room_file, shard))
+            return None
+
+    def add(self, room_file: str, room: dict, save: bool = True) -> bool:
+        """Add a room descriptor to the registry, or replace one, by appending it to its shard.
+
+        :param room_file: The room descriptor filename.
+        :param room: The room descriptor.
+        :param save: Whether to save the index right away. When adding many rooms, save() once at the end instead.
+
+        :return: True if succeeded, False if failed.
+        """
+        room_file = normalize_path(room_file)
+        shard = shard_of(room_file, self.shards)
+        data = json.dumps(room, separators=(",", ":")).encode("utf-8")
+        try:
+            with open(os.path.join(self.dir, SHARD_FILENAME.format(shard)), "ab") as f:
+                offset = f.tell()
+                f.write(data)
+        except OSError:
+            self.log.error("add(): Could not write to room registry shard: {0}".format(shard))
+            return False
+        self.rooms[room_file] = [shard, offset, len(data)]
+        self.__rooms.pop(room_file, None)
+        if save:
+            return self.save()
+        return True
+
+    def build(self, shards: int = SHARD_COUNT, check: Callable = None) -> int:
+        """Pack every room descriptor file in the world into a new registry, replacing any existing one.
+
+        :param shards: The number of shards to pack the rooms into.
+        :param check: If given, a function called with the filename and contents of each room descriptor, which
+                      returns False to leave it out.
+
+        :return: The number of rooms packed.
+        """
+        self.close()
+        for shard in range(max(shards, self.shards)):
+            path = os.path.join(self.dir, SHARD_FILENAME.format(shard))
+            if os.path.exists(path):
+                os.remove(path)
+        self.shards, self.rooms = shards, {}
+        self.__rooms.clear()
+
+        for filename in room_files(self.dir):
+            try:
+                with open(os.path.join(self.dir, filename)) as f:
+                    room = json.load(f)
+            except (OSError, ValueError):
+                self.log.warn("build(): Skipping unreadable room descriptor: {0}".format(filename))
+                continue
+            if type(room) is not dict or not any(type(view) is dict and "image" in view for view in room.values()):
+                continue
+            if check and not check(filename, room):
+                continue
+            self.add(filename, room, save=False)
+        self.save()
+        self.log.info("build(): Built room registry: {0} rooms in {1} shards".format(len(self.rooms), self.shards))
+        return len(self.rooms)
+
+    def save(self) -> bool:
+        """Save the registry index into the world directory.
+
+        :return: True if succeeded, False if failed.
+        """
+        path = os.path.join(self.dir, REGISTRY_FILENAME)
+        try:
+            with open(path, "wb") as f:
+                ubjson.dump({"version": REGISTRY_VERSION, "shards": self.shards, "rooms": self.rooms}, f)
+        except OSError:
+            self.log.error("save(): Could not save room registry: {0}".format(path))
+            return False
+        return True
+
+    def close(self) -> None:
+        """Close the shard files which are open for reading.
+        """
+        for f in self.__files.values():
+            f.close()
+        self.__files = {}
@@ -26,6 +26,9 @@
 # **********
 
 import random
+from typing import Optional
+
+import pygame
 
 from lib.logger import Logger
 
@@ -74,11 +77,22 @@ class Roomview(object):
     def _load(self) -> bool:
         """Load the room descriptor JSON file. Also load the room image.
 
+        This only prepares the roomview. Everything that happens each time the roomview is entered is done by _enter().
+
         :return: True if succeeded, False if failed.
         """
-        # Attempt to load the room file.
+        # Attempt to load the room file, or to generate the room if it belongs to a roomview generator.
+        # If the world has a room registry which has the room, read it from there instead of its own file.
         self.log.info("_load(): Loading room and view: {0}:{1}".format(self.file, self.view))
-        whole_room = self.resource.load_json(self.file, "room")
+        if self.world.is_generated(self.file):
+            whole_room = self.world._generate(self.file)
+        elif self.file in self.world.registry:
+            whole_room = self.world.registry.get(self.file)
+
+        # Otherwise only parse and validate the view we want, leaving the rest of the room file alone.
+        else:
+            view = self.resource.load_json_view(self.file, self.view, "room")
+            whole_room = {self.view: view} if view is not None else None
 
         # We were unable to load the room file.
         if not whole_room:
@@ -93,19 +107,45 @@ class Roomview(object):
         # Load the requested view.
         self.vars = whole_room[self.view]
 
-        # Set the window caption to the roomview title, if one exists.
+        # Remember the roomview title, if one exists.
         if "title" in self.vars:
             self.title = self.vars["title"]
-            self.world.set_caption(self.title)
 
-        # Attempt to load the view's background image.
-        self.image = self.resource.load_image(self.vars["image"], self.config["window"]["size"])
+        # A generated view may come with its background image already composed. Scale it to the window if needed.
+        # Attempt to load the view's background image otherwise.
+        # With progressive loading, we get a placeholder right away, and the full image is swapped in when ready.
+        if type(self.vars["image"]) is pygame.Surface:
+            self.image = self.vars["image"]
+            if self.image.get_size() != tuple(self.config["window"]["size"]):
+                self.image = pygame.transform.scale(self.image, self.config["window"]["size"])
+        elif self.config["cache"].get("progressive"):
+            self.image = self.resource.load_image_progressive(self.vars["image"], self.config["window"]["size"],
+                                                              self.__swap_image)
+        else:
+            self.image = self.resource.load_image(self.vars["image"], self.config["window"]["size"])
 
         # We were unable to load the background image.
         if not self.image:
             self.log.error("_load(): Unable to load room image: {0}".format(self.vars["image"]))
             return False
 
+        # Success.
+        self.log.info("_load(): Finished loading room: {0}".format(self.file))
+        return True
+
+    def _enter(self, recalculate: bool = True) -> None:
+        """Enter the roomview, after it has been loaded.
+
+        This sets the window caption, starts or stops the music, and calculates the exits. A roomview may be entered
+        again later without being loaded again, in which case only the chance-based exits turn out differently.
+
+        :param recalculate: Whether to calculate the exits. When going back through the history, the World restores
+                            the exits as they were instead.
+        """
+        # Set the window caption to the roomview title, if one exists.
+        if self.title:
+            self.world.set_caption(self.title)
+
         # Music is defined for this view.
         if "music" in self.vars:
             self.music = self.vars["music"]
@@ -119,136 +159,171 @@ class Roomview(object):
             elif type(self.music) in [None, int, float]:
                 self.app.audio.stop_music(self.music)
 
-        # Calculate the exits for this roomview.
-        self.__calculate_all_exits()
+        # Calculate the exits for this roomview, from scratch.
+        if recalculate:
+            self.exits = {}
+            self.action_exits = {}
+            self.__calculate_all_exits()
+        self.log.info("_enter(): Entered room and view: {0}:{1}".format(self.file, self.view))
 
-        # Success.
-        self.log.info("_load(): Finished loading room: {0}".format(self.file))
-        return True
+    def __swap_image(self, image) -> None:
+        """Replace the placeholder background image with the full image once it has finished loading.
+
+        If loading failed, the placeholder stays for now, but the roomview is dropped from the World's cache of
+        recently visited roomviews, so that the image is loaded again on the next visit.
+
+        :param image: The full resolution PyGame surface, or None if loading failed.
+        """
+        if image:
+            self.image = image
+        else:
+            self.log.error("__swap_image(): Unable to load room image: {0}".format(self.vars["image"]))
+            self.world.roomview_cache.pop("{0}:{1}".format(self.file, self.view), None)
 
     def __calculate_all_exits(self) -> bool:
         """Calculate the presence and destination of every potential named exit and go action exit in this roomview.
 
-        Processing is handed off to _calculate_exit() for each exit. The information is stored in the self.exits
-        variable for named exits, and the self.action_exits variable for go action exits.
+        The exits are first compiled by __compile_exit(), which resolves everything that depends on the funvalue. Since
+        the funvalue never changes for a save, the compiled exits are cached by the World for each room file, view and
+        funvalue, so that only the chance rolls are left to do on later visits. The information is stored in the
+        self.exits variable for named exits, and the self.action_exits variable for go action exits.
 
         :return: True if succeeded, False if failed.
         """
-        # Calculate each named exit in the view, adding it to the list of exits if it is present.
+        cache_key = (self.file, self.view, self.world.funvalue)
+        if cache_key in self.world.exit_cache:
+            compiled = self.world.exit_cache[cache_key]
+        else:
+            compiled = self.world.exit_cache[cache_key] = self.__compile_all_exits()
+
+        # Roll each named exit in the view, adding it to the list of exits if it is present.
+        for e, thisexit in compiled["exits"].items():
+            dest = self.__roll_exit(thisexit)
+            if dest:
+                self.exits[e] = dest
+
+        # Roll each action exit in the room, adding it to the list of action exits if it is present.
+        for rect, act_types in compiled["actions"].items():
+            for act_type, thisexit in act_types.items():
+                dest = self.__roll_exit(thisexit)
+                if dest:
+                    if rect not in self.action_exits:
+                        self.action_exits[rect] = {}
+                    self.action_exits[rect][act_type] = dest
+
+        # Done.
+        return True
+
+    def __compile_all_exits(self) -> dict:
+        """Compile every potential named exit and go action exit in this roomview.
+
+        :return: A dictionary of compiled named exits under "exits", and compiled action exits by rect and action type
+                 under "actions".
+        """
+        compiled = {"exits": {}, "actions": {}}
+
+        # Compile each named exit in the view.
         if "exits" in self.vars:
             for e in self.vars["exits"]:
-                thisexit = self.vars["exits"][e]
-                dest = self.__calculate_exit(thisexit)
-                if dest:
-                    self.exits[e] = dest
+                compiled["exits"][e] = self.__compile_exit(self.vars["exits"][e])
 
-        # Calculate each action exit in the room, adding it to the list of action exits if it is present.
+        # Compile each action exit in the room.
         if "actions" in self.vars:
             for a in self.vars["actions"]:
                 for act_type in ["go", "look", "use"]:
                     if act_type in a and a[act_type]["result"] == "exit":
-                        thisexit = a[act_type]["contents"]
-                        dest = self.__calculate_exit(thisexit)
-                        if dest:
-                            if tuple(a["rect"]) not in self.action_exits:
-                                self.action_exits[tuple(a["rect"])] = {}
-                            self.action_exits[tuple(a["rect"])][act_type] = dest
+                        compiled["actions"].setdefault(tuple(a["rect"]), {})[act_type] = \
+                            self.__compile_exit(a[act_type]["contents"])
 
         # Done.
-        return True
+        return compiled
 
-    def __calculate_exit(self, thisexit: dict) -> [str, None]:
-        """Calculate the presence and destination of a potential exit in this roomview.
-        
-        Taking into account chance and funvalue_constraints conditionals for presence and destination the exit,
-        calculate the actual destination (and presence or lack thereof). A string destination is returned if the exit
-        is present, otherwise None is returned.
+    def __compile_exit(self, thisexit: [str, dict]) -> Optional[tuple]:
+        """Compile a potential exit in this roomview, resolving its funvalue constraints ahead of time.
 
-        :param thisexit: A dictionary containing an exit description section from the roomview.
+        Taking into account the funvalue constraints for presence and destination, work out which parts of the exit can
+        still vary. What is left is the chance of the exit being present, the destination it has unless a chance roll
+        changes it, and the chances of each alternate destination. If a funvalue selector picks the destination, the
+        chance selectors are dropped, since they would be overridden anyway.
 
-        :return: Destination string if the exit should be present, otherwise None.
+        :param thisexit: A string or dictionary containing an exit description section from the roomview.
+
+        :return: A tuple of (presence chance or None, destination, [[chance, alternate destination], ...]) if the exit
+                 may be present, otherwise None.
         """
         # If the exit name maps to a string, this is a simple, static exit.
         if type(thisexit) is str:
-            return thisexit
-        # If the exit name maps to a dictionary, this is a dynamic exit that needs to be calculated.
-        elif type(thisexit) is dict:
-            # If the "presence" section exists, there are variables affecting whether this exit will appear.
-            if "presence" in thisexit:
-                # First check for a chance-based probability, and keep or skip the exit accordingly.
-                if "chance" in thisexit["presence"]:
-                    chance_roll = random.randint(1, 1000)
-                    if chance_roll < 1000 * thisexit["presence"]["chance"]:
-                        pass  # Keep this exit.
-                    else:
-                        return None  # Skip this exit.
-                # Next check for funvalue constraints, and keep or skip the exit accordingly.
-                if "funvalue" in thisexit["presence"]:
-                    constraint = thisexit["presence"]["funvalue"]
-                    # Check a range constraint.
-                    if constraint[0] == "range":
-                        if constraint[1] > self.world.funvalue or constraint[2] < self.world.funvalue:
-                            return None  # Skip this exit.
-                    # Check an equality constraint.
-                    elif constraint[0] == "=":
-                        if self.world.funvalue != constraint[1]:
-                            return None  # Skip this exit.
-                    # Check a less than constraint.
-                    elif constraint[0] == "<":
-                        if not (self.world.funvalue < constraint[1]):
-                            return None  # Skip this exit.
-                    # Check a greater than constraint.
-                    elif constraint[0] == ">":
-                        if not (self.world.funvalue > constraint[1]):
-                            return None  # Skip this exit.
-                    # Check a less than or equal to constraint.
-                    elif constraint[0] == "<=":
-                        if not (self.world.funvalue <= constraint[1]):
-                            return None  # Skip this exit.
-                    # Check a greater than or equal to constraint.
-                    elif constraint[0] == ">=":
-                        if not (self.world.funvalue >= constraint[1]):
-                            return None  # Skip this exit.
-            # Next calculate the destination itself.
-            # If the "destination" section maps to a string, the destination is static.
-            if type(thisexit["destination"]) is str:
-                return thisexit["destination"]
-            # If the "destination" section maps to a dictionary, the destination is dynamic.
-            elif type(thisexit["destination"]) is dict:
-                # Start with the default destination and then see if it needs to be overwritten.
-                dest = thisexit["destination"]["default"]
-                # First check for a chance-based selector.
-                if "chance" in thisexit["destination"]:
-                    for constraint in thisexit["destination"]["chance"]:
-                        chance_roll = random.randint(1, 1000)
-                        if chance_roll < 1000 * constraint[0]:
-                            dest = constraint[1]  # Select this alternate destination.
-                # Next check for a funvalue selector.
-                if "funvalue" in thisexit["destination"]:
-                    for constraint in thisexit["destination"]["funvalue"]:
-                        # Check a range constraint.
-                        if constraint[0] == "range":
-                            if constraint[1] <= self.world.funvalue <= constraint[2]:
-                                dest = constraint[3]  # Select this alternate destination.
-                        # Check an equality constraint.
-                        elif constraint[0] == "=":
-                            if self.world.funvalue == constraint[1]:
-                                dest = constraint[2]  # Select this alternate destination.
-                        # Check a less than constraint.
-                        elif constraint[0] == "<":
-                            if self.world.funvalue < constraint[1]:
-                                dest = constraint[2]  # Select this alternate destination.
-                        # Check a greater than constraint.
-                        elif constraint[0] == ">":
-                            if self.world.funvalue > constraint[1]:
-                                dest = constraint[2]  # Select this alternate destination.
-                        # Check a less than or equal to constraint.
-                        elif constraint[0] == "<=":
-                            if self.world.funvalue <= constraint[1]:
-                                dest = constraint[2]  # Select this alternate destination.
-                        # Check a greater than or equal to constraint.
-                        elif constraint[0] == ">=":
-                            if self.world.funvalue >= constraint[1]:
-                                dest = constraint[2]  # Select this alternate destination.
-                # Set the destination to whatever we landed on.
-                return dest
+            return None, thisexit, []
+
+        # If the exit name maps to anything but a dictionary, it is never present.
+        if type(thisexit) is not dict:
+            return None
+
+        # If the "presence" section exists, there are variables affecting whether this exit will appear.
+        # A failed funvalue constraint means the exit is never present, and a chance is left to be rolled on each visit.
+        presence = None
+        if "presence" in thisexit:
+            if "funvalue" in thisexit["presence"] and \
+                    self.__check_funvalue(thisexit["presence"]["funvalue"]) is False:
+                return None
+            presence = thisexit["presence"].get("chance")
+
+        # If the "destination" section maps to a string, the destination is static.
+        if type(thisexit["destination"]) is str:
+            return presence, thisexit["destination"], []
+
+        # If the "destination" section maps to a dictionary, the destination is dynamic.
+        elif type(thisexit["destination"]) is dict:
+            # The last funvalue selector that matches decides the destination, no matter what the chance rolls say.
+            for constraint in reversed(thisexit["destination"].get("funvalue", [])):
+                if self.__check_funvalue(constraint):
+                    return presence, constraint[-1], []
+
+            # Otherwise, start with the default destination and let the chance selectors overwrite it.
+            return presence, thisexit["destination"]["default"], thisexit["destination"].get("chance", [])
+
+        # We don't know what this is.
+        return None
+
+    def __check_funvalue(self, constraint: list) -> Optional[bool]:
+        """Check a funvalue constraint against the world's funvalue.
+
+        :param constraint: The constraint, as an operator followed by its operands. An alternate destination may follow.
+
+        :return: True if the constraint is met, False if it is not, or None if the operator is unknown.
+        """
+        if constraint[0] == "range":
+            return constraint[1] <= self.world.funvalue <= constraint[2]
+        elif constraint[0] == "=":
+            return self.world.funvalue == constraint[1]
+        elif constraint[0] == "<":
+            return self.world.funvalue < constraint[1]
+        elif constraint[0] == ">":
+            return self.world.funvalue > constraint[1]
+        elif constraint[0] == "<=":
+            return self.world.funvalue <= constraint[1]
+        elif constraint[0] == ">=":
+            return self.world.funvalue >= constraint[1]
+        return None
+
+    @staticmethod
+    def __roll_exit(compiled: Optional[tuple]) -> [str, None]:
+        """Roll the chances of a compiled exit to calculate its presence and destination for this visit.
+
+        :param compiled: A compiled exit from __compile_exit().
+
+        :return: Destination string if the exit should be present, otherwise None.
+        """
+        if compiled is None:
+            return None
+        presence, dest, chances = compiled
+
+        # First check for a chance-based probability, and keep or skip the exit accordingly.
+        if presence is not None and not random.randint(1, 1000) < 1000 * presence:
+            return None  # Skip this exit.
+
+        # Then roll each chance-based selector. The last one that succeeds selects its alternate destination.
+        for constraint in chances:
+            if random.randint(1, 1000) < 1000 * constraint[0]:
+                dest = constraint[1]
+        return dest
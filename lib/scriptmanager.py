@@ -26,6 +26,7 @@
 # **********
 
 import importlib.util
+import inspect
 import os
 import sys
 import traceback
@@ -49,7 +50,8 @@ class ScriptManager:
     :ivar resource: The ResourceManager instance.
     :ivar ui: The UIManager instance.
     :ivar world: The World instance.
-    :ivar __modules: The dictionary of active module instances mapped by filename.
+    :ivar __modules: The dictionary of active module instances mapped by full path, so that scripts with the same
+                     filename in different worlds are kept apart.
     """
 
     def __init__(self, app, audio, cursor, resource, ui, world):
@@ -86,16 +88,21 @@ class ScriptManager:
             self.log.error("__getitem__(): Error from module: {0}".format(item))
         return None
 
-    def call(self, filename: str, func: str, *args: Any) -> Any:
+    def call(self, filename: str, func: str, *args: Any, start: bool = False) -> Any:
         """Call a function from a script, loading if not already loaded.
 
         Usually you just want to run "BXE.script[path].function(args)". This wraps around that, and is cleaner
         for the engine to use in most cases. It also prevents exceptions from raising into the engine scope and
         crashing it, so the engine will always call scripts through this method.
 
+        If start is true, and the function is a generator function or an async function, it is started as a
+        coroutine with TickManager.start(), and its coroutine ID is returned instead. Otherwise whatever the function
+        returns is returned as it is, even if that is a generator, and it is up to the caller to start it.
+
         :param filename: Filename of the python script containing the function.
         :param func: Name of the function to call.
         :param args: Arguments to pass.
+        :param start: Whether to start a returned generator or coroutine running as a coroutine.
 
         :return: Function return code if succeeded, None if failed.
         """
@@ -103,8 +110,12 @@ class ScriptManager:
         filename = normalize_path(filename)
 
         # Call the module function from our registry if it can be loaded or is loaded already.
+        # If asked to, and the function is a generator function or an async function, start running it as a coroutine.
         try:
-            return getattr(self[filename], func)(*args)
+            ret = getattr(self[filename], func)(*args)
+            if start and (inspect.isgenerator(ret) or inspect.iscoroutine(ret)):
+                return self.app.tick.start(ret)
+            return ret
 
         # Give an error if we are attempting to call a module that could not be loaded.
         except AttributeError:
@@ -143,10 +154,10 @@ class ScriptManager:
         filename = normalize_path(filename)
 
         # Load the module if not loaded and then return it, otherwise return the existing module.
-        if filename not in self.__modules:
+        if self.__fullpath(filename) not in self.__modules:
             return self.__load(filename)
         else:
-            return self.__modules[filename]
+            return self.__modules[self.__fullpath(filename)]
 
     def __load(self, filename: str) -> Optional[bool]:
         """Load a script.
@@ -159,10 +170,7 @@ class ScriptManager:
         filename = normalize_path(filename)
 
         # Determine the full path of the module.
-        if filename.startswith("$COMMON$/"):
-            fullpath = "{0}/{1}".format("common", filename.split('/', 1)[1])
-        else:
-            fullpath = "{0}/{1}".format(self.world.dir, filename)
+        fullpath = self.__fullpath(filename)
 
         # If the path does not exist, give an error.
         if not os.path.exists(fullpath):
@@ -177,11 +185,11 @@ class ScriptManager:
             spec = importlib.util.spec_from_file_location(mname, fullpath)
             mod = importlib.util.module_from_spec(spec)
             spec.loader.exec_module(mod)
-            self.__modules[filename] = mod
-            self.__modules[filename].BXE = APIContext(filename, self.app)
+            self.__modules[fullpath] = mod
+            self.__modules[fullpath].BXE = APIContext(filename, self.app)
 
             self.log.info("__load(): Loaded script: {0}".format(filename))
-            return self.__modules[filename]
+            return self.__modules[fullpath]
 
         # Exit with a critical error if the module called sys.exit().
         except SystemExit:
@@ -193,3 +201,14 @@ class ScriptManager:
         except:
             self.log.error("__load(): Error from script: {0}\n{1}".format(filename, traceback.format_exc(10).rstrip()))
             return None
+
+    def __fullpath(self, filename: str) -> str:
+        """Determine the full path of a script, from the engine's base directory.
+
+        :param filename: Filename of the python script, from the current world directory or "$COMMON$/".
+
+        :return: The full path.
+        """
+        if filename.startswith("$COMMON$/"):
+            return "{0}/{1}".format("common", filename.split('/', 1)[1])
+        return "{0}/{1}".format(self.world.dir, filename)
@@ -25,20 +25,131 @@
 # IN THE SOFTWARE.
 # **********
 
-from typing import Callable
+import asyncio
+import heapq
+import inspect
+import itertools
+import queue
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, NewType, Optional, Union
 
 import pygame
 
 from lib.logger import Logger
 
+TimerID = NewType("TimerID", int)
+CoroutineID = NewType("CoroutineID", int)
+IdleTaskID = NewType("IdleTaskID", int)
+
+# An idle task that has been passed over for this many frames runs even when there is no time left in the frame.
+STARVATION_FRAMES = 30
+
+# The most fixed steps the simulation clock may take in one frame to catch up. If it falls further behind than this, the
+# rest of the lost time is dropped, so that a slow frame can't snowball into ever slower frames.
+MAX_STEPS_PER_FRAME = 8
+
+
+class Wait(object):
+    """Something an event script coroutine can wait for.
+
+    Generator functions wait by yielding one of these, and async functions wait by awaiting one. They are created
+    through TickManager.sleep(), TickManager.next_frame(), TickManager.wait_until() and TickManager.wait_for().
+    """
+    def __await__(self):
+        return (yield self)
+
+
+class Sleep(Wait):
+    """Wait for a number of milliseconds.
+
+    :ivar delay: The number of milliseconds to wait.
+    """
+    def __init__(self, delay: int):
+        self.delay = delay
+
+
+class NextFrame(Wait):
+    """Wait until the next frame.
+    """
+
+
+class WaitFor(Wait):
+    """Wait until background work started with TickManager.run_in_background() has finished.
+
+    :ivar future: The Future of the background work.
+    """
+    def __init__(self, future: Future):
+        self.future = future
+
+
+class WaitUntil(Wait):
+    """Wait until a condition is met. The condition is checked once per frame.
+
+    :ivar predicate: A function taking no arguments, which returns True when the wait is over.
+    """
+    def __init__(self, predicate: Callable):
+        self.predicate = predicate
+
 
 class TickManager:
     """The Tick Manager
 
     This class tracks game ticks and manages delayed events through a callback registry.
 
+    Game time is kept by a simulation clock, in now, which advances in fixed steps that are independent of the frame
+    rate. Each frame, the clock takes as many steps as it takes to catch up with real time, and delayed events are
+    checked after each step, so they stay on schedule even when frames are slow or dropped. The fraction of a step left
+    over, in alpha, can be used to interpolate anything that is drawn between steps.
+
+    Each registered event is identified by an opaque timer ID, so the same function can be registered any number of
+    times, and each of its events can be renewed or unregistered on its own.
+
+    Due times are kept in a priority queue ordered by when each event comes due, so registering, renewing and
+    unregistering an event costs O(log n), and each tick only looks at the events that are actually due. Renewed and
+    unregistered events leave stale entries behind in the queue, which are skipped when they reach the front, and
+    cleared out entirely once they outnumber the live ones.
+
+    TickManager also drives event script coroutines. A generator function can yield, or an async function can await,
+    sleep(), next_frame() or wait_until() to pause itself without blocking the engine, and it is resumed from the main
+    loop when the wait is over. This allows sequential logic to be written as one function, instead of being split up
+    across many delayed event callbacks.
+
+    Finally, TickManager runs expensive work in the background through run_in_background(), on a bounded thread pool.
+    Results are handed back to the main thread through a queue which is drained once per frame by _update(), so
+    completion callbacks never have to worry about thread safety.
+
+    When the engine runs its main loop on asyncio, event scripts can also run asyncio coroutines, like async file or
+    socket I/O, on the engine's event loop through run_async(), and wait for them the same way as background work.
+
+    Work that has to happen on the main thread but isn't urgent, like writing the database to disk, can be added as an
+    idle task with add_idle_task(). Idle tasks only get the time left over in each frame after rendering, highest
+    priority first. A task's priority goes up by one for every frame it is passed over, and a task that has been passed
+    over for too long runs even if the frame has no time left, so that no task is starved forever.
+
     :ivar log: The Logger instance for this class.
-    :ivar registry: The registry of timed event callbacks.
+    :ivar now: The current time on the simulation clock, in milliseconds since the main loop started.
+    :ivar step: The length of one fixed step of the simulation clock, in milliseconds.
+    :ivar alpha: How far real time is between the last step and the next one, from 0.0 to 1.0.
+    :ivar __real_time: The real time of the last tick, from pygame.time.get_ticks().
+    :ivar __lag: The number of milliseconds of real time the simulation clock still has to catch up with.
+    :ivar virtual: Whether the simulation clock takes exactly one step each frame instead of keeping up with real
+                   time. In headless mode, this lets delayed events come due as fast as frames can be run.
+    :ivar loop: The asyncio event loop the main loop is running on, or None if it is not running on asyncio.
+    :ivar registry: The registry of timed event callbacks, by timer ID.
+    :ivar __callbacks: A dict of callback functions mapped to the sets of timer IDs registered for them.
+    :ivar __queue: The priority queue of [due_time, sequence, timer_id] entries.
+    :ivar __sequence: A counter used to tell queue entries apart, so that stale entries can be recognized.
+    :ivar __timer_ids: A counter used to hand out timer IDs.
+    :ivar __coroutines: A dict of coroutine IDs mapped to running coroutines and what they are waiting for.
+    :ivar __next_frame: A list of coroutine IDs waiting for the next frame.
+    :ivar __coroutine_ids: A counter used to hand out coroutine IDs.
+    :ivar _executor: The thread pool used to run background work.
+    :ivar __completed: A queue of finished background work, waiting to be picked up by the main thread.
+    :ivar __idle: A dict of idle task IDs mapped to idle tasks.
+    :ivar __idle_ids: A counter used to hand out idle task IDs.
+    :ivar __stale: The number of stale entries currently in the queue.
     """
     def __init__(self):
         """
@@ -46,108 +157,590 @@ class TickManager:
         """
         self.log = Logger("Tick")
 
-        self.registry = {}  # {callback: {start_time: int, delay: int, continuous: bool}}
+        # The simulation clock. The step length is set from the tick rate in the config once the App starts.
+        self.now = 0.0
+        self.step = 1000 / 60
+        self.alpha = 0.0
+        self.__real_time = None
+        self.__lag = 0.0
+        self.virtual = False
+
+        # {timer_id: {callback: Callable, start_time: int, delay: int, arg: list, continuous: bool, sequence: int}}
+        self.registry = {}
+        self.__callbacks = {}
+        self.__queue = []
+        self.__sequence = itertools.count()
+        self.__timer_ids = itertools.count(1)
 
-    def __contains__(self, item: Callable) -> bool:
-        if item in self.registry:
+        # {coroutine_id: {coroutine: Generator, wait: Wait, timer: TimerID}}
+        self.__coroutines = {}
+        self.__next_frame = []
+        self.__coroutine_ids = itertools.count(1)
+
+        self.loop = None
+        self._executor = ThreadPoolExecutor(thread_name_prefix="Background")
+        self.__completed = queue.Queue()  # [(callback, future), ...]
+
+        # {idle_task_id: {task: Callable or Generator, priority: int, arg: list, continuous: bool, waited: int}}
+        self.__idle = {}
+        self.__idle_ids = itertools.count(1)
+        self.__stale = 0
+
+    def __contains__(self, item: Union[TimerID, Callable]) -> bool:
+        if item in self.registry or item in self.__callbacks:
             return True
         return False
 
-    def register(self, callback: Callable, delay: int, arg: list = None, continuous: bool = False) -> bool:
+    def register(self, callback: Callable, delay: int, arg: list = None, continuous: bool = False) -> TimerID:
         """Register a timed event callback.
 
         The registered event is a function that will be called, perhaps repeatedly, after a set interval in
-        milliseconds. (Each function can only be registered once, so you would need to copy its object to register it
-        a second time.)
+        milliseconds. The same function may be registered any number of times; each registration is a separate event
+        with its own timer ID.
 
         :param callback: A function to be called when the event comes due.
         :param delay: The delay in milliseconds until the event comes due.
         :param arg: Optional argument list to pass to the callback function when it is called.
         :param continuous: Whether the event should keep being called at the same interval or be deleted after one call.
 
-        :return: True if succeeded, False if failed.
+        :return: A unique timer ID for this event. This is used as an argument to other methods.
         """
-        # If this callback is already in the registry, fail.
-        if callback in self.registry:
-            self.log.warn("register(): Attempt to register already registered callback: {0}".format(callback.__name__))
-            return False
-
-        # Otherwise, add it to the registry.
-        self.registry[callback] = {"start_time": pygame.time.get_ticks(), "delay": delay, "arg": arg,
-                                   "continuous": continuous}
-        self.log.info("register(): Registered event callback: {0}".format(callback.__name__))
+        # Add the event to the registry and schedule it.
+        timer_id = TimerID(next(self.__timer_ids))
+        self.registry[timer_id] = {"callback": callback, "start_time": self.now, "delay": delay,
+                                   "arg": arg, "continuous": continuous, "sequence": None}
+        self.__callbacks.setdefault(callback, set()).add(timer_id)
+        self.__schedule(timer_id)
+        self.log.info("register(): Registered event callback: {0} ({1})".format(callback.__name__, timer_id))
 
         # Success.
-        return True
+        return timer_id
 
-    def unregister(self, callback: Callable) -> bool:
+    def unregister(self, timer: Union[TimerID, Callable]) -> bool:
         """Unregister a timed event callback.
 
-        This takes the original function object as an argument, and unregisters that function's event.
+        This takes the timer ID given by register(). For backwards compatibility, it also takes a callback function,
+        in which case every event registered for that function is unregistered.
 
-        :param callback: The function of the event to be unregistered.
+        :param timer: The timer ID of the event to be unregistered, or its function.
 
         :return: True if succeeded, false if failed.
         """
-        # If this callback is not in the registry, fail.
-        if callback not in self.registry:
-            self.log.warn("unregister(): Attempt to unregister nonexistent callback: {0}".format(callback.__name__))
+        timer_ids = self.__lookup(timer)
+
+        # If this event is not in the registry, fail.
+        if not timer_ids:
+            self.log.warn("unregister(): Attempt to unregister nonexistent callback: {0}".format(self.__name(timer)))
             return False
 
-        # Otherwise, remove it from the registry.
-        del self.registry[callback]
-        self.log.info("unregister(): Unregistered event callback: {0}".format(callback.__name__))
+        # Otherwise, remove it from the registry. Its queue entry is now stale.
+        for timer_id in timer_ids:
+            callback = self.registry.pop(timer_id)["callback"]
+            self.__callbacks[callback].discard(timer_id)
+            if not self.__callbacks[callback]:
+                del self.__callbacks[callback]
+            self.__stale += 1
+            self.log.info("unregister(): Unregistered event callback: {0} ({1})".format(callback.__name__, timer_id))
 
         # Success.
         return True
 
-    def renew(self, callback: Callable) -> bool:
+    def renew(self, timer: Union[TimerID, Callable]) -> bool:
         """Reset a delayed event timer's start time to now.
 
         If a delayed event was originally registered to happen in 5 minutes, this will reset the timer so that it will
-        wait another 5 minutes starting now.
+        wait another 5 minutes starting now. This takes the timer ID given by register(). For backwards compatibility,
+        it also takes a callback function, in which case every event registered for that function is renewed.
 
-        :param callback: The function of the event to be renewed.
+        :param timer: The timer ID of the event to be renewed, or its function.
 
         :return: True if succeeded, false if failed.
         """
-        # If this callback is not in the registry, fail.
-        if callback not in self.registry:
-            self.log.warn("renew(): Attempt to renew nonexistent callback: {0}".format(callback.__name__))
+        timer_ids = self.__lookup(timer)
+
+        # If this event is not in the registry, fail.
+        if not timer_ids:
+            self.log.warn("renew(): Attempt to renew nonexistent callback: {0}".format(self.__name(timer)))
             return False
 
-        # Otherwise, renew it.
-        self.registry[callback]["start_time"] = pygame.time.get_ticks()
-        self.log.debug("renew(): Renewed event callback: {0}".format(callback.__name__))
+        # Otherwise, renew it. Its old queue entry is now stale.
+        for timer_id in timer_ids:
+            self.registry[timer_id]["start_time"] = self.now
+            self.__stale += 1
+            self.__schedule(timer_id)
+            self.log.debug("renew(): Renewed event callback: {0} ({1})".format(
+                self.registry[timer_id]["callback"].__name__, timer_id))
+        return True
+
+    def sleep(self, delay: int) -> Sleep:
+        """Create a wait for a number of milliseconds, for an event script coroutine to yield or await.
+
+        For example, "yield BXE.tick.sleep(500)" in a generator function, or "await BXE.tick.sleep(500)" in an async
+        function, pauses that function for half a second.
+
+        :param delay: The number of milliseconds to wait.
+
+        :return: Sleep wait.
+        """
+        return Sleep(delay)
+
+    def next_frame(self) -> NextFrame:
+        """Create a wait for the next frame, for an event script coroutine to yield or await.
+
+        Yielding None from a generator function does the same thing.
+
+        :return: NextFrame wait.
+        """
+        return NextFrame()
+
+    def wait_until(self, predicate: Callable) -> WaitUntil:
+        """Create a wait for a condition, for an event script coroutine to yield or await.
+
+        :param predicate: A function taking no arguments, which returns True when the wait is over. It is called once
+            per frame, so it should be cheap.
+
+        :return: WaitUntil wait.
+        """
+        return WaitUntil(predicate)
+
+    def wait_for(self, future: Future) -> WaitFor:
+        """Create a wait for background work, for an event script coroutine to yield or await.
+
+        For example, "data = yield BXE.tick.wait_for(BXE.tick.run_in_background(parse, text))" in a generator
+        function pauses that function until parse() has finished on a worker thread, and then returns its result.
+
+        :param future: The Future returned by run_in_background().
+
+        :return: WaitFor wait.
+        """
+        return WaitFor(future)
+
+    def start(self, coroutine: Any) -> CoroutineID:
+        """Start running an event script coroutine.
+
+        The coroutine runs right away until its first wait, and is then resumed from the main loop each time its wait
+        is over, until it returns. The engine starts event scripts called from actions this way when they are
+        generator functions or async functions, and scripts may call this to start their own.
+
+        :param coroutine: A generator or coroutine object, made by calling a generator function or async function.
+
+        :return: A unique identifier for this coroutine, which can be given to stop().
+        """
+        coroutine_id = CoroutineID(next(self.__coroutine_ids))
+        self.__coroutines[coroutine_id] = {"coroutine": coroutine, "wait": None, "timer": None}
+        self.log.info("start(): Started coroutine: {0} ({1})".format(coroutine.__name__, coroutine_id))
+        self.__resume(coroutine_id)
+        return coroutine_id
+
+    def running(self, coroutine_id: CoroutineID) -> bool:
+        """Check whether an event script coroutine is still running.
+
+        :param coroutine_id: The coroutine ID given by start().
+
+        :return: True if still running, False if it finished, was stopped, or does not exist.
+        """
+        return coroutine_id in self.__coroutines
+
+    def stop(self, coroutine_id: CoroutineID) -> bool:
+        """Stop a running event script coroutine.
+
+        :param coroutine_id: The coroutine ID given by start().
+
+        :return: True if succeeded, False if the coroutine does not exist or already finished.
+        """
+        if coroutine_id not in self.__coroutines:
+            self.log.warn("stop(): Attempt to stop nonexistent coroutine: {0}".format(coroutine_id))
+            return False
+
+        # Cancel whatever the coroutine was waiting for, and close it.
+        state = self.__coroutines.pop(coroutine_id)
+        if state["timer"] in self.registry:
+            self.unregister(state["timer"])
+        state["coroutine"].close()
+        self.log.info("stop(): Stopped coroutine: {0} ({1})".format(state["coroutine"].__name__, coroutine_id))
+        return True
+
+    def run_in_background(self, func: Callable, *args: Any, on_done: Callable = None) -> Future:
+        """Call a function on a background worker thread, so that it does not stall the engine.
+
+        The function must not touch the engine or call the scripting API, which is not thread safe. Hand its result
+        back with on_done instead, which is called on the main thread once the function has returned. If the function
+        raises an exception, the error is logged and on_done is not called.
+
+        A coroutine can also wait for the returned Future with wait_for(), and gets the result back from its yield
+        or await. If the function raised an exception, it is raised inside the coroutine instead.
+
+        :param func: The function to call.
+        :param args: Arguments to pass to the function.
+        :param on_done: Optional function taking one argument, which is called with the result on the main thread.
+
+        :return: A concurrent.futures.Future for the result.
+        """
+        future = self._executor.submit(func, *args)
+        if on_done:
+            future.add_done_callback(lambda f: self.__completed.put((self.__finish_background, [f, on_done])))
+        self.log.debug("run_in_background(): Started background work: {0}".format(getattr(func, "__name__", func)))
+        return future
+
+    def run_async(self, coroutine: Any) -> Optional[Future]:
+        """Run an asyncio coroutine on the engine's event loop.
+
+        This only works when the main loop is running on asyncio. The coroutine runs alongside the main loop, on the
+        main thread, so it can safely use the engine, but it should await anything that takes time instead of doing it
+        directly. For example, "data = yield BXE.tick.wait_for(BXE.tick.run_async(read_socket()))" in a generator
+        function pauses that function until read_socket() has finished.
+
+        :param coroutine: An asyncio coroutine object, made by calling an async function.
+
+        :return: A Future for the result of the coroutine if succeeded, None if there is no event loop.
+        """
+        if not self.loop:
+            coroutine.close()
+            self.log.error("run_async(): Cannot run coroutine without the asyncio main loop: {0}".format(
+                self.__name(coroutine)))
+            return None
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def add_idle_task(self, task: Any, priority: int = 0, arg: list = None, continuous: bool = False) -> IdleTaskID:
+        """Add a task to be run on the main thread when a frame has time to spare.
+
+        A task is either a function, which is called once per run, or a generator, which is advanced by one step per
+        run, so that a long job can be split into small slices by yielding between them. A generator task is removed
+        when it finishes; a function task is removed after it runs, unless it is continuous.
+
+        :param task: A function or a generator object.
+        :param priority: Tasks with higher priority get the spare time first.
+        :param arg: Optional argument list to pass to a function task when it is called.
+        :param continuous: Whether a function task should stay queued and run again whenever there is time.
+
+        :return: A unique identifier for this idle task, which can be given to remove_idle_task().
+        """
+        task_id = IdleTaskID(next(self.__idle_ids))
+        self.__idle[task_id] = {"task": task, "priority": priority, "arg": arg, "continuous": continuous, "waited": 0}
+        self.log.debug("add_idle_task(): Added idle task: {0} ({1})".format(self.__name(task), task_id))
+        return task_id
+
+    def remove_idle_task(self, task_id: IdleTaskID) -> bool:
+        """Remove an idle task.
+
+        :param task_id: The idle task ID given by add_idle_task().
+
+        :return: True if succeeded, False if the task does not exist or already finished.
+        """
+        if task_id not in self.__idle:
+            self.log.warn("remove_idle_task(): Attempt to remove nonexistent idle task: {0}".format(task_id))
+            return False
+        del self.__idle[task_id]
+        self.log.debug("remove_idle_task(): Removed idle task: {0}".format(task_id))
+        return True
+
+    def _idle(self, budget: float) -> None:
+        """This is called by the mainloop once per frame, after rendering.
+
+        It runs idle tasks, highest effective priority first, until the frame's spare time is used up.
+
+        :param budget: The number of milliseconds left in this frame.
+        """
+        if not self.__idle:
+            return
+        start_time = time.perf_counter()
+        forced = False
+
+        # Tasks gain one point of priority for every frame they have been passed over.
+        for task_id in sorted(self.__idle, key=lambda tid: self.__idle[tid]["priority"] + self.__idle[tid]["waited"],
+                              reverse=True):
+            if task_id not in self.__idle:
+                continue  # A task we ran removed this one.
+            task = self.__idle[task_id]
+
+            # Once the budget is used up, only let through one task which has been starved for too long.
+            if (time.perf_counter() - start_time) * 1000 >= budget:
+                if forced or task["waited"] < STARVATION_FRAMES:
+                    task["waited"] += 1
+                    continue
+                forced = True
+            self.__run_idle(task_id)
+
+    def _update(self) -> None:
+        """This is called by the mainloop once per frame.
+
+        It picks up finished background work and hands it over to whoever is waiting for it.
+        """
+        while True:
+            try:
+                callback, arg = self.__completed.get_nowait()
+            except queue.Empty:
+                return
+            callback(*arg)
 
     def _tick(self) -> None:
         """This is called repeatedly by the mainloop each iteration.
 
-        It looks for, executes, and cleans up delayed events which have come due.
+        It advances the simulation clock and runs delayed events which have come due, and then resumes the event
+        script coroutines that are ready to continue.
+        """
+        self._advance()
+
+        # Resume coroutines that were waiting for the next frame, or whose condition has been met.
+        # Coroutines that start waiting for the next frame while we do this are left for the next frame.
+        next_frame, self.__next_frame = self.__next_frame, []
+        for coroutine_id in next_frame:
+            if coroutine_id in self.__coroutines:
+                self.__resume(coroutine_id)
+        for coroutine_id in [cid for cid in self.__coroutines if type(self.__coroutines[cid]["wait"]) is WaitUntil]:
+            if coroutine_id in self.__coroutines and self.__check_predicate(coroutine_id):
+                self.__resume(coroutine_id)
+
+        # Clear out stale entries once they outnumber the live ones, so the queue doesn't grow without bound.
+        if self.__stale > len(self.registry) and self.__stale > 64:
+            self.__queue = [entry for entry in self.__queue if entry[2] in self.registry and
+                            self.registry[entry[2]]["sequence"] == entry[1]]
+            heapq.heapify(self.__queue)
+            self.__stale = 0
+
+    def _advance(self) -> None:
+        """Advance the simulation clock by as many fixed steps as it takes to catch up with real time.
+
+        After each step, it looks for, executes, and cleans up delayed events which have come due. This is called by
+        _tick(), and also by the asyncio main loop when it wakes up between frames for an event that is due.
+        """
+        # On a virtual clock, every frame is one step, however long it really took.
+        if self.virtual:
+            self.now += self.step
+            self.__run_due()
+            return
+
+        # Add the real time that passed since the last tick to the time the clock has to catch up with.
+        real_time = pygame.time.get_ticks()
+        if self.__real_time is None:
+            self.__real_time = real_time
+        self.__lag += real_time - self.__real_time
+        self.__real_time = real_time
+
+        # Take fixed steps until the clock catches up, or give up on the lost time if it has fallen too far behind.
+        steps = 0
+        while self.__lag >= self.step:
+            if steps == MAX_STEPS_PER_FRAME:
+                self.log.debug("_advance(): Simulation clock fell behind, dropping {0} ms.".format(int(self.__lag)))
+                self.__lag %= self.step
+                break
+            self.now += self.step
+            self.__lag -= self.step
+            self.__run_due()
+            steps += 1
+        self.alpha = self.__lag / self.step
+
+    def _next_due(self) -> Optional[float]:
+        """Find out how long it is until the next delayed event comes due, in real time.
+
+        This lets the asyncio main loop sleep until then instead of until the next frame, when the event comes first.
+
+        :return: The number of milliseconds until the next event comes due, or None if there are no events.
+        """
+        # Throw away stale entries at the front of the queue, so that we see the next live event.
+        while self.__queue and (self.__queue[0][2] not in self.registry or
+                                self.registry[self.__queue[0][2]]["sequence"] != self.__queue[0][1]):
+            heapq.heappop(self.__queue)
+            self.__stale -= 1
+        if not self.__queue:
+            return None
+
+        # The event runs on the first step after its due time, and the clock is already behind by the lag, plus
+        # whatever real time passed since it last advanced.
+        behind = self.__lag + (pygame.time.get_ticks() - self.__real_time if self.__real_time is not None else 0)
+        return max(self.__queue[0][0] - self.now + self.step - behind, 0.0)
+
+    def __run_due(self) -> None:
+        """Execute and clean up the delayed events which have come due at the current simulation time.
         """
-        # This has to be wrapped in a try block because the registry could change size during iteration.
+        now = self.now
+
+        # Pop events off the front of the queue for as long as they are due.
+        # The event is due if more than the delay in milliseconds has passed since the start_time.
+        # Callbacks may freely register, renew or unregister events, including their own, while we do this.
+        while self.__queue and self.__queue[0][0] < now:
+            due_time, sequence, timer_id = heapq.heappop(self.__queue)
+
+            # Skip stale entries left behind by renewed or unregistered events.
+            if timer_id not in self.registry or self.registry[timer_id]["sequence"] != sequence:
+                self.__stale -= 1
+                continue
+            event = self.registry[timer_id]
+            callback = event["callback"]
+
+            # Call the callback.
+            try:
+                if event["arg"]:
+                    callback(*event["arg"])
+                else:
+                    callback()
+            except Exception:
+                self.log.error("_tick(): Error from event callback: {0}\n{1}".format(
+                    callback.__name__, traceback.format_exc().rstrip()))
+            self.log.debug("_tick(): Called event callback: {0}".format(callback.__name__))
+
+            # If the callback renewed or unregistered its own event, leave it alone.
+            if self.registry.get(timer_id) is not event or event["sequence"] != sequence:
+                continue
+
+            # If the event is continuous, update its start time to the current time. Otherwise, delete it.
+            if event["continuous"]:
+                event["start_time"] = now
+                self.__schedule(timer_id)
+                self.log.debug("_tick(): Reset time on continuous event callback: {0}".format(callback.__name__))
+            else:
+                del self.registry[timer_id]
+                self.__callbacks[callback].discard(timer_id)
+                if not self.__callbacks[callback]:
+                    del self.__callbacks[callback]
+                self.log.debug("_tick(): Deleted expired event callback: {0}".format(callback.__name__))
+
+    def __resume(self, coroutine_id: CoroutineID, value: Any = None, error: BaseException = None) -> None:
+        """Run a coroutine until its next wait, and arrange for it to be resumed when that wait is over.
+
+        :param coroutine_id: The ID of the coroutine to resume.
+        :param value: The value to send into the coroutine, which becomes the result of its yield or await.
+        :param error: If set, an exception to raise inside the coroutine instead of sending a value.
+        """
+        # The coroutine may have been stopped already.
+        if coroutine_id not in self.__coroutines:
+            return
+        state = self.__coroutines[coroutine_id]
+        state["wait"] = None
+        state["timer"] = None
+        name = state["coroutine"].__name__
+
+        # Run the coroutine until it waits for something, returns, or fails.
+        try:
+            if error:
+                wait = state["coroutine"].throw(error)
+            else:
+                wait = state["coroutine"].send(value)
+        except StopIteration:
+            del self.__coroutines[coroutine_id]
+            self.log.info("__resume(): Finished coroutine: {0} ({1})".format(name, coroutine_id))
+            return
+        except Exception:
+            del self.__coroutines[coroutine_id]
+            self.log.error("__resume(): Error from coroutine: {0} ({1})\n{2}".format(
+                name, coroutine_id, traceback.format_exc().rstrip()))
+            return
+
+        # Arrange to resume the coroutine when its wait is over.
+        state["wait"] = wait
+        if type(wait) is Sleep:
+            state["timer"] = self.register(self.__resume, wait.delay, [coroutine_id])
+        elif wait is None or type(wait) is NextFrame:
+            self.__next_frame.append(coroutine_id)
+        elif type(wait) is WaitUntil:
+            pass  # Checked every tick.
+        elif type(wait) is WaitFor and wait.future:
+            wait.future.add_done_callback(lambda f: self.__completed.put((self.__finish_wait, [coroutine_id, wait])))
+        else:
+            del self.__coroutines[coroutine_id]
+            state["coroutine"].close()
+            self.log.error("__resume(): Coroutine waited for something that is not a wait: {0} ({1}): {2}".format(
+                name, coroutine_id, wait))
+
+    def __run_idle(self, task_id: IdleTaskID) -> None:
+        """Run one idle task, or one step of it if it is a generator, and remove it if it is finished.
+
+        :param task_id: The ID of the idle task to run.
+        """
+        task = self.__idle[task_id]
+        task["waited"] = 0
+        finished = not task["continuous"]
+        try:
+            if inspect.isgenerator(task["task"]):
+                try:
+                    next(task["task"])
+                    finished = False
+                except StopIteration:
+                    finished = True
+            elif task["arg"]:
+                task["task"](*task["arg"])
+            else:
+                task["task"]()
+        except Exception:
+            finished = True
+            self.log.error("_idle(): Error from idle task: {0} ({1})\n{2}".format(
+                self.__name(task["task"]), task_id, traceback.format_exc().rstrip()))
+        if finished and self.__idle.get(task_id) is task:
+            del self.__idle[task_id]
+
+    def __finish_background(self, future: Future, on_done: Callable) -> None:
+        """Hand the result of finished background work to its completion callback, on the main thread.
+
+        :param future: The Future of the finished background work.
+        :param on_done: The completion callback.
+        """
+        if future.exception():
+            self.log.error("_update(): Error from background work:\n{0}".format(
+                "".join(traceback.format_exception(future.exception())).rstrip()))
+            return
         try:
-            # Loop through the registry and look for delayed events that have come due.
-            for callback in self.registry:
-                # The event is due if the correct amount of milliseconds has passed since the start_time.
-                if pygame.time.get_ticks() - self.registry[callback]["start_time"] > self.registry[callback]["delay"]:
-                    # Call the callback.
-                    if self.registry[callback]["arg"]:
-                        callback(*self.registry[callback]["arg"])
-                    else:
-                        callback()
-                    self.log.debug("_tick(): Called event callback: {0}".format(callback.__name__))
-
-                    # If the event is continuous, update its start time to the current time. Otherwise, delete it.
-                    if self.registry[callback]["continuous"]:
-                        self.registry[callback]["start_time"] = pygame.time.get_ticks()
-                        self.log.debug("_tick(): Reset time on continuous event callback: {0}".format(
-                            callback.__name__))
-                    else:
-                        del self.registry[callback]
-                        self.log.debug("_tick(): Deleted expired event callback: {0}".format(callback.__name__))
-
-        # If the registry list changed its size during iteration, just try again next cycle.
-        # Sometimes we get a KeyError on the callback sometimes too which is very strange.
-        except (RuntimeError, KeyError):
-            pass
+            on_done(future.result())
+        except Exception:
+            self.log.error("_update(): Error from background completion callback: {0}\n{1}".format(
+                getattr(on_done, "__name__", on_done), traceback.format_exc().rstrip()))
+
+    def __finish_wait(self, coroutine_id: CoroutineID, wait: WaitFor) -> None:
+        """Resume a coroutine that was waiting for background work, on the main thread.
+
+        :param coroutine_id: The ID of the waiting coroutine.
+        :param wait: The WaitFor wait for the finished background work.
+        """
+        if coroutine_id in self.__coroutines and self.__coroutines[coroutine_id]["wait"] is wait:
+            if wait.future.exception():
+                self.__resume(coroutine_id, error=wait.future.exception())
+            else:
+                self.__resume(coroutine_id, wait.future.result())
+
+    def __check_predicate(self, coroutine_id: CoroutineID) -> bool:
+        """Check whether the condition a coroutine is waiting for has been met.
+
+        If the condition itself fails, the coroutine is stopped.
+
+        :param coroutine_id: The ID of the coroutine to check.
+
+        :return: True if the coroutine should be resumed, otherwise False.
+        """
+        try:
+            return bool(self.__coroutines[coroutine_id]["wait"].predicate())
+        except Exception:
+            self.log.error("_tick(): Error from wait condition of coroutine: {0}\n{1}".format(
+                coroutine_id, traceback.format_exc().rstrip()))
+            self.stop(coroutine_id)
+            return False
+
+    def __lookup(self, timer: Union[TimerID, Callable]) -> list:
+        """Find the timer IDs of registered events matching a timer ID or a callback function.
+
+        :param timer: A timer ID, or a callback function.
+
+        :return: A list of matching timer IDs, which is empty if there are none.
+        """
+        if timer in self.registry:
+            return [timer]
+        if timer in self.__callbacks:
+            return list(self.__callbacks[timer])
+        return []
+
+    @staticmethod
+    def __name(timer: Union[TimerID, Callable]) -> str:
+        """Get a printable name for a timer ID or a callback function, for logging.
+
+        :param timer: A timer ID, or a callback function.
+
+        :return: The name.
+        """
+        return getattr(timer, "__name__", str(timer))
+
+    def __schedule(self, timer_id: TimerID) -> None:
+        """Push a registered event onto the queue, based on its current start time and delay.
+
+        :param timer_id: The timer ID of the event to be scheduled.
+        """
+        event = self.registry[timer_id]
+        event["sequence"] = next(self.__sequence)
+        heapq.heappush(self.__queue, [event["start_time"] + event["delay"], event["sequence"], timer_id])
@@ -72,10 +72,12 @@ class UIManager(object):
         """
         self.pgui.draw_ui(self.screen)
 
-    def _update(self):
+    def _update(self, wait: bool = True):
         """Call PyGame GUI to update / perform a tick.
+
+        :param wait: Whether to wait out the rest of the frame. The asyncio main loop does its own waiting instead.
         """
-        self.pgui.update(self.clock.tick(self.fps) / 1000.0)
+        self.pgui.update(self.clock.tick(self.fps if wait else 0) / 1000.0)
 
     def _refresh(self):
         """Refresh what is drawn and call PyGame GUI to update.
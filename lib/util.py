@@ -26,10 +26,11 @@
 # **********
 
 import functools
+import os
 import sys
 import types
-
-from typing import Callable
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterator
 
 from lib.logger import Logger
 
@@ -51,13 +52,67 @@ def copy_function(f: Callable) -> Callable:
 
     Based on https://stackoverflow.com/a/6528148/190597 (Glenn Maynard)
 
-    This is needed to pass the same function multiple times to TickManager as a callback.
+    Deprecated: This used to be needed to pass the same function multiple times to TickManager as a callback. Now
+    TickManager.register() returns a timer ID for each event, so the same function can just be registered again.
 
     :param f: The function to be copied.
 
     :return: A function object.
     """
+    Logger("Util").warn("copy_function(): Deprecated, register the same function again instead: {0}".format(
+        f.__name__))
     g = types.FunctionType(f.__code__, f.__globals__, name=f.__name__, argdefs=f.__defaults__, closure=f.__closure__)
     g = functools.update_wrapper(g, f)
     g.__kwdefaults__ = f.__kwdefaults__
     return g
+
+
+def room_files(world_dir: str) -> Iterator[str]:
+    """Go through the filenames of every potential room descriptor in a world, relative to the world directory.
+
+    This is every JSON file except the world descriptor and the world's own schema files.
+
+    :param world_dir: The directory of the game world.
+
+    :return: An iterator of room descriptor filenames.
+    """
+    for dirpath, dirnames, filenames in os.walk(world_dir):
+        if os.path.normpath(dirpath) == os.path.normpath(world_dir) and "schema" in dirnames:
+            dirnames.remove("schema")
+        dirnames.sort()
+        for filename in sorted(filenames):
+            relpath = normalize_path(os.path.relpath(os.path.join(dirpath, filename), world_dir))
+            if filename.endswith(".json") and relpath != "world.json":
+                yield relpath
+
+
+class LRUCache(OrderedDict):
+    """A dictionary which holds at most a fixed number of items, forgetting the least recently used ones first.
+
+    Getting or setting an item counts as using it.
+
+    :ivar maxsize: The most items the cache may hold.
+    """
+    def __init__(self, maxsize: int):
+        """LRUCache Class Initializer
+
+        :param maxsize: The most items the cache may hold.
+        """
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if key in self:
+            return self[key]
+        return default
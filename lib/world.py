@@ -25,12 +25,32 @@
 # IN THE SOFTWARE.
 # **********
 
-from random import randint
+import functools
+import traceback
+from collections import deque
+from random import randint, Random
+from typing import Callable, Optional
 
+import jsonschema
 import pygame
 
 from lib.logger import Logger
+from lib.roomregistry import RoomRegistry
 from lib.roomview import Roomview
+from lib.util import LRUCache
+from lib.worldgraph import node_name, WorldGraph
+
+# The most roomviews whose compiled exits are kept at once.
+EXIT_CACHE_SIZE = 256
+
+# The most loaded roomviews which are kept at once, if the config doesn't say.
+ROOMVIEW_CACHE_SIZE = 16
+
+# The most roomviews which are kept in the history to go back to, if the config doesn't say.
+HISTORY_SIZE = 8
+
+# The most generated room descriptors which are kept at once, if the config doesn't say.
+GENERATED_CACHE_SIZE = 64
 
 
 class World(object):
@@ -39,51 +59,97 @@ class World(object):
     :ivar config: This contains the engine's configuration variables.
     :ivar app: The main App instance.
     :ivar dir: The directory of the game world.
+    :ivar primary: Whether this is the world the engine started in. Other worlds keep their database keys apart.
     :ivar vars: The JSON object representing the world file.
     :ivar roomview: The currently focused roomview.
     :ivar resource: The ResourceManager instance.
     :ivar log: The Logger instance for this class.
     :ivar funvalue: The world's funvalue, which is set on first load and affects what may happen this playthrough.
+    :ivar exit_cache: The compiled exits of recently visited roomviews, by room file, view name and funvalue.
+    :ivar graph: The WorldGraph index of how the roomviews in the world are connected.
+    :ivar roomview_cache: Recently visited roomviews, by room file and view name, as "room:view".
+    :ivar history: The roomviews we left most recently, last left at the end, with their exits and overlays as they
+                   were when we left.
+    :ivar seed: The world's seed, which generated rooms are built from.
+    :ivar generators: Roomview generator functions, by the room name prefix they generate rooms for.
+    :ivar generated: Recently generated room descriptors, by room name.
+    :ivar registry: The RoomRegistry of packed room descriptors, which is used instead of the room descriptor files if
+                    the world has one.
     """
-    def __init__(self, config, app, resource):
+    def __init__(self, config, app, resource, world_dir: str = None, primary: bool = True):
         """World Class Initializer
 
         :param config: This contains the engine's configuration variables.
         :param app: The main App instance.
         :param resource: The ResourceManager instance.
+        :param world_dir: The directory of the game world, if not the one from the config.
+        :param primary: Whether this is the world the engine started in.
         """
         self.config = config
         self.app = app
-        self.dir = self.config["world"]
+        self.dir = world_dir or self.config["world"]
+        self.primary = primary
         self.vars = None
         self.roomview = None
         self.resource = resource
         self.log = Logger("World")
         self.funvalue = None
+        self.exit_cache = LRUCache(EXIT_CACHE_SIZE)
+        self.roomview_cache = LRUCache(self.config["cache"].get("roomviews", ROOMVIEW_CACHE_SIZE))
+
+        # [{roomview: Roomview, exits: dict, action_exits: dict, overlays: dict}, ...]
+        self.history = deque(maxlen=self.config["cache"].get("history", HISTORY_SIZE))
 
-    def load(self) -> bool:
+        self.seed = None
+        self.generators = {}
+        self.generated = LRUCache(self.config["cache"].get("generated", GENERATED_CACHE_SIZE))
+        self.registry = RoomRegistry(self.dir)
+        self.graph = WorldGraph(self.dir, self.registry)
+
+    def load(self, enter: bool = True) -> bool:
         """Load the world descriptor JSON file and prepare the world.
 
+        This must be called while the world is the current one in the config, as the App does.
+
+        :param enter: Whether to enter the first roomview, or only prepare the world so it can be switched to later.
+
         :return: True if succeeded, False if failed.
         """
         self.vars = self.resource.load_json("world.json", "world")
 
         # Check if we successfully loaded the file.
         if not self.vars:
-            self.log.critical("load(): Unable to load game world: {0}".format(self.config["world"]))
+            self.log.critical("load(): Unable to load game world: {0}".format(self.dir))
             return False
-        self.log.info("load(): Finished loading game world: {0} ({1})".format(self.config["world"], self.vars["name"]))
-
-        # Set our window title to the world name.
-        self.set_caption()
+        self.log.info("load(): Finished loading game world: {0} ({1})".format(self.dir, self.vars["name"]))
 
         # Configure the funvalue. If none exists yet, it is chosen randomly just once, based on the range configured
         # in the world.json file. If a funvalue has already been chosen, load that out of the database.
-        if "funvalue" not in self.app.database:
-            self.app.database["funvalue"] = randint(self.vars["funvalue_range"][0], self.vars["funvalue_range"][1])
-        self.funvalue = self.app.database["funvalue"]
+        if self.__db_key("funvalue") not in self.app.database:
+            self.app.database[self.__db_key("funvalue")] = randint(self.vars["funvalue_range"][0],
+                                                                   self.vars["funvalue_range"][1])
+        self.funvalue = self.app.database[self.__db_key("funvalue")]
+
+        # Configure the seed for generated rooms in the same way, unless the world.json file fixes one.
+        if "seed" in self.vars:
+            self.seed = self.vars["seed"]
+        else:
+            if self.__db_key("seed") not in self.app.database:
+                self.app.database[self.__db_key("seed")] = randint(0, 2 ** 32 - 1)
+            self.seed = self.app.database[self.__db_key("seed")]
+
+        # Use the packed room registry, if the world has one.
+        self.registry.load()
+
+        # Add the roomview generators named in the world.json file, as "script.py:function".
+        for prefix, contents in self.vars.get("generators", {}).items():
+            script_file, func = contents.split(':', 1)
+            self.add_generator(prefix, functools.partial(self.app.script.call, script_file, func))
 
         # Done.
+        if not enter:
+            return True
+        self.set_caption()
         return self.change_roomview(self.vars["first_roomview"])
 
     def navigate(self, direction: str) -> bool:
@@ -94,6 +160,10 @@ class World(object):
         :return: True if succeeded, False if failed.
         """
         if direction in self.roomview.exits:
+            # If going backward leads to the roomview we just came from, go back to it as it was.
+            if direction == "backward" and self.history and node_name(self.roomview.exits[direction]) == \
+                    "{0}:{1}".format(self.history[-1]["roomview"].file, self.history[-1]["roomview"].view):
+                return self.back()
             return self.change_roomview(self.roomview.exits[direction])
         self.log.warn("navigate(): Attempt to navigate through non-existent exit: {0}".format(direction))
         return False
@@ -105,6 +175,24 @@ class World(object):
 
         :return: True if succeeded, False if failed.
         """
+        # Load the roomview, and make sure we loaded correctly.
+        roomview = self._load_roomview(room_name)
+        if not roomview:
+            return False
+
+        # Enter the roomview.
+        self.__switch(roomview)
+
+        # Done.
+        return True
+
+    def _load_roomview(self, room_name: str) -> Optional[Roomview]:
+        """Load a roomview by room descriptor filename and optionally included view name, without entering it.
+
+        :param room_name: The room descriptor filename and optionally included view name.
+
+        :return: The Roomview instance if succeeded, None if failed.
+        """
         # If there is a colon in the room name, a particular view is being chosen.
         # Otherwise, load the "default" view.
         if ":" in room_name:
@@ -112,26 +200,188 @@ class World(object):
         else:
             view_name = "default"
 
-        # Temporarily hold the previous roomview in case we need to switch back.
-        backtrack = self.roomview
-
-        # Create a Roomview class instance for this room and view. Load the data.
-        self.roomview = Roomview(self.config, self.app, self, self.resource, room_name, view_name)
-        self.roomview._load()
+        # Reuse the Roomview class instance for this room and view if we visited it recently.
+        # Otherwise, create one and load the data, and keep it for next time if it loaded completely.
+        cache_key = "{0}:{1}".format(room_name, view_name)
+        if cache_key in self.roomview_cache:
+            roomview = self.roomview_cache[cache_key]
+        else:
+            roomview = Roomview(self.config, self.app, self, self.resource, room_name, view_name)
+            if roomview._load():
+                self.roomview_cache[cache_key] = roomview
 
         # Make sure we loaded correctly.
-        if not self.roomview.vars:
-            self.log.error("change_roomview(): Unable to load room and view: {0}:{1}".format(room_name, view_name))
-            self.roomview = backtrack
+        if not roomview.vars:
+            self.log.error("_load_roomview(): Unable to load room and view: {0}:{1}".format(room_name, view_name))
+            return None
+        return roomview
+
+    def back(self, steps: int = 1) -> bool:
+        """Go back to a roomview we left earlier.
+
+        The roomview is swapped back in just as it was when we left it, with the same exits and overlays, without
+        loading anything. The roomviews in between, and the one we are leaving, are dropped from the history.
+
+        :param steps: How many roomviews to go back.
+
+        :return: True if succeeded, False if failed.
+        """
+        if steps < 1 or steps > len(self.history):
+            self.log.warn("back(): Attempt to go back further than the history: {0}".format(steps))
             return False
 
-        # Perform overlay cleanup if necessary.
+        for step in range(steps - 1):
+            self.history.pop()
+        returning = self.history.pop()
+        self.__switch(returning["roomview"], returning)
+        return True
+
+    def __switch(self, roomview: Roomview, returning: dict = None) -> None:
+        """Leave the current roomview and enter another, which has already been loaded.
+
+        :param roomview: The Roomview instance to enter.
+        :param returning: If going back, the history entry of the roomview, to restore its exits and overlays from.
+        """
+        backtrack = self.roomview
+
+        # Enter the roomview, restoring the exits as they were if we are going back to it.
+        self.roomview = roomview
+        if returning:
+            self.roomview.exits = returning["exits"]
+            self.roomview.action_exits = returning["action_exits"]
+        self.roomview._enter(recalculate=not returning)
+
+        # Perform overlay cleanup if necessary, and put back the overlays of a roomview we are going back to.
+        overlays = {}
         if hasattr(self.app, "overlay"):
-            self.app.overlay._cleanup()
+            overlays = self.app.overlay._cleanup()
+            if returning:
+                self.app.overlay._restore(returning["overlays"])
 
-        # Done.
+        # Remember the roomview we left, unless we are going back, so that we can return to it just as it was.
+        if backtrack and not returning:
+            self.history.append({"roomview": backtrack, "exits": backtrack.exits,
+                                 "action_exits": backtrack.action_exits, "overlays": overlays})
+
+        # Let event subscribers know we left the old roomview and entered the new one.
+        if backtrack:
+            self.app.event.publish("roomview_leave", backtrack.file, backtrack)
+        self.app.event.publish("roomview_enter", self.roomview.file, self.roomview)
+
+    def add_generator(self, prefix: str, generator: Callable) -> bool:
+        """Add a roomview generator, which builds room descriptors on demand instead of loading them from files.
+
+        Any room whose name starts with the prefix is built by calling the generator with the rest of the room name
+        and a random.Random instance seeded from the world's seed and the whole room name, such as
+        "generate("12_-3.json", rng)" for the room "backrooms/12_-3.json" with the prefix "backrooms/". It should
+        return a room descriptor just like one from a JSON file, except that the image of a view may also be a PyGame
+        surface composed by the generator. Since the seed only depends on the room name, a room which is dropped from
+        memory is built again just the same when it is visited again.
+
+        Generators may also be added in the world.json file, as "generators": {"backrooms/": "backrooms.py:generate"}.
+
+        :param prefix: The room name prefix to generate rooms for.
+        :param generator: The generator function.
+
+        :return: True if succeeded, False if failed.
+        """
+        if prefix in self.generators:
+            self.log.error("add_generator(): Generator already exists for prefix: {0}".format(prefix))
+            return False
+        self.generators[prefix] = generator
+        self.log.info("add_generator(): Added roomview generator for prefix: {0}".format(prefix))
+        return True
+
+    def remove_generator(self, prefix: str) -> bool:
+        """Remove a roomview generator.
+
+        :param prefix: The room name prefix given to add_generator().
+
+        :return: True if succeeded, False if failed.
+        """
+        if prefix not in self.generators:
+            self.log.warn("remove_generator(): Attempt to remove nonexistent generator: {0}".format(prefix))
+            return False
+        del self.generators[prefix]
+        for room_file in [room_file for room_file in self.generated if room_file.startswith(prefix)]:
+            del self.generated[room_file]
+        self.log.info("remove_generator(): Removed roomview generator for prefix: {0}".format(prefix))
         return True
 
+    def is_generated(self, room_file: str) -> bool:
+        """Check whether a room is built by a roomview generator.
+
+        :param room_file: The room name.
+
+        :return: True if generated, False if loaded from a file.
+        """
+        return self.__generator_prefix(room_file) is not None
+
+    def _generate(self, room_file: str) -> Optional[dict]:
+        """Build a room descriptor with its roomview generator, or get it from the cache if it was built recently.
+
+        :param room_file: The room name.
+
+        :return: The room descriptor if succeeded, None if failed.
+        """
+        if room_file in self.generated:
+            return self.generated[room_file]
+
+        prefix = self.__generator_prefix(room_file)
+        if prefix is None:
+            self.log.error("_generate(): No generator for room: {0}".format(room_file))
+            return None
+
+        # Build the room from the seed and the room name alone, so it always turns out the same.
+        self.log.info("_generate(): Generating room: {0}".format(room_file))
+        try:
+            room = self.generators[prefix](room_file[len(prefix):], Random("{0}:{1}".format(self.seed, room_file)))
+        except:
+            self.log.error("_generate(): Error from generator: {0}: {1}\n{2}".format(
+                prefix, room_file, traceback.format_exc().rstrip()))
+            return None
+
+        # The generator failed, which ScriptManager has already logged if it was called from a script.
+        if not room:
+            self.log.error("_generate(): Generator returned no room descriptor: {0}: {1}".format(prefix, room_file))
+            return None
+
+        # Check the room descriptor against the room schema, as if it were loaded from a file.
+        # Images composed by the generator are surfaces rather than filenames, so they are left out of the check.
+        try:
+            jsonschema.validate({view: dict(room[view], image="") if type(room[view].get("image")) is pygame.Surface
+                                 else room[view] for view in room}, self.resource.load_schema("room"))
+        except (AttributeError, TypeError, jsonschema.exceptions.ValidationError):
+            self.log.error("_generate(): Invalid room descriptor from generator: {0}: {1}\n{2}".format(
+                prefix, room_file, traceback.format_exc(1).rstrip()))
+            return None
+
+        self.generated[room_file] = room
+        return room
+
+    def __generator_prefix(self, room_file: str) -> Optional[str]:
+        """Find the prefix of the roomview generator for a room, preferring the longest if more than one matches.
+
+        :param room_file: The room name.
+
+        :return: The prefix if there is a generator for the room, otherwise None.
+        """
+        matches = [prefix for prefix in self.generators if room_file.startswith(prefix)]
+        if not matches:
+            return None
+        return max(matches, key=len)
+
+    def __db_key(self, key: str) -> str:
+        """Get the database key for one of the world's own values, which is kept apart for each world but the primary.
+
+        :param key: The name of the value, like "funvalue".
+
+        :return: The database key.
+        """
+        if self.primary:
+            return key
+        return "{0}:{1}".format(key, self.dir)
+
     def set_caption(self, caption: [str, None] = None) -> bool:
         """Set the window title/caption.
 
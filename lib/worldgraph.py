@@ -0,0 +1,418 @@
+#######################
+# BXEngine            #
+# worldgraph.py       #
+# Copyright 2021-2023 #
+# Sei Satzparad       #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+import json
+import os
+from array import array
+from collections import deque
+from typing import Iterator, Optional
+
+import ubjson
+
+from lib.logger import Logger
+from lib.roomregistry import REGISTRY_FILENAME, RoomRegistry
+from lib.util import LRUCache, room_files
+
+# The filename of the graph index, which is kept in the world directory.
+GRAPH_FILENAME = "worldgraph.ubj"
+
+# Bump this whenever the layout of the graph index file changes, so that old files are rebuilt.
+GRAPH_VERSION = 1
+
+# The most breadth-first searches whose results are kept at once.
+SEARCH_CACHE_SIZE = 64
+
+# Edge flag for an exit whose presence or destination depends on chance or the funvalue.
+DYNAMIC = 1
+
+
+def node_name(destination: str) -> str:
+    """Turn an exit destination into the name of a graph node, which always includes the view name.
+
+    :param destination: A room descriptor filename, and optionally a colon and view name.
+
+    :return: The node name, as "room:view".
+    """
+    if ":" in destination:
+        return destination
+    return "{0}:default".format(destination)
+
+
+def exit_destinations(thisexit: [str, dict]) -> tuple[list, bool]:
+    """Find every destination an exit could possibly lead to, whatever the funvalue and chance rolls turn out to be.
+
+    :param thisexit: A string or dictionary containing an exit description section from a roomview.
+
+    :return: A tuple of the list of possible destinations, and whether the exit is dynamic.
+    """
+    if type(thisexit) is str:
+        return [thisexit], False
+    if type(thisexit) is not dict or "destination" not in thisexit:
+        return [], False
+    dynamic = "presence" in thisexit
+    destination = thisexit["destination"]
+    if type(destination) is str:
+        return [destination], dynamic
+    if type(destination) is not dict:
+        return [], dynamic
+
+    # The default destination, plus the alternate destination at the end of every selector.
+    destinations = [destination["default"]] if "default" in destination else []
+    for selector in ["chance", "funvalue"]:
+        for constraint in destination.get(selector, []):
+            destinations.append(constraint[-1])
+    return destinations, dynamic or len(destinations) > 1
+
+
+def view_exits(view: dict) -> Iterator[tuple[str, list, bool]]:
+    """Go through every named exit and action exit in a view.
+
+    :param view: The JSON object of a view from a room descriptor.
+
+    :return: An iterator of (label, possible destinations, dynamic) tuples. Named exits are labeled by their name, and
+             action exits by their action type and the index of the action, like "go#2".
+    """
+    for name, thisexit in view.get("exits", {}).items():
+        yield (name,) + exit_destinations(thisexit)
+    for index, action in enumerate(view.get("actions", [])):
+        for act_type in ["go", "look", "use"]:
+            if act_type in action and action[act_type].get("result") == "exit":
+                yield ("{0}#{1}".format(act_type, index),) + exit_destinations(action[act_type]["contents"])
+
+
+class WorldGraph(object):
+    """An index of how the roomviews in a world are connected.
+
+    Every view of every room descriptor is a node, named "room:view", and every named exit and action exit is a
+    labeled edge to each destination it could possibly lead to. Edges of exits that depend on chance or the funvalue
+    are flagged as dynamic, and queries can leave them out.
+
+    The graph is kept in compact integer arrays, in compressed sparse row form: the edges leaving node n are the ones
+    from offsets[n] up to offsets[n + 1] in targets, labels and flags. It is saved into the world directory, and only
+    rebuilt when a room descriptor has changed since. Nothing is scanned until the first query. Like the World, the
+    graph reads each room descriptor from the world's room registry if it is there, and from its own file otherwise.
+
+    Breadth-first search results are cached for each starting node, so repeated queries from the same place are
+    cheap.
+
+    :ivar dir: The directory of the game world.
+    :ivar log: The Logger instance for this class.
+    :ivar registry: The RoomRegistry of packed room descriptors in the world.
+    :ivar nodes: A list of node names, by node number.
+    :ivar index: A dict of node names mapped to node numbers.
+    :ivar labels: A list of edge labels, by label number.
+    :ivar offsets: An array of where the edges of each node start, plus the total number of edges at the end.
+    :ivar targets: An array of the destination node number of each edge.
+    :ivar edge_labels: An array of the label number of each edge.
+    :ivar flags: An array of the flags of each edge.
+    :ivar __reverse: The graph with every edge reversed, as (offsets, sources, flags), built when first needed.
+    :ivar __searches: A cache of breadth-first search results, by starting node, direction and edge filter.
+    """
+    def __init__(self, world_dir: str, registry: RoomRegistry = None):
+        """WorldGraph Class Initializer
+
+        :param world_dir: The directory of the game world.
+        :param registry: The world's RoomRegistry, if it already has one. Otherwise the graph loads its own.
+        """
+        self.dir = world_dir
+        self.log = Logger("WorldGraph")
+        self.registry = registry
+        self.nodes = None
+        self.index = None
+        self.labels = None
+        self.offsets = None
+        self.targets = None
+        self.edge_labels = None
+        self.flags = None
+        self.__reverse = None
+        self.__searches = LRUCache(SEARCH_CACHE_SIZE)
+
+    def __contains__(self, item: str) -> bool:
+        self.__ensure()
+        return node_name(item) in self.index
+
+    def __len__(self) -> int:
+        self.__ensure()
+        return len(self.nodes)
+
+    def load(self) -> bool:
+        """Load the graph index from the world directory, or build and save it if it is missing or out of date.
+
+        :return: True if the saved index was used, False if it was rebuilt.
+        """
+        if self.registry is None:
+            self.registry = RoomRegistry(self.dir)
+            self.registry.load()
+        signature = self.__signature()
+        path = os.path.join(self.dir, GRAPH_FILENAME)
+        try:
+            with open(path, "rb") as f:
+                saved = ubjson.load(f)
+            if saved["version"] == GRAPH_VERSION and saved["signature"] == signature:
+                self.__set(saved["nodes"], saved["labels"], array("i", saved["offsets"]),
+                           array("i", saved["targets"]), array("i", saved["edge_labels"]), array("b", saved["flags"]))
+                self.log.info("load(): Loaded world graph: {0} nodes, {1} edges".format(len(self.nodes),
+                                                                                     len(self.targets)))
+                return True
+        except (OSError, ValueError, KeyError, TypeError, ubjson.DecoderException):
+            pass
+
+        # The saved index is missing, damaged or out of date.
+        self.build()
+        self.save(signature)
+        return False
+
+    def build(self) -> None:
+        """Scan every room descriptor in the world and build the graph from scratch.
+        """
+        nodes, index, labels, label_index = [], {}, [], {}
+        edges = []  # [[(target, label, flags), ...], ...] by node number.
+
+        def node(name: str) -> int:
+            if name not in index:
+                index[name] = len(nodes)
+                nodes.append(name)
+                edges.append([])
+            return index[name]
+
+        for filename in sorted(set(room_files(self.dir)) | set(self.registry)):
+            if filename in self.registry:
+                room = self.registry.get(filename)
+            else:
+                try:
+                    with open(os.path.join(self.dir, filename)) as f:
+                        room = json.load(f)
+                except (OSError, ValueError):
+                    room = None
+            if room is None:
+                self.log.warn("build(): Skipping unreadable room descriptor: {0}".format(filename))
+                continue
+            if type(room) is not dict:
+                continue
+            for view_name, view in room.items():
+                if type(view) is not dict or "image" not in view:
+                    continue
+                source = node("{0}:{1}".format(filename, view_name))
+                for label, destinations, dynamic in view_exits(view):
+                    if label not in label_index:
+                        label_index[label] = len(labels)
+                        labels.append(label)
+                    for destination in destinations:
+                        edges[source].append((node(node_name(destination)), label_index[label],
+                                              DYNAMIC if dynamic else 0))
+
+        # Flatten the edge lists into arrays.
+        offsets, targets, edge_labels, flags = array("i", [0]), array("i"), array("i"), array("b")
+        for node_edges in edges:
+            for target, label, flag in node_edges:
+                targets.append(target)
+                edge_labels.append(label)
+                flags.append(flag)
+            offsets.append(len(targets))
+        self.__set(nodes, labels, offsets, targets, edge_labels, flags)
+        self.log.info("build(): Built world graph: {0} nodes, {1} edges".format(len(self.nodes), len(self.targets)))
+
+    def save(self, signature: list = None) -> bool:
+        """Save the graph index into the world directory.
+
+        :param signature: The signature of the room descriptors the graph was built from, if already known.
+
+        :return: True if succeeded, False if failed.
+        """
+        path = os.path.join(self.dir, GRAPH_FILENAME)
+        try:
+            with open(path, "wb") as f:
+                ubjson.dump({"version": GRAPH_VERSION, "signature": signature or self.__signature(),
+                             "nodes": self.nodes, "labels": self.labels, "offsets": self.offsets.tolist(),
+                             "targets": self.targets.tolist(), "edge_labels": self.edge_labels.tolist(),
+                             "flags": self.flags.tolist()}, f)
+        except OSError:
+            self.log.warn("save(): Could not save world graph: {0}".format(path))
+            return False
+        return True
+
+    def exits(self, room_name: str) -> list:
+        """Get the exits leaving a roomview.
+
+        :param room_name: The room descriptor filename and optionally included view name.
+
+        :return: A list of (label, destination, dynamic) tuples, which is empty if the roomview is unknown.
+        """
+        self.__ensure()
+        node = self.index.get(node_name(room_name))
+        if node is None:
+            return []
+        return [(self.labels[self.edge_labels[edge]], self.nodes[self.targets[edge]], bool(self.flags[edge] & DYNAMIC))
+                for edge in range(self.offsets[node], self.offsets[node + 1])]
+
+    def reachable(self, room_name: str, dynamic: bool = True) -> set:
+        """Get every roomview which can be reached from a roomview.
+
+        :param room_name: The room descriptor filename and optionally included view name to start from.
+        :param dynamic: Whether to count exits that depend on chance or the funvalue.
+
+        :return: A set of node names, including the starting one, or an empty set if the roomview is unknown.
+        """
+        distances = self.__search(room_name, False, dynamic)
+        return {self.nodes[node] for node in distances} if distances else set()
+
+    def reaching(self, room_name: str, dynamic: bool = True) -> set:
+        """Get every roomview from which a roomview can be reached.
+
+        :param room_name: The room descriptor filename and optionally included view name to reach.
+        :param dynamic: Whether to count exits that depend on chance or the funvalue.
+
+        :return: A set of node names, including the given one, or an empty set if the roomview is unknown.
+        """
+        distances = self.__search(room_name, True, dynamic)
+        return {self.nodes[node] for node in distances} if distances else set()
+
+    def distance(self, source: str, destination: str, dynamic: bool = True) -> Optional[int]:
+        """Get the least number of exits it takes to get from one roomview to another.
+
+        :param source: The room descriptor filename and optionally included view name to start from.
+        :param destination: The room descriptor filename and optionally included view name to reach.
+        :param dynamic: Whether to count exits that depend on chance or the funvalue.
+
+        :return: Number of exits if reachable, otherwise None.
+        """
+        distances = self.__search(source, False, dynamic)
+        target = self.index.get(node_name(destination))
+        if not distances or target not in distances:
+            return None
+        return distances[target][0]
+
+    def path(self, source: str, destination: str, dynamic: bool = True) -> Optional[list]:
+        """Get a shortest path from one roomview to another.
+
+        :param source: The room descriptor filename and optionally included view name to start from.
+        :param destination: The room descriptor filename and optionally included view name to reach.
+        :param dynamic: Whether to count exits that depend on chance or the funvalue.
+
+        :return: List of node names from the source to the destination if reachable, otherwise None.
+        """
+        distances = self.__search(source, False, dynamic)
+        node = self.index.get(node_name(destination))
+        if not distances or node not in distances:
+            return None
+        path = []
+        while node is not None:
+            path.append(self.nodes[node])
+            node = distances[node][1]
+        return path[::-1]
+
+    def __ensure(self) -> None:
+        """Load the graph if this hasn't happened yet.
+        """
+        if self.nodes is None:
+            self.load()
+
+    def __set(self, nodes: list, labels: list, offsets: array, targets: array, edge_labels: array,
+              flags: array) -> None:
+        """Replace the graph, and forget everything worked out from the old one.
+        """
+        self.nodes = nodes
+        self.index = {name: number for number, name in enumerate(nodes)}
+        self.labels = labels
+        self.offsets = offsets
+        self.targets = targets
+        self.edge_labels = edge_labels
+        self.flags = flags
+        self.__reverse = None
+        self.__searches.clear()
+
+    def __signature(self) -> list:
+        """Work out a signature of the room descriptors in the world, which changes whenever one of them does.
+
+        The room registry index counts as one of them, since it is saved again whenever the registry changes.
+
+        :return: The number of room descriptors, their total size, and the latest modification time.
+        """
+        count, size, mtime = 0, 0, 0
+        filenames = list(room_files(self.dir))
+        if os.path.exists(os.path.join(self.dir, REGISTRY_FILENAME)):
+            filenames.append(REGISTRY_FILENAME)
+        for filename in filenames:
+            stat = os.stat(os.path.join(self.dir, filename))
+            count += 1
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime_ns)
+        return [count, size, mtime]
+
+    def __reversed(self) -> tuple[array, array, array]:
+        """Get the graph with every edge reversed, building it if needed.
+
+        :return: A tuple of offsets, source node numbers and flags, in the same form as the forward graph.
+        """
+        if self.__reverse is None:
+            counts = [0] * (len(self.nodes) + 1)
+            for target in self.targets:
+                counts[target + 1] += 1
+            for node in range(len(self.nodes)):
+                counts[node + 1] += counts[node]
+            offsets = array("i", counts)
+            sources, flags = array("i", [0] * len(self.targets)), array("b", [0] * len(self.targets))
+            fill = counts[:-1]
+            for node in range(len(self.nodes)):
+                for edge in range(self.offsets[node], self.offsets[node + 1]):
+                    target = self.targets[edge]
+                    sources[fill[target]] = node
+                    flags[fill[target]] = self.flags[edge]
+                    fill[target] += 1
+            self.__reverse = (offsets, sources, flags)
+        return self.__reverse
+
+    def __search(self, room_name: str, reverse: bool, dynamic: bool) -> Optional[dict]:
+        """Run a breadth-first search from a roomview, or get the cached result of an earlier one.
+
+        :param room_name: The room descriptor filename and optionally included view name to start from.
+        :param reverse: Whether to follow edges backwards.
+        :param dynamic: Whether to follow edges of exits that depend on chance or the funvalue.
+
+        :return: A dict of reached node numbers mapped to (distance, previous node number), or None if unknown.
+        """
+        self.__ensure()
+        start = self.index.get(node_name(room_name))
+        if start is None:
+            return None
+        cache_key = (start, reverse, dynamic)
+        if cache_key in self.__searches:
+            return self.__searches[cache_key]
+
+        offsets, targets, flags = self.__reversed() if reverse else (self.offsets, self.targets, self.flags)
+        distances = {start: (0, None)}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            distance = distances[node][0] + 1
+            for edge in range(offsets[node], offsets[node + 1]):
+                target = targets[edge]
+                if target not in distances and (dynamic or not flags[edge] & DYNAMIC):
+                    distances[target] = (distance, node)
+                    queue.append(target)
+        self.__searches[cache_key] = distances
+        return distances
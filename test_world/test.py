@@ -10,8 +10,5 @@ def test_func(a, b):
     print(BXE.resource.load_raw("README.md", rootdir=True))
     rsrc = BXE.resource.load_image("common/arrow_backward.png", rootdir=True)
     overlay = BXE.overlay.insert_overlay(rsrc, (50, 50), (400, 400))
-    BXE.tick.register(delayed_func, 2000, [overlay], False)
-
-
-def delayed_func(overlay):
+    yield BXE.tick.sleep(2000)
     BXE.overlay.rescale_overlay(overlay, (300, 300))
@@ -0,0 +1,69 @@
+#######################
+# BXEngine            #
+# test_tickmanager.py #
+# Copyright 2021-2023 #
+# Sei Satzparad       #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+import sys
+import unittest
+
+from lib import logger
+from lib.tickmanager import TickManager
+
+
+class TestIdleTasks(unittest.TestCase):
+    """Tests for TickManager idle tasks.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        logger.init("critical", use_stdout=False, suppressions=[])
+
+    def test_error_removes_task(self):
+        """An idle task that raises an error is logged and removed, and the engine keeps going.
+        """
+        tick = TickManager()
+        calls = []
+
+        def task():
+            calls.append(True)
+            raise ValueError("broken")
+
+        tick.add_idle_task(task, continuous=True)
+        tick._idle(1000)
+        tick._idle(1000)
+        self.assertEqual(len(calls), 1)
+
+    def test_system_exit_propagates(self):
+        """An idle task that exits the engine, like the DatabaseManager when it can't write, does exit it.
+        """
+        tick = TickManager()
+        tick.add_idle_task(lambda: sys.exit(6), continuous=True)
+        with self.assertRaises(SystemExit) as context:
+            tick._idle(1000)
+        self.assertEqual(context.exception.code, 6)
+
+
+if __name__ == "__main__":
+    unittest.main()